@@ -1,29 +1,51 @@
-import os
-from datetime import datetime
-import json
+from datetime import datetime, timedelta
 import config
+from metrics import METRICS, ENABLED as METRICS_ENABLED, timed
+from pager import Pager
 
 class Admin:
-    def __init__(self, catalog):
+    def __init__(self, catalog, storage):
         self.catalog = catalog
-        self.user_files = config.user_files
-        self.users = self.load_users()
-
-    def load_users(self):
-        if not os.path.isfile(self.user_files):
-            return {}
-        with open(self.user_files, 'r') as f:
-            return json.load(f)
-
-    def save_users(self):
-        with open(self.user_files, 'w') as f:
-            json.dump(self.users, f, indent=4)
+        self.storage = storage
+        self.catalog_store = storage.catalog_store
+        # The same user store (and cached buckets) the Store uses
+        self.user_store = storage.user_store()
+        # Built on the first sales report / stock check (see sales and low_stock below)
+        self.sales_analytics = None
+        self.low_stock_index = None
+        self.rolling_sales = None
+
+    # Built on first use; afterwards every stock change of this process keeps it current
+    @property
+    def low_stock(self):
+        if self.low_stock_index is None:
+            from restock import LowStockIndex, StockThresholds
+            self.low_stock_index = LowStockIndex(self.catalog, StockThresholds())
+        return self.low_stock_index
+
+    # Last few days of sales per size, read once through the time index; afterwards every
+    # checkout and return of this process is added as it is saved
+    @property
+    def recent_sales(self):
+        if self.rolling_sales is None:
+            from restock import RollingSales
+            self.rolling_sales = RollingSales(self.storage.history)
+        return self.rolling_sales
+
+    # Reading the whole purchase history is only worth it once an admin asks for a report;
+    # after that the rollups follow every checkout and return of this process
+    @property
+    def sales(self):
+        if self.sales_analytics is None:
+            from analytics import SalesAnalytics
+            self.sales_analytics = SalesAnalytics(self.storage.history, self.catalog)
+        return self.sales_analytics
 
     # Add Users to the System
     def add_users(self):
         print("\n\033[1;36m----------  Add New Users Page ----------\033[0m")
         username = input("\n\033[1mEnter Username: \033[0m").strip()
-        if username in self.users:
+        if self.user_store.get(username):
             print("\n\033[31m Username already exists!\033[0m\n")
             return
 
@@ -41,38 +63,40 @@ class Admin:
             print("\n\033[31m Invalid Role Selected. Only 'admin' or 'user' Allowed.\033[0m\n")
             return
 
-        self.users[username] = {
+        new_user = {
             "role": role,
             "password": password,
             "registered_date": datetime.now().strftime("%m/%d/%Y %I:%M:%S %p")
         }
-        self.save_users()
+        if not self.user_store.add(username, new_user):
+            print("\n\033[31m Username already exists!\033[0m\n")
+            return
         print(f'\n\033[34m User {username} with "{role}" role has been added successfully!\033[0m\n')
 
+    # Streamed one bucket at a time and shown a page at a time; the whole user base is never held
     def view_registered_users(self):
         print("\n\033[1;36m----------  Registered Users Page ----------\033[0m\n")
 
-        # Reload user data from file to ensure the latest info
-        if os.path.exists(self.user_files):
-            with open(self.user_files, 'r') as f:
-                self.users = json.load(f)
-        else:
-            self.users = {}
-
-        if not self.users:
+        pager = Pager()
+        found = False
+        for users, more in pager.iter_pages(self.user_store.iter_users()):
+            found = True
+            pager.write([
+                f'Username: {username}  |  Role: {details["role"]}  |  Registered Date: {details.get("registered_date", "-")} \n'
+                for username, details in users
+            ])
+            if more and input("\033[1mPress Enter for more, or 'q' to stop: \033[0m").strip().lower() == "q":
+                break
+
+        if not found:
             print("\n\033[31m No Users Found!\033[0m\n")
-            return
-
-        for username, details in self.users.items():
-            reg_date = details.get("registered_date", "-")
-            print(f'Username: {username}  |  Role: {details["role"]}  |  Registered Date: {reg_date} \n')
 
     def add_products(self):
         print("\n\033[1;36m----------  Add New Products ----------\033[0m\n")
         try:
             name = input("\033[1mEnter Product Name: \033[0m")
             # Check for Duplicate Product Names
-            if any(product["name"].lower() == name.lower() for product in self.catalog):
+            if self.catalog.name_exists(name):
                 print("\n\033[31m Product Name already exists!\033[0m")
                 return
 
@@ -85,9 +109,9 @@ class Admin:
                 quantity = int(input(f'\033[1mEnter Product Quantity for size {size}: \033[0m'))
                 size_stock[size] = quantity
 
-            new_id = max([p["id"] for p in self.catalog]) + 1
+            new_id = self.catalog.next_id()
 
-            self.catalog.append({
+            self.catalog.add({
                 "id": new_id,
                 "name": name,
                 "price": price,
@@ -106,13 +130,16 @@ class Admin:
         print("\n\033[1;36m----------  Edit Products ----------\033[0m\n")
         try:
             product_id = int(input("Enter Product ID: "))
-            product = next((p for p in self.catalog if p["id"] == product_id), None)
+            product = self.catalog.get(product_id)
             if not product:
                 print("\n\033[31m Product not found.\033[0m\n")
                 return
 
             print(f'\033[32mEditing {product["name"]}...\n\033[0m')
             name = input(f"\033[1mName ({product['name']}): \033[0m") or product["name"]
+            if name.lower() != product["name"].lower() and self.catalog.name_exists(name):
+                print("\n\033[31m Product Name already exists!\033[0m")
+                return
 
             price_input = input(f"\033[1mPrice ({product["price"]}): \033[0m")
             price = float(price_input) if (price_input) else product["price"]
@@ -131,10 +158,7 @@ class Admin:
                     quantity = input(f"\033[1m Enter Product Quantity for size {size.upper()}: \033[0m")
                 quantity_by_size[size] = int(quantity)
 
-            product['sizes'] = sizes
-            product['stock'] = quantity_by_size
-
-            product.update({"name": name, "price": price, "sizes": sizes, "stock": quantity_by_size})
+            self.catalog.update(product, name=name, price=price, sizes=sizes, stock=quantity_by_size)
             print("\n\033[34m Product Updated Successfully.\033[0m\n")
 
         except ValueError:
@@ -148,14 +172,14 @@ class Admin:
         print("\n\033[1;36m----------  Delete Products ----------\033[0m\n")
         try:
             product_id = int(input("\033[1mEnter Product ID: \033[0m"))
-            indx =next((i for i, product in enumerate(self.catalog) if product["id"] == product_id), None)
-            if indx is None:
+            product = self.catalog.get(product_id)
+            if product is None:
                 print("\n\033[31m Product not found.\033[0m\n")
                 return
 
-            confirm = input(f'\n\033[1mAre you sure you want to delete "{self.catalog[indx]['name']}"? (Y/N): \033[0m'.lower())
+            confirm = input(f'\n\033[1mAre you sure you want to delete "{product['name']}"? (Y/N): \033[0m'.lower())
             if confirm == 'y':
-                removed = self.catalog.pop(indx)
+                removed = self.catalog.remove(product_id)
                 print(f'\n\033[34m" {removed["name"]}" Deleted Successfully.\033[0m\n')
             else:
                 print("\n\033[31mProduct delete Cancelled.\033[0m\n")
@@ -166,43 +190,231 @@ class Admin:
 
         self.save_catalog()
 
+    # Bulk Import from a CSV or JSON Lines file (one catalog save for the whole file)
+    def import_products(self):
+        print("\n\033[1;36m----------  Bulk Import Products ----------\033[0m\n")
+        from bulk import ProductImporter
+
+        path = input("\033[1mEnter file path (.csv or .jsonl): \033[0m").strip()
+        upsert = input("\033[1mUpdate products whose ID already exists? (y/n): \033[0m").strip().lower() == "y"
+        try:
+            report = ProductImporter(self.catalog, self.storage, upsert).import_file(path)
+        except OSError as e:
+            print(f"\n\033[31m Could not read file: {e}\033[0m\n")
+            return
+
+        for line_number, error in report["errors"][:20]:
+            print(f"\033[31m Line {line_number}: {error}\033[0m")
+        if len(report["errors"]) > 20:
+            print(f"\033[31m ... and {len(report['errors']) - 20} more rejected rows\033[0m")
+        print(f"\n\033[34m {report['rows']} rows: {report['added']} added, {report['updated']} updated, {len(report['errors'])} rejected.\033[0m\n")
+
+    # Bulk Export to a CSV or JSON Lines file
+    def export_products(self):
+        print("\n\033[1;36m----------  Export Products ----------\033[0m\n")
+        from bulk import export_products
+
+        path = input("\033[1mEnter file path (.csv or .jsonl): \033[0m").strip()
+        try:
+            count = export_products(self.catalog, path)
+        except OSError as e:
+            print(f"\n\033[31m Could not write file: {e}\033[0m\n")
+            return
+        print(f"\n\033[34m Exported {count} products to {path}.\033[0m\n")
+
     # Catalog Insights - for Admin users
+    @timed
     def view_catalog_insights(self):
         print("\n\033[1;36m----------  Catalog Insights Page ----------\033[0m")
         total_items = len(self.catalog)
 
-        # Calculate total stock units
-        total_stock = sum(
-            sum(item['stock'].values()) if isinstance(item['stock'], dict) else item['stock']
-            for item in self.catalog
-        )
-
-        # Calculate total inventory value = sum of (price * total quantity per product)
-        total_value = sum(
-            item['price'] * (sum(item['stock'].values()) if isinstance(item['stock'], dict) else item['stock'])
-            for item in self.catalog
-        )
+        # Running totals kept up to date by every stock change
+        total_stock = self.catalog.totals.total_units
+        total_value = self.catalog.totals.total_value
 
         print(f'\n\033[1mTotal Products:  {total_items}\033[0m')
         print(f'\033[1mTotal Stock Units: {total_stock}\033[0m')
         print(f'\033[1mTotal Inventory Value: Ұ{total_value:,.2f}\033[0m\n')
 
     # Monitor Stock - for Admin User
+    # Only sizes at or below their threshold are listed (kept by the low-stock index, not a catalog scan)
+    @timed
     def monitor_stock(self):
         print("\n\033[1;36m----------  Monitor Stock Page ----------\033[0m\n")
-        low_stock_threshold = 3
+        from restock import days_until_stockout
 
-        for item in self.catalog:
-            stock = item['stock']
-            if isinstance(stock, dict):
-                total_stock = sum(stock.values())
+        rows = self.low_stock.items()
+        if not rows:
+            print("\033[32m  Every size is above its low-stock threshold.\033[0m")
+            return
+
+        # Recent rate of sale: a lookup in the rolling per-size counts
+        sales = self.recent_sales
+        sales.expire()
+        lines = []
+        for product, size, quantity, threshold in rows:
+            per_day = sales.per_day(product["id"], size)
+            days_left = days_until_stockout(quantity, per_day)
+            if quantity <= 0:
+                forecast = "\033[31m ⚠ Out of Stock!!!\033[0m"
+            elif days_left is None:
+                forecast = f"\033[33m ⚠ Low Stock (no sales in the last {config.forecast_window_days} days)\033[0m"
             else:
-                total_stock = stock
+                forecast = f"\033[31m ⚠ Low Stock!!! ~{days_left:.1f} days left at {per_day:.2f}/day\033[0m"
+            lines.append(f"{product['name']} | Size {size} | Stock {quantity} (threshold {threshold}) →  {forecast}")
+        print("\n".join(lines))
+
+    # Low-stock threshold of one size, or of every size of a product
+    def set_stock_threshold(self):
+        print("\n\033[1;36m----------  Set Low-Stock Threshold ----------\033[0m\n")
+        try:
+            product_id = int(input("\033[1mEnter Product ID: \033[0m"))
+        except ValueError:
+            print("\n\033[31m Invalid ID.\033[0m\n")
+            return
+        product = self.catalog.get(product_id)
+        if product is None:
+            print("\n\033[31m Product not found.\033[0m\n")
+            return
+
+        size = input(f"\033[1mSize ({', '.join(product['sizes'])}; blank for all sizes): \033[0m").strip().upper() or None
+        if size is not None and size not in product["sizes"]:
+            print("\n\033[31m Invalid size selected.\033[0m\n")
+            return
+        threshold_input = input(f"\033[1mThreshold (blank to reset to {config.low_stock_threshold}): \033[0m").strip()
+        if threshold_input and not threshold_input.isdigit():
+            print("\n\033[31m Please enter valid number.\033[0m\n")
+            return
+
+        self.low_stock.set_threshold(product, size, int(threshold_input) if threshold_input else None)
+        print(f'\n\033[34m Low-stock threshold for "{product["name"]}" {size or "(all sizes)"} saved.\033[0m\n')
+
+    # Sales Reports - revenue, best sellers and returns from the purchase history
+    def sales_reports(self):
+        while True:
+            print("\n\033[1;36m----------  Sales Reports ----------\033[0m\n")
+            print("\t1.  Sales Summary")
+            print("\t2.  Top Sellers")
+            print("\t3.  Sales by Size")
+            print("\t4.  Sales by Day")
+            print("\t5.  Return Rates")
+            print("\t6.  Orders Between Dates")
+            print("\t7.  Orders in the Last N Days")
+            print("\t8.  Back to Menu")
+
+            choice = input("\n\033[1m  Enter your choice: \033[0m").strip()
+            if choice == "8":
+                return
+            if choice in ("6", "7"):
+                self.orders_by_date(choice == "7")
+                continue
+            if choice not in ("1", "2", "3", "4", "5"):
+                print("\n\033[31m Invalid Choice. Please try again...\033[0m")
+                continue
+
+            sales = self.sales
+            if choice == "1":
+                summary = sales.summary()
+                print(f'\n\033[1mOrders: {summary["orders"]}\033[0m')
+                print(f'\033[1mUnits Sold: {summary["units_sold"]}  |  Units Returned: {summary["units_returned"]}  |  Return Rate: {summary["return_rate"]:.1%}\033[0m')
+                print(f'\033[1mRevenue: Ұ{summary["revenue"]:,.2f}  |  Refunded: Ұ{summary["refunded"]:,.2f}  |  Net Revenue: Ұ{summary["net_revenue"]:,.2f}\033[0m')
+            elif choice == "2":
+                by = "revenue" if input("\033[1mRank by units or revenue? (u/r): \033[0m").strip().lower() == "r" else "units"
+                self.print_product_rows(sales.top_sellers(by=by), "No sales yet.")
+            elif choice == "3":
+                rows = sales.sales_by_size()
+                print(f"\n\033[1m{'Size':<8} {'Sold':>8} {'Returned':>9} {'Revenue':>16}\033[0m")
+                for row in rows:
+                    print(f"{str(row['size']):<8} {row['units_sold']:>8} {row['units_returned']:>9} {'Ұ' + format(row['revenue'], ',.2f'):>16}")
+                if not rows:
+                    print("\033[31m No sales yet.\033[0m")
+            elif choice == "4":
+                rows = sales.sales_by_day()
+                print(f"\n\033[1m{'Day':<12} {'Sold':>8} {'Returned':>9} {'Net Revenue':>16}\033[0m")
+                for row in rows:
+                    print(f"{row['day']:<12} {row['units_sold']:>8} {row['units_returned']:>9} {'Ұ' + format(row['net_revenue'], ',.2f'):>16}")
+                if not rows:
+                    print("\033[31m No sales yet.\033[0m")
+            else:
+                self.print_product_rows(sales.return_rates(), "No returns yet among products with enough sales.")
+
+    # Orders and returns of every user in a date range, newest first, read through the time index
+    def orders_by_date(self, last_days):
+        try:
+            if last_days:
+                days = int(input("\033[1mNumber of days: \033[0m").strip())
+                end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+                start = end - timedelta(days=max(days, 1))
+            else:
+                start = datetime.strptime(input("\033[1mFrom date (MM/DD/YYYY): \033[0m").strip(), "%m/%d/%Y")
+                end = datetime.strptime(input("\033[1mTo date (MM/DD/YYYY): \033[0m").strip(), "%m/%d/%Y") + timedelta(days=1)
+        except ValueError:
+            print("\n\033[31m Invalid input. Please try again...\033[0m")
+            return
+
+        pager = Pager()
+        found = False
+        records = self.storage.history.iter_between(int(start.timestamp()), int(end.timestamp()), newest_first=True)
+        for page, more in pager.iter_pages(records):
+            found = True
+            lines = []
+            for record in page:
+                # Amount actually charged (or refunded) where the record has it, else the catalog price
+                total = sum(item["total_cents"] / 100 if "total_cents" in item else item["price"] * item["quantity"] for item in record["items"])
+                units = sum(item["quantity"] for item in record["items"])
+                label = record.get("type", "purchase").capitalize()
+                lines.append(f"{record['timestamp']}  |  {label:<8} |  {record.get('username') or '-':<16} |  {units:>3} items  |  Ұ{total:,.2f}")
+            pager.write(lines)
+
+            if more and input("\033[1mPress Enter for more, or 'q' to stop: \033[0m").strip().lower() == "q":
+                break
+
+        if not found:
+            print("\033[31m No orders in that period.\033[0m")
+
+    def print_product_rows(self, rows, not_found_message):
+        print(f"\n\033[1m{'ID':>6}  {'Product':<32} {'Sold':>7} {'Returned':>9} {'Rate':>7} {'Net Revenue':>16}\033[0m")
+        for row in rows:
+            print(f"{row['product_id']:>6}  {row['name'][:32]:<32} {row['units_sold']:>7} {row['units_returned']:>9} {row['return_rate']:>7.1%} {'Ұ' + format(row['net_revenue'], ',.2f'):>16}")
+        if not rows:
+            print(f"\033[31m {not_found_message}\033[0m")
+
+    # Performance Metrics - call latencies and data file I/O since start-up
+    def view_metrics(self):
+        print("\n\033[1;36m----------  Performance Metrics Page ----------\033[0m\n")
+        if not METRICS_ENABLED:
+            print("\033[31m Instrumentation is disabled (set metrics_enabled = True in config.py).\033[0m")
+            return
 
-            status = "\033[31m ⚠ Low Stock!!!\033[0m" if total_stock <= low_stock_threshold else "\033[32m  Enough Stock Available\033[0m"
-            print(f"{item['name']} | Total Stock {total_stock} →  {status}")
+        report = METRICS.to_dict()
+        lines = [
+            f"\033[1m{'Operation':<38} {'Calls':>7} {'Total s':>9} {'Mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}\033[0m",
+            "-" * 92
+        ]
+        for name, stats in report["operations"].items():
+            if stats["calls"]:
+                lines.append(f"{name:<38} {stats['calls']:>7} {stats['total_seconds']:>9.3f} {stats['mean_ms']:>9.3f} {stats['p50_ms']:>8.3f} {stats['p95_ms']:>8.3f} {stats['p99_ms']:>8.3f}")
+
+        lines += [
+            "",
+            f"\033[1m{'File':<50} {'Read':>14} {'Written':>14}\033[0m",
+            "-" * 80
+        ]
+        for path, counts in report["files"].items():
+            lines.append(f"{path:<50} {counts['bytes_read']:>14,} {counts['bytes_written']:>14,}")
+        print("\n".join(lines))
+
+        export_file = input(f"\n\033[1mExport to file (blank to skip, '.' for {config.metrics_export_file}): \033[0m").strip()
+        if export_file:
+            if export_file == ".":
+                export_file = config.metrics_export_file
+            try:
+                METRICS.export(export_file)
+                print(f"\n\033[34m Metrics exported to {export_file}.\033[0m")
+            except OSError as e:
+                print(f"\n\033[31m Could not export metrics: {e}\033[0m")
 
     # Save Catalog
+    @timed
     def save_catalog(self):
-        with open(config.catalog_file, "w") as f:
-            json.dump(self.catalog, f, indent=4)
\ No newline at end of file
+        self.catalog_store.save()
\ No newline at end of file
@@ -0,0 +1,274 @@
+import argparse
+import heapq
+import json
+import time
+from array import array
+from datetime import datetime, timezone
+
+try:
+    import numpy
+except ImportError:
+    # Optional: without NumPy the same group-bys run as one pass of dictionary updates
+    numpy = None
+
+import config
+from history import HistoryListener, epoch_of
+from metrics import timed
+
+PURCHASE = 0
+RETURN = 1
+DAY_SECONDS = 86400
+
+# Rollup entry layout: [units sold, revenue, units returned, refunded]
+UNITS, REVENUE, RETURNED, REFUNDED = range(4)
+
+# Local calendar day of an epoch: (epoch + UTC_OFFSET) // DAY_SECONDS (offset taken at start-up)
+UTC_OFFSET = time.localtime().tm_gmtoff
+
+
+def day_label(day):
+    return datetime.fromtimestamp(day * DAY_SECONDS, timezone.utc).strftime("%m/%d/%Y")
+
+
+def entry(rollup, key):
+    totals = rollup.get(key)
+    if totals is None:
+        totals = rollup[key] = [0, 0.0, 0, 0.0]
+    return totals
+
+
+def add_line(totals, kind, quantity, amount):
+    if kind == PURCHASE:
+        totals[UNITS] += quantity
+        totals[REVENUE] += amount
+    else:
+        totals[RETURNED] += quantity
+        totals[REFUNDED] += amount
+
+
+# One row per history item line, held column by column in compact arrays
+class SalesColumns:
+
+    FIELDS = (("product", "q"), ("size", "l"), ("quantity", "q"), ("price", "d"), ("timestamp", "q"), ("kind", "b"))
+
+    def __init__(self):
+        for name, typecode in self.FIELDS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.product)
+
+    def append(self, product, size, quantity, price, timestamp, kind):
+        self.product.append(product)
+        self.size.append(size)
+        self.quantity.append(quantity)
+        self.price.append(price)
+        self.timestamp.append(timestamp)
+        self.kind.append(kind)
+
+    # Zero-copy NumPy view of one column; only used inside a query so the array can keep growing
+    def view(self, name):
+        column = getattr(self, name)
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+
+# Sales, returns and revenue by product, size and day, built from the purchase history
+# and kept current as checkouts and returns are appended to it
+class SalesAnalytics(HistoryListener):
+
+    def __init__(self, history, catalog=None):
+        self.history = history
+        # ProductCatalog used for current product names (and to place old lines without a product ID)
+        self.catalog = catalog
+        self.columns = SalesColumns()
+        # Size label <-> small integer code stored in the size column
+        self.sizes = []
+        self.size_codes = {}
+        # Product ID -> name as last seen in history; old lines of unknown products get negative IDs
+        self.names = {}
+        self.unknown_ids = {}
+        self.orders = 0
+
+        self.by_product = {}
+        self.by_size = {}
+        self.by_day = {}
+        self.totals = [0, 0.0, 0, 0.0]
+
+        self.load()
+        history.subscribe(self)
+
+    @property
+    def vectorized(self):
+        return numpy is not None
+
+    @timed
+    def load(self):
+        for record in self.history.iter_records():
+            self.add_record(record, self.columns.append)
+        self.build_rollups()
+
+    def size_code(self, size):
+        code = self.size_codes.get(size)
+        if code is None:
+            code = self.size_codes[size] = len(self.sizes)
+            self.sizes.append(size)
+        return code
+
+    def product_key(self, item):
+        product_id = item.get("product_id")
+        if product_id is None:
+            product = self.catalog.find_by_name(item["name"]) if self.catalog is not None else None
+            if product is not None:
+                product_id = product["id"]
+            else:
+                product_id = self.unknown_ids.setdefault(item["name"], -1 - len(self.unknown_ids))
+        self.names[product_id] = item["name"]
+        return product_id
+
+    # Turn one history record into column rows, passed to add_row one line at a time
+    def add_record(self, record, add_row):
+        kind = RETURN if record.get("type") == "return" else PURCHASE
+        if kind == PURCHASE:
+            self.orders += 1
+        timestamp = epoch_of(record)
+        for item in record["items"]:
+            # Priced records carry what was actually paid; older ones only the catalog price
+            price = item["total_cents"] / 100 / item["quantity"] if item.get("total_cents") is not None and item["quantity"] else item["price"]
+            add_row(self.product_key(item), self.size_code(item.get("size")), item["quantity"], price, timestamp, kind)
+
+    # Totals by product, size and day in one group-by per key over the whole history
+    @timed
+    def build_rollups(self):
+        columns = self.columns
+        if self.vectorized and len(columns):
+            kind = columns.view("kind")
+            quantity = columns.view("quantity")
+            amount = quantity * columns.view("price")
+            purchased = kind == PURCHASE
+            weights = (
+                numpy.where(purchased, quantity, 0),
+                numpy.where(purchased, amount, 0.0),
+                numpy.where(purchased, 0, quantity),
+                numpy.where(purchased, 0.0, amount)
+            )
+            self.by_product = self.group_sums(columns.view("product"), weights)
+            self.by_size = self.group_sums(columns.view("size"), weights)
+            self.by_day = self.group_sums((columns.view("timestamp") + UTC_OFFSET) // DAY_SECONDS, weights)
+            self.totals = [int(weights[UNITS].sum()), float(weights[REVENUE].sum()), int(weights[RETURNED].sum()), float(weights[REFUNDED].sum())]
+            return
+
+        self.by_product, self.by_size, self.by_day = {}, {}, {}
+        self.totals = [0, 0.0, 0, 0.0]
+        for row in zip(columns.product, columns.size, columns.quantity, columns.price, columns.timestamp, columns.kind):
+            self.add_to_rollups(*row)
+
+    @staticmethod
+    def group_sums(keys, weights):
+        unique, inverse = numpy.unique(keys, return_inverse=True)
+        sums = [numpy.bincount(inverse, weights=weight, minlength=len(unique)).tolist() for weight in weights]
+        return {
+            key: [int(units), revenue, int(returned), refunded]
+            for key, units, revenue, returned, refunded in zip(unique.tolist(), *sums)
+        }
+
+    def add_to_rollups(self, product, size, quantity, price, timestamp, kind):
+        amount = quantity * price
+        add_line(entry(self.by_product, product), kind, quantity, amount)
+        add_line(entry(self.by_size, size), kind, quantity, amount)
+        add_line(entry(self.by_day, (timestamp + UTC_OFFSET) // DAY_SECONDS), kind, quantity, amount)
+        add_line(self.totals, kind, quantity, amount)
+
+    # Checkouts and returns: append the new lines and add them to the rollups (no rebuild)
+    def records_added(self, records):
+        def add_row(*row):
+            self.columns.append(*row)
+            self.add_to_rollups(*row)
+
+        for record in records:
+            self.add_record(record, add_row)
+
+    # Reports
+    def product_name(self, product_id):
+        product = self.catalog.get(product_id) if self.catalog is not None else None
+        return product["name"] if product is not None else self.names.get(product_id, f"#{product_id}")
+
+    def summary(self):
+        units, revenue, returned, refunded = self.totals
+        return {
+            "orders": self.orders,
+            "lines": len(self.columns),
+            "units_sold": units,
+            "revenue": revenue,
+            "units_returned": returned,
+            "refunded": refunded,
+            "net_revenue": revenue - refunded,
+            "return_rate": returned / units if units else 0.0
+        }
+
+    # Best sellers by units kept (sold minus returned) or by net revenue
+    def top_sellers(self, count=None, by="units"):
+        if by == "revenue":
+            score = lambda entry: entry[1][REVENUE] - entry[1][REFUNDED]
+        else:
+            score = lambda entry: entry[1][UNITS] - entry[1][RETURNED]
+        best = heapq.nlargest(count or config.top_sellers_count, self.by_product.items(), key=score)
+        return [self.product_row(product_id, totals) for product_id, totals in best]
+
+    def product_row(self, product_id, totals):
+        units, revenue, returned, refunded = totals
+        return {
+            "product_id": product_id,
+            "name": self.product_name(product_id),
+            "units_sold": units,
+            "revenue": revenue,
+            "units_returned": returned,
+            "net_revenue": revenue - refunded,
+            "return_rate": returned / units if units else 0.0
+        }
+
+    def sales_by_size(self):
+        rows = [
+            {"size": self.sizes[code], "units_sold": totals[UNITS], "revenue": totals[REVENUE], "units_returned": totals[RETURNED]}
+            for code, totals in self.by_size.items()
+        ]
+        return sorted(rows, key=lambda row: -row["units_sold"])
+
+    # The most recent days with any sales or returns, oldest first
+    def sales_by_day(self, days=None):
+        recent = heapq.nlargest(days or config.sales_report_days, self.by_day)
+        return [
+            {"day": day_label(day), "units_sold": self.by_day[day][UNITS], "revenue": self.by_day[day][REVENUE],
+             "units_returned": self.by_day[day][RETURNED], "net_revenue": self.by_day[day][REVENUE] - self.by_day[day][REFUNDED]}
+            for day in sorted(recent)
+        ]
+
+    # Highest return rates among returned products that sold at least min_units
+    def return_rates(self, count=None, min_units=5):
+        candidates = [(product_id, totals) for product_id, totals in self.by_product.items() if totals[RETURNED] and totals[UNITS] >= min_units]
+        worst = heapq.nlargest(count or config.top_sellers_count, candidates, key=lambda entry: entry[1][RETURNED] / entry[1][UNITS])
+        return [self.product_row(product_id, totals) for product_id, totals in worst]
+
+
+if __name__ == "__main__":
+    from storage import open_storage
+    from catalog import Catalog
+
+    parser = argparse.ArgumentParser(description="Sales report over the purchase history.")
+    parser.add_argument("--top", type=int, default=None, help="Number of products in the rankings")
+    parser.add_argument("--days", type=int, default=None, help="Number of recent days in the daily report")
+    args = parser.parse_args()
+
+    catalog = Catalog(None, open_storage())
+    started = time.perf_counter()
+    analytics = SalesAnalytics(catalog.purchase_history, catalog.catalog)
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "engine": "numpy" if analytics.vectorized else "python",
+        "load_seconds": round(elapsed, 3),
+        "summary": analytics.summary(),
+        "top_sellers": analytics.top_sellers(args.top),
+        "by_size": analytics.sales_by_size(),
+        "by_day": analytics.sales_by_day(args.days),
+        "return_rates": analytics.return_rates(args.top)
+    }, indent=4))
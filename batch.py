@@ -0,0 +1,123 @@
+import argparse
+import json
+import time
+
+import config
+from catalog import Catalog
+
+
+class BatchOrderProcessor:
+
+    def __init__(self, catalog):
+        # A Catalog instance; its stock rules and cart handling are reused unchanged
+        self.catalog = catalog
+
+    # Build a cart from one order request, or return the reason it is rejected
+    def build_cart(self, request):
+        items = request.get("items")
+        if not isinstance(items, list) or not items:
+            return None, "Order has no items."
+
+        cart = {}
+        for line in items:
+            try:
+                product_id = int(line["id"])
+                size = str(line["size"]).strip().upper()
+                quantity = int(line["quantity"])
+            except (KeyError, TypeError, ValueError):
+                return None, f"Invalid order line: {line}"
+            if quantity < 1:
+                return None, f"Invalid quantity in order line: {line}"
+
+            product = self.catalog.catalog.get(product_id)
+            if not product:
+                return None, f"No product found for ID {product_id}."
+
+            error = self.catalog.size_error(product, size)
+            if error:
+                return None, error
+            # Two lines for the same product and size add up (add_cart_line replaces the line)
+            if (product_id, size) in cart:
+                quantity += cart[(product_id, size)]['quantity']
+            self.catalog.add_cart_line(cart, product, size, quantity)
+
+        # Validate the final cart quantities against current stock
+        for cart_item in cart.values():
+            error = self.catalog.quantity_error(cart_item['product'], cart_item['size'], cart_item['quantity'])
+            if error:
+                return None, f"{cart_item['product']['name']} ({cart_item['size']}): {error}"
+        return cart, None
+
+    # Process order requests (an iterable of JSON lines); stock and history are saved once
+    def process(self, lines):
+        outcomes = []
+        entries = []
+        started = time.perf_counter()
+
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                outcomes.append({"line": line_number, "request_id": None, "status": "rejected", "reason": "Invalid JSON."})
+                continue
+
+            request_id = request.get("request_id") if isinstance(request, dict) else None
+            cart, reason = self.build_cart(request) if isinstance(request, dict) else (None, "Order must be a JSON object.")
+            if cart is not None:
+                # Same path as an interactive checkout: priced, then locked, checked and deducted
+                record = self.catalog.build_purchase_record(cart, request.get("username"))
+                reason = self.catalog.orders.deduct(f"batch-{line_number}", cart)
+            if cart is None or reason:
+                outcomes.append({"line": line_number, "request_id": request_id, "status": "rejected", "reason": reason})
+                continue
+
+            outcome = {"line": line_number, "request_id": request_id, "status": "accepted", "reason": None}
+            outcomes.append(outcome)
+            entries.append({"cart": cart, "record": record, "error": None, "outcome": outcome})
+
+        # One save; orders other sessions sold the stock for in the meantime are rolled back
+        if entries:
+            self.catalog.orders.persist_all(entries)
+            for entry in entries:
+                if entry["error"]:
+                    entry["outcome"].update(status="rejected", reason=entry["error"])
+        accepted = sum(1 for outcome in outcomes if outcome["status"] == "accepted")
+
+        elapsed = time.perf_counter() - started
+        summary = {
+            "orders": len(outcomes),
+            "accepted": accepted,
+            "rejected": len(outcomes) - accepted,
+            "seconds": round(elapsed, 6),
+            "orders_per_second": round(len(outcomes) / elapsed, 2) if elapsed > 0 else None
+        }
+        return outcomes, summary
+
+    def process_file(self, order_file):
+        with open(order_file, 'r') as f:
+            return self.process(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process a JSON Lines file of orders without the interactive menus.")
+    parser.add_argument("order_file", nargs="?", default=config.order_batch_file)
+    parser.add_argument("--report", help="Write per-order outcomes to this JSON Lines file")
+    args = parser.parse_args()
+
+    processor = BatchOrderProcessor(Catalog(None))
+    outcomes, summary = processor.process_file(args.order_file)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            for outcome in outcomes:
+                f.write(json.dumps(outcome) + "\n")
+    else:
+        for outcome in outcomes:
+            if outcome["status"] == "rejected":
+                print(f"Line {outcome['line']} ({outcome['request_id']}): {outcome['reason']}")
+
+    print(json.dumps(summary))
@@ -0,0 +1,329 @@
+import argparse
+import builtins
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+
+import config
+from history import ShardedPurchaseHistory, timestamp_fields
+from menu import ScriptedInput
+from persistence import CatalogFile
+
+# Varied size sets: letter sizes, waist sizes, shoe sizes and one-size items
+SIZE_SETS = (
+    ("S", "M", "L"),
+    ("XS", "S", "M", "L", "XL"),
+    ("M", "L", "XL", "XXL"),
+    ("28", "30", "32", "34", "36"),
+    ("6", "7", "8", "9", "10", "11"),
+    ("FREE",),
+)
+COLOURS = ("Red", "Blue", "Black", "White", "Green", "Sakura", "Grey", "Navy")
+GARMENTS = ("T-Shirt", "Jeans", "Jacket", "Dress", "Skirt", "Hoodie", "Blazer", "Sweater", "Shorts", "Coat", "Kimono", "Scarf")
+
+BENCH_USER = "bench"
+
+
+# Synthetic products in the catalog.json product format
+def generate_products(count, seed=0):
+    rng = random.Random(seed)
+    for product_id in range(1, count + 1):
+        sizes = rng.choice(SIZE_SETS)
+        yield {
+            "id": product_id,
+            "name": f"{rng.choice(COLOURS)} {rng.choice(GARMENTS)} {product_id}",
+            "price": round(rng.uniform(500, 20000), 2),
+            "sizes": list(sizes),
+            "stock": {size: rng.randint(0, 50) for size in sizes}
+        }
+
+
+# Synthetic purchase records (the checkout format) until the given number of item lines is reached
+def generate_history(products, lines, usernames, seed=0):
+    rng = random.Random(seed)
+    timestamp = datetime(2020, 1, 1)
+    written = 0
+    while written < lines:
+        items = []
+        for line_id in range(1, min(rng.randint(1, 4), lines - written) + 1):
+            product = rng.choice(products)
+            items.append({
+                "line_id": line_id,
+                "product_id": product["id"],
+                "name": product["name"],
+                "price": product["price"],
+                "quantity": rng.randint(1, 3),
+                "size": rng.choice(product["sizes"])
+            })
+        written += len(items)
+        timestamp += timedelta(seconds=rng.randint(1, 600))
+        yield {
+            "order_id": f"{rng.getrandbits(128):032x}",
+            "username": rng.choice(usernames),
+            **timestamp_fields(int(timestamp.timestamp())),
+            "type": "purchase",
+            "items": items
+        }
+
+
+# Synthetic promotions touching about a tenth of the products, plus two cart-total tiers
+def generate_promotions(products, seed=0):
+    rng = random.Random(seed)
+    rules = []
+    for product in rng.sample(products, max(1, len(products) // 10)):
+        kind = rng.choice(("price", "percent_off", "buy_x_get_y"))
+        rule = {"type": kind, "product_id": product["id"]}
+        if kind != "buy_x_get_y" and rng.random() < 0.5:
+            rule["size"] = rng.choice(product["sizes"])
+        if kind == "price":
+            rule["price"] = round(product["price"] * rng.uniform(0.8, 1.2), 2)
+        elif kind == "percent_off":
+            rule["percent"] = rng.choice((5, 10, 12.5, 20, 30))
+        else:
+            rule.update(buy=rng.randint(1, 3), get=1)
+        rules.append(rule)
+    rules.append({"type": "cart_threshold", "min_total": 50000, "percent": 5, "name": "5% off orders over 50,000"})
+    rules.append({"type": "cart_threshold", "min_total": 200000, "percent": 10, "name": "10% off orders over 200,000"})
+    return rules
+
+
+# Point every data file at the given directory (relative names, like the defaults)
+@contextmanager
+def use_directory(directory):
+    names = ("catalog_file", "user_files", "user_bucket_dir", "promotions_file", "purchase_history_file", "purchase_log_file", "purchase_history_dir", "sqlite_file", "storage_backend")
+    saved = {name: getattr(config, name) for name in names}
+    cwd = os.getcwd()
+    os.chdir(directory)
+    config.catalog_file = "catalog.json"
+    config.user_files = "users.json"
+    config.user_bucket_dir = "users"
+    config.promotions_file = "promotions.json"
+    config.purchase_history_file = "purchase_history.json"
+    config.purchase_log_file = "purchase_history.jsonl"
+    config.purchase_history_dir = "purchase_history"
+    config.sqlite_file = "store.db"
+    config.storage_backend = "json"
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+# Write a synthetic catalog and history into the directory, in the files the store reads
+def generate_dataset(directory, products, history_lines, users=100, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    with use_directory(directory):
+        catalog = list(generate_products(products, seed))
+        CatalogFile(config.catalog_file).create(catalog)
+        with open(config.promotions_file, 'w') as f:
+            json.dump(generate_promotions(catalog, seed), f, indent=4)
+
+        usernames = [BENCH_USER] + [f"user{n}" for n in range(1, users)]
+        history = ShardedPurchaseHistory()
+        batch = []
+        for record in generate_history(catalog, history_lines, usernames, seed):
+            batch.append(record)
+            if len(batch) >= 10000:
+                history.extend(batch)
+                batch = []
+        history.extend(batch)
+
+
+class Benchmarks:
+
+    def __init__(self, store, seed=0):
+        self.store = store
+        self.catalog = store.catalog
+        self.admin = store.admin
+        self.rng = random.Random(seed)
+        self.input = ScriptedInput()
+
+    def in_stock_line(self):
+        while True:
+            product = self.catalog.catalog.get(self.rng.randint(1, self.catalog.catalog.max_id))
+            if product is None:
+                continue
+            sizes = [size for size, quantity in product["stock"].items() if quantity > 0]
+            if sizes:
+                return product, self.rng.choice(sizes)
+
+    # Each case returns (setup, run); only run() is timed
+    def search_product(self):
+        keyword = self.rng.choice(GARMENTS + COLOURS).lower()[:self.rng.randint(2, 5)]
+        return lambda: self.input.feed(keyword), self.catalog.search_product
+
+    def filter_products(self):
+        low = self.rng.randint(500, 15000)
+        size = self.rng.choice(self.rng.choice(SIZE_SETS))
+        return lambda: self.input.feed("3", str(low), str(low + 2000), size, "y", "4"), self.catalog.filter_products
+
+    def add_to_cart(self):
+        product, size = self.in_stock_line()
+
+        def setup():
+            self.store.cart.clear()
+            self.input.feed(str(product["id"]), size, "1")
+        return setup, self.catalog.add_to_cart
+
+    def checkout(self):
+        def setup():
+            self.store.cart.clear()
+            for _ in range(3):
+                product, size = self.in_stock_line()
+                self.catalog.add_cart_line(self.store.cart, product, size, 1)
+        return setup, self.catalog.checkout
+
+    def return_items(self):
+        return lambda: self.input.feed("0", "1"), self.catalog.return_items
+
+    # Pricing alone, for a large cart (one line per product up to CART_LINES)
+    def price_large_cart(self):
+        cart = {}
+        for product in self.catalog.catalog:
+            self.catalog.add_cart_line(cart, product, product["sizes"][0], self.rng.randint(1, 5))
+            if len(cart) >= self.CART_LINES:
+                break
+        return None, lambda: self.catalog.pricing.price_cart(cart)
+
+    def view_catalog_insights(self):
+        return None, self.admin.view_catalog_insights
+
+    def monitor_stock(self):
+        return None, self.admin.monitor_stock
+
+    CASES = ("search_product", "filter_products", "add_to_cart", "checkout", "return_items", "price_large_cart", "view_catalog_insights", "monitor_stock")
+    CART_LINES = 1000
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        "runs": len(timings),
+        "min": timings[0],
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "max": timings[-1]
+    }
+
+
+# Run every benchmark against the dataset in directory; returns the JSON-ready report
+def run_benchmarks(directory, repeat=20, cases=None, seed=0):
+    from store import Store
+
+    results = {}
+    real_input = builtins.input
+    with use_directory(directory), open(os.devnull, 'w') as sink, redirect_stdout(sink):
+        started = time.perf_counter()
+        store = Store()
+        results["startup"] = summarize([time.perf_counter() - started])
+        store.current_user = {"username": BENCH_USER, "role": "user"}
+
+        benchmarks = Benchmarks(store, seed)
+        builtins.input = benchmarks.input
+        try:
+            for name in cases or Benchmarks.CASES:
+                timings = []
+                for _ in range(repeat):
+                    setup, run = getattr(benchmarks, name)()
+                    if setup:
+                        setup()
+                    started = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - started)
+                results[name] = summarize(timings)
+        finally:
+            builtins.input = real_input
+
+        products = len(store.catalog.catalog)
+        history_records = len(store.catalog.purchase_history)
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "products": products,
+        "history_records": history_records,
+        "repeat": repeat,
+        "unit": "seconds",
+        "results": results
+    }
+
+
+# Median ratios new/base per benchmark; names slower than the tolerance are regressions
+def compare_reports(base, new, tolerance=0.10):
+    rows = []
+    for name, stats in new["results"].items():
+        if name in base["results"] and base["results"][name]["median"] > 0:
+            ratio = stats["median"] / base["results"][name]["median"]
+            rows.append((name, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic data generator and benchmarks for the store's hot paths.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Write a synthetic catalog and purchase history")
+    generate.add_argument("directory")
+
+    run = commands.add_parser("run", help="Run the benchmarks and print a JSON report")
+    run.add_argument("--directory", help="Run on a copy of an existing dataset (default: generate one in a temporary folder)")
+    run.add_argument("--repeat", type=int, default=20)
+    run.add_argument("--case", action="append", choices=Benchmarks.CASES, help="Only run these benchmarks")
+    run.add_argument("--output", help="Write the report to this file")
+
+    for command in (generate, run):
+        command.add_argument("--products", type=int, default=10000)
+        command.add_argument("--history-lines", type=int, default=100000)
+        command.add_argument("--users", type=int, default=100)
+        command.add_argument("--seed", type=int, default=0)
+
+    compare = commands.add_parser("compare", help="Compare two reports; exit status 1 on a regression")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--tolerance", type=float, default=0.10)
+
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_dataset(args.directory, args.products, args.history_lines, args.users, args.seed)
+        print(f"Wrote {args.products} products and {args.history_lines} history lines to {args.directory}")
+
+    elif args.command == "run":
+        # Checkouts and returns change the data, so every run works on a fresh copy
+        with tempfile.TemporaryDirectory() as directory:
+            if args.directory:
+                shutil.copytree(args.directory, directory, dirs_exist_ok=True)
+            else:
+                generate_dataset(directory, args.products, args.history_lines, args.users, args.seed)
+            report = run_benchmarks(directory, args.repeat, args.case, args.seed)
+
+        text = json.dumps(report, indent=4)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+        print(text)
+
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+
+        regressions = 0
+        for name, ratio, regressed in compare_reports(base, new, args.tolerance):
+            regressions += regressed
+            marker = "\033[31m regression\033[0m" if regressed else ""
+            print(f"{name:<24} {ratio:>6.2f}x{marker}")
+        sys.exit(1 if regressions else 0)
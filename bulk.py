@@ -0,0 +1,233 @@
+import argparse
+import csv
+import json
+import math
+import os
+import re
+
+import config
+from catalog import Catalog
+
+# CSV layout (one product per row); sizes "S|M|L", stock "S:3|M:4|L:3":
+#   id,name,price,sizes,stock
+# JSON Lines: one product per line in the catalog.json product format.
+CSV_FIELDS = ("id", "name", "price", "sizes", "stock")
+
+SIZE_SEPARATORS = re.compile(r"[|;,]")
+
+
+def file_format(path, file_format=None):
+    if file_format:
+        return file_format
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+# Stream rows as (line number, dict or None when the line is not valid JSON)
+def read_rows(path, row_format=None):
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        if file_format(path, row_format) == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else None
+
+
+def parse_sizes(value):
+    if value in (None, ""):
+        return []
+    if isinstance(value, str):
+        value = SIZE_SEPARATORS.split(value)
+    return [str(size).strip().upper() for size in value if str(size).strip()]
+
+
+def parse_stock(value):
+    if value in (None, ""):
+        return {}
+    if isinstance(value, str):
+        pairs = []
+        for part in SIZE_SEPARATORS.split(value):
+            part = part.strip()
+            if not part:
+                continue
+            size, separator, quantity = part.replace("=", ":").partition(":")
+            if not separator:
+                raise ValueError(f"Stock entry '{part}' must look like SIZE:QUANTITY")
+            pairs.append((size, quantity))
+    elif isinstance(value, dict):
+        pairs = value.items()
+    else:
+        raise ValueError("Stock must map sizes to quantities")
+
+    stock = {}
+    for size, quantity in pairs:
+        try:
+            quantity = int(str(quantity).strip())
+        except ValueError:
+            raise ValueError(f"Quantity for size {size} must be a whole number")
+        if quantity < 0:
+            raise ValueError(f"Quantity for size {size} cannot be negative")
+        if quantity > config.max_stock_quantity:
+            raise ValueError(f"Quantity for size {size} cannot be more than {config.max_stock_quantity:,}")
+        stock[str(size).strip().upper()] = quantity
+    return stock
+
+
+def parse_price(value):
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Price '{value}' is not a number")
+    if not math.isfinite(price):
+        raise ValueError(f"Price '{value}' is not a finite number")
+    if price < 0:
+        raise ValueError("Price cannot be negative")
+    return price
+
+
+class ProductImporter:
+
+    def __init__(self, products, storage, upsert=False):
+        # The ProductCatalog (rows are checked and applied through its ID and name indexes)
+        self.products = products
+        self.storage = storage
+        # Rows whose ID already exists update that product instead of being rejected
+        self.upsert = upsert
+
+    # Add or update one product from a row; returns "added" / "updated" or raises ValueError
+    def apply_row(self, row):
+        product_id = row.get("id")
+        product_id = int(product_id) if product_id not in (None, "") else None
+        existing = self.products.get(product_id) if product_id is not None else None
+
+        if existing is not None:
+            if not self.upsert:
+                raise ValueError(f"Product ID {product_id} already exists (use upsert to update it)")
+            return self.update_product(existing, row)
+        return self.add_product(product_id, row)
+
+    def add_product(self, product_id, row):
+        name = str(row.get("name") or "").strip()
+        if not name:
+            raise ValueError("Product name is required")
+        if self.products.name_exists(name):
+            raise ValueError(f'Product Name "{name}" already exists')
+        if row.get("price") in (None, ""):
+            raise ValueError("Price is required")
+
+        price = parse_price(row["price"])
+        stock = parse_stock(row.get("stock"))
+        sizes = parse_sizes(row.get("sizes")) or list(stock)
+        if not sizes:
+            raise ValueError("At least one size is required")
+        unknown = [size for size in stock if size not in sizes]
+        if unknown:
+            raise ValueError(f"Stock given for sizes not in the size list: {', '.join(unknown)}")
+
+        self.products.add({
+            "id": product_id if product_id is not None else self.products.next_id(),
+            "name": name,
+            "price": price,
+            "sizes": sizes,
+            "stock": {size: stock.get(size, 0) for size in sizes}
+        })
+        return "added"
+
+    # Upsert: price and per-size stock are set to the row's values; blank columns are left as they are
+    def update_product(self, product, row):
+        changes = {}
+        name = str(row.get("name") or "").strip()
+        if name and name.lower() != product["name"].lower():
+            if self.products.name_exists(name):
+                raise ValueError(f'Product Name "{name}" already exists')
+            changes["name"] = name
+        if row.get("price") not in (None, ""):
+            price = parse_price(row["price"])
+            if price != product["price"]:
+                changes["price"] = price
+
+        stock = parse_stock(row.get("stock"))
+        sizes = parse_sizes(row.get("sizes")) or product["sizes"]
+        sizes += [size for size in stock if size not in sizes]
+
+        if changes or sizes != product["sizes"]:
+            new_stock = dict(product["stock"])
+            new_stock.update(stock)
+            changes.update(sizes=sizes, stock={size: new_stock.get(size, 0) for size in sizes})
+            self.products.update(product, **changes)
+        else:
+            # Stock only: small per-size deltas, like checkout
+            for size, quantity in stock.items():
+                delta = quantity - product["stock"].get(size, 0)
+                if delta:
+                    self.products.adjust_stock(product, size, delta)
+        return "updated"
+
+    # Stream the file, validating row by row; everything accepted is saved once at the end
+    def import_file(self, path, row_format=None):
+        report = {"rows": 0, "added": 0, "updated": 0, "errors": []}
+        try:
+            for line_number, row in read_rows(path, row_format):
+                report["rows"] += 1
+                if row is None:
+                    report["errors"].append((line_number, "Invalid JSON object"))
+                    continue
+                try:
+                    report[self.apply_row(row)] += 1
+                except (ValueError, TypeError) as e:
+                    report["errors"].append((line_number, str(e)))
+        finally:
+            # Rows applied before an unexpected error (or a read error) are saved too, so memory and disk agree
+            if report["added"] or report["updated"]:
+                with self.storage.transaction():
+                    self.storage.catalog_store.save()
+        return report
+
+# Stream every product to a CSV or JSON Lines file (written to a temp file, then renamed)
+def export_products(products, path, row_format=None):
+    temp_file = path + ".tmp"
+    count = 0
+    with open(temp_file, 'w', newline='', encoding='utf-8') as f:
+        if file_format(path, row_format) == "csv":
+            writer = csv.writer(f)
+            writer.writerow(CSV_FIELDS)
+            for product in products:
+                writer.writerow([
+                    product["id"],
+                    product["name"],
+                    product["price"],
+                    "|".join(product["sizes"]),
+                    "|".join(f"{size}:{quantity}" for size, quantity in product["stock"].items())
+                ])
+                count += 1
+        else:
+            for product in products:
+                f.write(json.dumps(product.to_dict()) + "\n")
+                count += 1
+    os.replace(temp_file, path)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk product import and export (CSV or JSON Lines).")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Default: from the file extension")
+    parser.add_argument("--upsert", action="store_true", help="Update products whose ID already exists")
+    args = parser.parse_args()
+
+    catalog = Catalog(None)
+    if args.command == "export":
+        print(f"Exported {export_products(catalog.catalog, args.file, args.format)} products to {args.file}")
+    else:
+        report = ProductImporter(catalog.catalog, catalog.storage, args.upsert).import_file(args.file, args.format)
+        for line_number, error in report["errors"]:
+            print(f"Line {line_number}: {error}")
+        print(f"{report['rows']} rows: {report['added']} added, {report['updated']} updated, {len(report['errors'])} rejected")
@@ -1,83 +1,139 @@
-from datetime import datetime
 from itertools import product
+from uuid import uuid4
 
 from config import catalog_file
-import json
-import os
+from inventory import ProductCatalog
+from search import SearchIndex
+from filters import FilterIndex
+from storage import open_storage
+from history import order_id_of, line_id_of, timestamp_fields
+from models import CartLine
+from pager import Pager, CatalogView
+from metrics import timed
+from orders import OrderService
+from pricing import PricingEngine, format_cents
 import config
 
 class Catalog():
 
-    def __init__(self, store_instance):
+    def __init__(self, store_instance, storage=None):
         self.store = store_instance
+        self.storage = storage or open_storage()
         self.catalog_file = catalog_file
-        self.catalog = self.load_catalog()
-        self.purchase_history = config.purchase_history_file
+        self.catalog_store = self.storage.catalog_store
+        self.catalog = ProductCatalog(self.load_catalog())
+        self.catalog_store.attach(self.catalog)
+        # Built on the first search (see search_index below)
+        self.search_index_built = None
+        self.filter_index = FilterIndex(self.catalog)
+        self.catalog_view = CatalogView(self.catalog, self.filter_index.price_keys)
+        self.pager = Pager()
+        self.sort_order = "id"
+        # Stock reservations and locked checkout (safe to share between threads)
+        self.orders = OrderService(self)
+        # Cart prices in integer cents, with the promotions file compiled into lookup tables
+        self.pricing = PricingEngine()
+
+    # The n-gram index is the slowest part of start-up; sessions that never search skip it
+    @property
+    def search_index(self):
+        if self.search_index_built is None:
+            self.search_index_built = SearchIndex(self.catalog)
+        return self.search_index_built
+
+    # Purchase history is opened only when a session first reads or writes it
+    @property
+    def purchase_history(self):
+        return self.storage.history
 
     # Load Catalog
+    @timed
     def load_catalog(self):
-        if not os.path.exists(self.catalog_file):
+        if not self.catalog_store.exists():
             # Create default catalog
             default_catalog = [
                 {"id": 1, "name": "T-Shirt", "price": 2500.00, "sizes": ["S", "M", "L"], "stock": {"S": 3, "M": 4, "L": 3}},
                 {"id": 2, "name": "Jeans", "price": 4890.00, "sizes": ["M", "L", "XL"], "stock": {"M": 2, "L": 2, "XL": 1}},
                  {"id": 3, "name": "Jacket", "price": 7600.00, "sizes": ["M", "L"], "stock": {"M": 1, "L": 2}},
             ]
-            with open(catalog_file, "w") as f:
-                json.dump(default_catalog, f, indent=4)
+            self.catalog_store.create(default_catalog)
             return default_catalog
         else:
-            with open(self.catalog_file, "r") as f:
-                return json.load(f)
+            return self.catalog_store.load()
 
-    # Save Data to Catalog
+    # Save Data to Catalog (merged with changes saved meanwhile by other sessions)
+    @timed
     def save_catalog(self):
-        with open(self.catalog_file, "w") as f:
-            json.dump(self.catalog, f, indent=4)
+        self.catalog_store.save()
 
-    # View Catalog
+    # View Catalog (one page at a time)
     def view_catalog(self):
-        print("\n\033[1;95m--------------------  Catalog --------------------\033[0m\n")
-
-        # Print header
-        print(f"\033[1m{'ID':<5} {'Name':<10} {'Price (Ұ)':<12} {'Sizes':<15} {'Stock':<6}\033[0m")
-        print("-" * 50)
-
-        for item in self.catalog:
-            sizes = ", ".join(item['sizes'])
-
-            stock_value = item['stock']
-            if isinstance(stock_value, dict):
-                total_stock = sum(stock_value.values())
-            else:
-                total_stock = stock_value
-
-            print(f"{item['id']:<5} {item['name']:<10} Ұ{item['price']:<10,.2f} {sizes:<12} {total_stock:<6}")
-
-        print("-" * 50)
-        print("\n\t1.  Search Product")
-        print("\t2.  Filter Products")
-        print("\t3.  Add to Cart")
-        print("\t4.  Back to Menu")
-
-        # Get user Selection
-        user_choice = input("\n\033[1m  Enter your choice: \033[0m")
-
-        if user_choice == "1":
-            self.search_product()
-        elif user_choice == "2":
-            self.filter_products()
-        elif user_choice == "3":
-            self.add_to_cart()
-            checkout_now = input("\n Proceed to checkout now? (y/n): ").strip().lower()
-            if checkout_now == 'y':
-                self.checkout()
-                return
-            elif checkout_now == 'n':
-                print("\n\033[33m Checkout cancelled. Returning to Catalog menu...\033[0m")
-            else:
-                print("\n\033[31m Invalid input. Returning to Catalog menu...\033[0m")
-        elif user_choice == "4":
+        page_number = 0
+        while True:
+            page_count = self.pager.page_count(len(self.catalog_view))
+            page_number = min(page_number, page_count - 1)
+
+            lines = [
+                "\n\033[1;95m--------------------  Catalog --------------------\033[0m\n",
+                # Header
+                f"\033[1m{'ID':<5} {'Name':<10} {'Price (Ұ)':<12} {'Sizes':<15} {'Stock':<6}\033[0m",
+                "-" * 50
+            ]
+            lines += self.catalog_view.page(page_number, self.pager.page_size, self.sort_order)
+            lines += [
+                "-" * 50,
+                f"Page {page_number + 1} of {page_count}  |  Sorted by {self.sort_order}",
+                "\n\t1.  Search Product",
+                "\t2.  Filter Products",
+                "\t3.  Add to Cart",
+                "\t4.  Back to Menu",
+                "\t5.  Next Page",
+                "\t6.  Previous Page",
+                "\t7.  Go to Page",
+                "\t8.  Sort by ID / Name / Price"
+            ]
+            self.pager.write(lines)
+
+            # Get user Selection
+            user_choice = input("\n\033[1m  Enter your choice: \033[0m")
+
+            if user_choice == "5":
+                page_number = min(page_number + 1, page_count - 1)
+                continue
+            elif user_choice == "6":
+                page_number = max(page_number - 1, 0)
+                continue
+            elif user_choice == "7":
+                try:
+                    page_number = max(int(input(f"\033[1mEnter page number (1-{page_count}): \033[0m")) - 1, 0)
+                except ValueError:
+                    print("\n\033[31m Invalid page number.\033[0m")
+                continue
+            elif user_choice == "8":
+                order = input("\033[1mSort by (id/name/price): \033[0m").strip().lower()
+                if order in self.catalog_view.SORT_ORDERS:
+                    self.sort_order = order
+                    page_number = 0
+                else:
+                    print("\n\033[31m Invalid sort option.\033[0m")
+                continue
+
+            if user_choice == "1":
+                # Results are printed above the catalog page, which is shown again
+                self.search_product()
+                continue
+            elif user_choice == "2":
+                self.filter_products()
+            elif user_choice == "3":
+                self.add_to_cart()
+                checkout_now = input("\n Proceed to checkout now? (y/n): ").strip().lower()
+                if checkout_now == 'y':
+                    self.checkout()
+                    return
+                elif checkout_now == 'n':
+                    print("\n\033[33m Checkout cancelled. Returning to Catalog menu...\033[0m")
+                else:
+                    print("\n\033[31m Invalid input. Returning to Catalog menu...\033[0m")
             return
 
     # Searching Products
@@ -85,15 +141,18 @@ class Catalog():
         print("\n\033[1;95m----------  Search Product Page ----------\033[0m\n")
         keyword = input("\033[1mEnter keyword: \033[0m").lower()
 
-        found = False
-        for item in self.catalog:
-            if keyword in item['name'].lower():
-                print(f"\n{item['id']}: {item['name']} - Ұ{item['price']:,.2f} | Sizes: {', '.join(item['sizes'])} | Stock: {item['stock']}")
-                found = True
-        if not found:
+        results = self.search_index.search(keyword, limit=config.search_result_limit)
+        for item in results:
+            print(f"\n{item['id']}: {item['name']} - Ұ{item['price']:,.2f} | Sizes: {', '.join(item['sizes'])} | Stock: {item['stock']}")
+        if not results:
             print("\n\033[31m No Matching Products Found...\033[0m")
 
-        self.view_catalog()
+    # Print Filtered Products
+    def print_filtered_products(self, products, not_found_message):
+        for item in products:
+            print(f"{item['id']}: {item['name']} - Ұ{item['price']:,.2f} | Sizes: {', '.join(item['sizes'])} | Stock: {item['stock']}")
+        if not products:
+            print(f"\033[31m {not_found_message}\033[0m")
 
     # Fitering Products by Size and Price
     def filter_products(self):
@@ -101,7 +160,8 @@ class Catalog():
             print("\n\033[1;95m----------  Filter Products ----------\033[0m\n")
             print("\t1.  Filter by Size")
             print("\t2.  Filter by Price")
-            print("\t3.  Back to Menu")
+            print("\t3.  Filter by Price, Size and Availability")
+            print("\t4.  Back to Menu")
 
             user_filter_option = input("\n\033[1m  Enter your choice: \033[0m")
 
@@ -111,13 +171,7 @@ class Catalog():
                 user_entered_size = input("\n\033[1mEnter the size for filter items: \033[0m").upper()
                 print()
 
-                found = False
-                for item in self.catalog:
-                    if user_entered_size in item['sizes']:
-                        print(f"{item['id']}: {item['name']} - Ұ{item['price']:,.2f} | Sizes: {', '.join(item['sizes'])} | Stock: {item['stock']}")
-                        found = True
-                if not found:
-                    print("\033[31m No products found for given size...\033[0m")
+                self.print_filtered_products(self.filter_index.query(size=user_entered_size), "No products found for given size...")
 
             # Filter Products by Price+
             elif user_filter_option == "2":
@@ -127,22 +181,36 @@ class Catalog():
                     user_entered_max_price =float(input("\033[1mEnter the Maximum price for filter items: \033[0m"))
                     print()
 
-                    found = False
-                    for item in self.catalog:
-                        if user_entered_min_price <= item['price'] <= user_entered_max_price:
-                            print(f"{item['id']}: {item['name']} - Ұ{item['price']:,.2f} | Sizes: {', '.join(item['sizes'])} | Stock: {item['stock']}")
-                            found = True
-                    if not found:
-                        print("\n\033[31m No products found for given price...\033[0m")
+                    products = self.filter_index.query(min_price=user_entered_min_price, max_price=user_entered_max_price)
+                    self.print_filtered_products(products, "No products found for given price...")
                 except ValueError:
                     print("\n\033[31m Invalid input. Please try again...\033[0m")
 
-            # Back to User Menu
+            # Filter Products by any combination (blank input skips that criterion)
             elif user_filter_option == "3":
+                print("\n\033[1;95m---------- Filter Products by Price, Size and Availability ----------\033[0m")
+                try:
+                    min_price_input = input("\n\033[1mEnter the Minimum price (blank for any): \033[0m").strip()
+                    max_price_input = input("\033[1mEnter the Maximum price (blank for any): \033[0m").strip()
+                    size_input = input("\033[1mEnter the size (blank for any): \033[0m").strip().upper()
+                    in_stock_input = input("\033[1mOnly items in stock? (y/n): \033[0m").strip().lower()
+                    print()
+
+                    products = self.filter_index.query(
+                        min_price=float(min_price_input) if min_price_input else None,
+                        max_price=float(max_price_input) if max_price_input else None,
+                        size=size_input or None,
+                        in_stock=in_stock_input == "y"
+                    )
+                    self.print_filtered_products(products, "No products found for given filters...")
+                except ValueError:
+                    print("\n\033[31m Invalid input. Please try again...\033[0m")
+
+            # Back to User Menu
+            elif user_filter_option == "4":
                 return
             else:
                 print("\n\033[31m Invalid Choice. Please try again...\033[0m")
-                self.filter_products()
 
 
     # Add Items to the Cart
@@ -151,7 +219,7 @@ class Catalog():
         try:
             selected_item_id = int(input("\n\033[1mEnter ID of the item you want to add: \033[0m"))
 
-            product = next((item for item in self.catalog if item['id'] == selected_item_id), None)
+            product = self.catalog.get(selected_item_id)
 
             if not product:
                 print("\n\033[31m No product found for given ID...\033[0m")
@@ -160,28 +228,21 @@ class Catalog():
             print(f"Available Sizes: {', '.join(product['sizes'])}")
             selected_size = input("\n\033[1mEnter Size: \033[0m").strip().upper()
 
-            if not isinstance(product['stock'], dict):
-                print("\n\033[31m Error: Stock format invalid for this product!\033[0m")
+            error = self.size_error(product, selected_size)
+            if error:
+                print(f"\n\033[31m {error}\033[0m")
                 return
 
-            if selected_size not in product['stock']:
-                print("\n\033[31m Selected size is not available in stock!\033[0m")
-                return
-
-            available_stock = product['stock'].get(selected_size, 0)
             quantity = int(input("\033[1mEnter quantity: \033[0m"))
 
-            if quantity > available_stock:
-                print("\n\033[31m Sorry! Requested quantity exceeds available stock.\033[0m")
+            # Checked against stock not held by other carts, then held for this cart
+            error = self.quantity_error(product, selected_size, quantity, self.store.cart_id) or \
+                self.orders.reserve(self.store.cart_id, product, selected_size, quantity)
+            if error:
+                print(f"\n\033[31m {error}\033[0m")
                 return
 
-            #product['stock'][selected_size] -= quantity
-
-            self.store.cart[(selected_item_id, selected_size)] = {
-                'quantity': quantity,
-                'product': product,
-                'size': selected_size
-            }
+            self.add_cart_line(self.store.cart, product, selected_size, quantity)
 
             print(
                 f'\n\033[34m Successfully added {quantity} x {product["name"]} (Size {selected_size}) to cart.\033[0m')
@@ -189,6 +250,23 @@ class Catalog():
         except ValueError:
             print("\n\033[31m Invalid input. Please try again...\033[0m")
 
+    # Stock rules shared by the interactive cart and batch orders
+    def size_error(self, product, size):
+        if size not in product['stock']:
+            return "Selected size is not available in stock!"
+        return None
+
+    def quantity_error(self, product, size, quantity, cart_id=None):
+        if quantity <= 0:
+            return "Quantity must be at least 1."
+        if quantity > self.orders.available(product, size, cart_id):
+            return "Sorry! Requested quantity exceeds available stock."
+        return None
+
+    # Adding the same product and size again replaces the earlier quantity
+    def add_cart_line(self, cart, product, size, quantity):
+        cart[(product['id'], size)] = CartLine(product, size, quantity)
+
     # View Cart
     def view_cart(self):
         print("\n\033[1;95m----------  Your Cart ----------\033[0m\n")
@@ -196,18 +274,18 @@ class Catalog():
             print("\n\033[31m Your Cart is empty. Add some items first!\033[0m")
             return
 
-        total_value = 0
-        print("\033[1mItems in your cart: \033[0m")
+        # Whole cart priced in one pass (integer cents, promotions applied)
+        priced = self.pricing.price_cart(self.store.cart)
+        lines = ["\033[1mItems in your cart: \033[0m"]
+        for line in priced.lines:
+            lines.append(f"{line.product['name']} ({line.size}) x {line.quantity} = Ұ{format_cents(line.gross_cents)}")
+            if line.discount_cents:
+                lines.append(f"\033[33m   {', '.join(line.promotions)}: -Ұ{format_cents(line.discount_cents)}\033[0m")
+        if priced.cart_discount_cents:
+            lines.append(f"\n\033[33m{priced.cart_promotion}: -Ұ{format_cents(priced.cart_discount_cents)}\033[0m")
+        print("\n".join(lines))
 
-        for item_id, cart_item in self.store.cart.items():
-            product = cart_item['product']
-            quantity = cart_item['quantity']
-            price = product['price']
-            subtotal = price * quantity
-            total_value += subtotal
-            print(f"{product['name']} x {quantity} = Ұ{subtotal:,.2f}")
-
-        print(f'\n\033[32mYour Total Amount : Ұ{total_value:.2f}\033[0m')
+        print(f'\n\033[32mYour Total Amount : Ұ{format_cents(priced.total_cents)}\033[0m')
 
         proceed_to_checkout = input("\n\033[1mProceed to checkout? (y/n): \033[0m").strip().lower()
 
@@ -222,120 +300,124 @@ class Catalog():
 
 
     # Checkout
+    @timed
     def checkout(self):
         print("\n\033[1;95m---------- Checkout Page ----------\033[0m\n")
         if not self.store.cart:
             print("\n\033[31m Your Cart is empty. Add some items first!\033[0m")
             return
 
-        for(item_id, size), cart_item in list(self.store.cart.items()):
-            # Deduct from the Stock
-            product = cart_item['product']
-            quantity = cart_item['quantity']
-
-            if isinstance(product['stock'], dict):
-                if size in product['stock']:
-                    product['stock'][size] -= quantity
-                else:
-                    print(f"\n\033[31m Error: Size {size} is notfound in stock!\033[0m")
-            else:
-                product['stock'] -= quantity
-
-            #Save to History
-            self.save_purchase_history(self.store.cart)
-
-            self.store.cart.clear()
-            print("\n\033[34m Your Order Successful! Thank you for your purchase.\033[0m")
-
-    def save_purchase_history(self, cart):
-        history = []
-
-        if os.path.exists(self.purchase_history):
-            with open(self.purchase_history, 'r') as f:
-                try:
-                    history = json.load(f)
-                except json.JSONDecodeError:
-                    pass
+        # Every line is checked and deducted under its SKU lock; stock and history are saved together
+        record, error = self.orders.checkout(self.store.cart_id, self.store.cart, self.build_purchase_record)
+        if error:
+            print(f"\n\033[31m {error}\033[0m")
+            return
 
-        # Build new History Record
-        new_record = {
-            "timestamp": datetime.now().strftime("%m/%d/%Y %I:%M:%S %p"),
+        self.store.cart.clear()
+        print(f"\n\033[34m Your Order Successful! Total charged: Ұ{format_cents(record['total_cents'])}. Thank you for your purchase.\033[0m")
+
+    def current_username(self):
+        if self.store is None or not self.store.current_user:
+            return None
+        return self.store.current_user['username']
+
+    # The current user's history shard; nobody else's records are read
+    def user_history(self):
+        return self.purchase_history.for_user(self.current_username())
+
+    # Build new History Record (stable order ID, line IDs used by returns, and the prices charged)
+    def build_purchase_record(self, cart, username=None):
+        priced = self.pricing.price_cart(cart)
+        return {
+            "order_id": uuid4().hex,
+            "username": username or self.current_username(),
+            # Display string plus epoch seconds (sortable; used by the time index)
+            **timestamp_fields(),
             "type": 'purchase',
+            "total_cents": priced.total_cents,
             "items":[
                 {
-                    "name": item['product']['name'],
-                    "price": item['product']['price'],
-                    "quantity": item['quantity'],
-                    "size": item['size']
-                } for item in cart.values()
+                    "line_id": line_id,
+                    "product_id": line.product['id'],
+                    "name": line.product['name'],
+                    "price": line.product['price'],
+                    "quantity": line.quantity,
+                    "size": line.size,
+                    # Paid for the line after its promotions and its share of any cart discount
+                    "unit_cents": line.unit_cents,
+                    "discount_cents": line.discount_cents + line.cart_share_cents,
+                    "total_cents": line.total_cents
+                } for line_id, line in enumerate(priced.lines, start=1)
             ]
         }
-        history.append(new_record)
-
-        with open(self.purchase_history, 'w') as f:
-            json.dump(history, f, indent=4)
 
     # View Purchase History
     def view_purchase_history(self):
         print("\n\033[1;95m----------  Purchase History ----------\033[0m\n")
 
-        if not os.path.exists(self.purchase_history):
-            print("\033[31m No Purchase History Found.\033[0m")
-            return
-
-        with open(self.purchase_history, 'r') as f:
-            try:
-                history = json.load(f)
-            except json.JSONDecodeError:
-                print("\033[31m Error reading Purchase History.\033[0m")
-                return
+        found = False
+        # Newest first, streamed from this user's shard only
+        for records, more in self.pager.iter_pages(self.user_history().iter_records(newest_first=True)):
+            found = True
+            lines = []
+            for record in records:
+                label = record.get("type", "purchase").capitalize()
+                total = f" | Total: Ұ{format_cents(record['total_cents'])}" if 'total_cents' in record else ""
+                lines.append(f"{label} - Date: {record['timestamp']}{total}")
+                for item in record['items']:
+                    lines.append(f" - {item['name']} x {item['quantity']} {self.price_paid(item)}")
+                lines.append("")
+            self.pager.write(lines)
+
+            if more and input("\033[1mPress Enter for more, or 'q' to stop: \033[0m").strip().lower() == "q":
+                break
 
-        if not history:
+        if not found:
             print("\033[31m No Purchase History Found.\033[0m")
-            return
 
-        for record in history:
-            label = record.get("type", "purchase").capitalize()
-            print(f"{label} - Date: {record['timestamp']}")
-            for item in record['items']:
-                print(f" - {item['name']} x {item['quantity']} @ Ұ{item['price']:,.2f}")
-            print()
+    # Priced records show the unit price and what was paid for the line (or refunded);
+    # older ones only have the catalog price
+    def price_paid(self, item):
+        if 'total_cents' not in item:
+            return f"@ Ұ{item['price']:,.2f}"
+        if 'unit_cents' not in item:
+            return f"= Ұ{format_cents(item['total_cents'])}"
+        return f"@ Ұ{format_cents(item['unit_cents'])} = Ұ{format_cents(item['total_cents'])}"
 
     # Return Items
     def return_items(self):
         print("\n\033[1;95m----------  Return Items ----------\n\033[0m")
 
-        if not os.path.exists(self.purchase_history):
-            print("\033[31m No Purchase History Found.\033[0m")
-            return
-
-        # Load History
-        try:
-            with open(self.purchase_history, 'r') as f:
-                history = json.load(f)
-        except json.JSONDecodeError:
-            print("\033[31m Error reading Purchase History.\033[0m")
-            return
+        # Show Available Purchases (streamed newest first from this user's log, one page at a time)
+        all_items = []
+        record_number = 0
+        selection = ""
+        for page, more in self.pager.iter_pages(self.iter_returnable(self.user_history())):
+            lines = ["\033[1mYour Purchase History: \n\033[0m"] if record_number == 0 else []
+            for order_id, record, returnable in page:
+                record_number += 1
+                lines.append(f"{record_number}. Date : {record['timestamp']}")
+                for line_id, item, remaining in returnable:
+                    index = len(all_items)
+                    #Order ID + line ID + item + quantity still returnable
+                    all_items.append((order_id, line_id, item, remaining))
+                    # Priced orders show what was paid per unit (the refund rate)
+                    unit_price = item['total_cents'] / item['quantity'] / 100 if 'total_cents' in item else item['price']
+                    lines.append(f" [{index}] {item['name']} x {remaining} @ Ұ{unit_price:,.2f}")
+            self.pager.write(lines)
+
+            # Select Item to Return (or page on)
+            prompt = "Which item do you want to return (Enter for more): " if more else "Which item do you want to return: "
+            selection = input(f"\n\033[1m{prompt}\033[0m").strip()
+            if selection or not more:
+                break
 
-        if not history:
+        if not all_items:
             print("\033[31m No Purchases to Return.\033[0m")
             return
 
-        # Show Available Purchases
-        all_items = []
-        print("\033[1mYour Purchase History: \n\033[0m")
-        for i,record in enumerate(history):
-            print(f"{i + 1}. Date : {record['timestamp']}")
-            for j,item in enumerate(record['items']):
-                index = len(all_items)
-                #Record index + item
-                all_items.append((i, item))
-                print(f" [{index}] {item['name']} x {item['quantity']} @ Ұ{item['price']:,.2f}")
-        print()
-
-        # Select Item to Return
         try:
-            return_index = int(input("\033[1mWhich item do you want to return: \033[0m"))
+            return_index = int(selection)
         except ValueError:
             print("\n\033[31m Please enter a valid selection.\033[0m")
             return
@@ -344,79 +426,95 @@ class Catalog():
                 print("\n\033[31m Invalid Selection. Please choose a valid item number.\033[0m")
                 return
 
-        record_index, item_to_return = all_items[return_index]
+        order_id, line_id, item_to_return, item_quantity = all_items[return_index]
         item_name = item_to_return['name']
-        item_quantity = item_to_return['quantity']
         item_size = item_to_return.get('size', None)
 
         # Ask Return Quantity
         try:
             return_quantity = int(input("\033[1mHow many items do you want to return: \033[0m"))
-            if return_quantity < 0 or return_quantity > item_quantity:
+            if return_quantity <= 0 or return_quantity > item_quantity:
                 print("\n\033[31m Invalid Quantity\033[0m")
                 return
         except ValueError:
             print("\n\033[31m Please enter a valid number.\033[0m")
             return
 
-        # Update Stock
-        for product in self.catalog:
-            if product['name'] == item_name:
-                if isinstance(product['stock'], dict) and item_size in product['stock']:
-                    product['stock'][item_size] += return_quantity
-                else:
-                    #product['stock'] += return_quantity
-                    print("\n\033[31m Size mismatch or stock format invalid.\033[0m")
-                    return
-                break
-            else:
-                # This executes only if for loop complete without break
-                print("\n\033[31m Returned item not found in catalog.\033[0m")
-                return
+        # Update Stock (older records have no product ID and are matched by name)
+        product = self.catalog.get(item_to_return['product_id']) if 'product_id' in item_to_return else None
+        if product is None:
+            product = self.catalog.find_by_name(item_name)
+        if not product:
+            print("\n\033[31m Returned item not found in catalog.\033[0m")
+            return
 
-        # Adjust Purchase Record
-        if return_quantity == item_quantity:
-            history[record_index]['items'].remove(item_to_return)
-        else:
-            item_to_return['quantity'] -= return_quantity
+        if item_size not in product['stock']:
+            print("\n\033[31m Size mismatch: this size is no longer stocked.\033[0m")
+            return
 
-        # Check whether the order has any other items
-        if not history[record_index]['items']:
-            # Remove Record if no other items
-            del history[record_index]
+        # Stock and the return event are written in one transaction; the purchase record is left as it is
+        with self.storage.transaction():
+            # The line is found again through the order index, as saved: the list may be stale
+            # (another session of this user can have returned part of it since)
+            history = self.user_history()
+            order_index = history.order_index()
+            item_to_return = order_index.find_line(history, order_id, line_id, item_to_return.get('product_id'), item_size)
+            item_quantity = order_index.remaining(order_id, line_id, item_to_return['quantity']) if item_to_return else 0
+            if return_quantity > item_quantity:
+                print(f"\n\033[31m Only {item_quantity} of this item can still be returned.\033[0m")
+                return
 
-        # Save Updated History
-        with open(self.purchase_history, 'w') as f:
-            json.dump(history, f, indent=4)
+            self.catalog.adjust_stock(product, item_size, return_quantity)
+            self.save_catalog()
+            returned_before = item_to_return['quantity'] - item_quantity
+            self.save_return_history(order_id, line_id, dict(item_to_return, product_id=product["id"]), return_quantity, returned_before)
 
         print(f'\n\033[34m Successfully Returned {return_quantity} x {item_name}.\033[0m')
 
-    def save_return_history(self,item_name, return_quantity, price):
-        history = []
-
-        if not os.path.exists(self.purchase_history):
-            with open(self.purchase_history, 'w') as f:
-                try:
-                    history = json.load(f)
-                except json.JSONDecodeError:
-                    pass
-
+    # Purchases that still have something to return, newest first, as (order ID, record, lines)
+    def iter_returnable(self, history):
+        order_index = history.order_index()
+        for offset, record in history.iter_with_offsets(newest_first=True):
+            if record.get("type", "purchase") != "purchase":
+                continue
+            order_id = order_id_of(offset, record)
+            returnable = []
+            for j,item in enumerate(record['items']):
+                line_id = line_id_of(j, item)
+                remaining = order_index.remaining(order_id, line_id, item['quantity'])
+                if remaining > 0:
+                    returnable.append((line_id, item, remaining))
+            if returnable:
+                yield order_id, record, returnable
+
+    # Append a Return event for one purchase line to the Purchase History log
+    @timed
+    def save_return_history(self, order_id, line_id, item, return_quantity, returned_before=0):
         return_record = {
-            "timestamp": datetime.now().strftime("%m/%d/%Y %I:%M:%S %p"),
+            "order_id": order_id,
+            "username": self.current_username(),
+            **timestamp_fields(),
             "type": "return",
             "items": [
                 {
-                    "name": item_name,
-                    "price": price,
-                    "quantity": return_quantity
+                    "line_id": line_id,
+                    "product_id": item.get('product_id'),
+                    "name": item['name'],
+                    "price": item['price'],
+                    "quantity": return_quantity,
+                    "size": item.get('size')
                 }
             ]
         }
-
-        history.append(return_record)
-
-        with open(self.purchase_history, 'w') as f:
-            json.dump(history, f, indent=4)
+        # Refund the returned units' share of what the line actually cost, taken from cumulative
+        # shares so returning a line piece by piece refunds exactly its total
+        if "total_cents" in item:
+            total, quantity = item["total_cents"], item["quantity"]
+            refunded_before = total * returned_before // quantity
+            return_record["items"][0]["total_cents"] = total * (returned_before + return_quantity) // quantity - refunded_before
+
+        # Routed to this user's shard by its username (and added to the time index)
+        self.purchase_history.append(return_record)
 
 if __name__ == "__main__":
     from store import Store
@@ -5,4 +5,60 @@ user_files = "C:\\Users\\USER\\Desktop\\Python Projects\\Online Clothing Store\\
 catalog_file = "catalog.json"
 
 # Save Purchase History into this file
-purchase_history_file = "C:\\Users\\USER\\Desktop\\Python Projects\\Online Clothing Store\\purchase_history.json"
\ No newline at end of file
+purchase_history_file = "C:\\Users\\USER\\Desktop\\Python Projects\\Online Clothing Store\\purchase_history.json"
+
+# Append-only Purchase History Log (one JSON record per line)
+purchase_log_file = "purchase_history.jsonl"
+
+# Maximum number of products shown for a search
+search_result_limit = 20
+
+# Order requests processed by batch.py (one JSON order per line)
+order_batch_file = "orders.jsonl"
+
+# Catalog change journal entries after which the catalog snapshot is rewritten
+journal_compact_threshold = 1000
+
+# Storage backend: "json" (files above) or "sqlite"
+storage_backend = "json"
+
+# SQLite database used when storage_backend = "sqlite"
+sqlite_file = "store.db"
+
+# Rows (catalog) or records (history) shown per page
+page_size = 20
+
+# One purchase history log per user is kept in this folder
+purchase_history_dir = "purchase_history"
+
+# Registrations logged after which users.json is rewritten
+user_log_compact_threshold = 500
+
+# Record call latencies and file I/O (shown under Admin > Performance Metrics); False removes the wrappers
+metrics_enabled = True
+metrics_export_file = "metrics.json"
+
+# Keep a pickled copy of catalog.json and users.json next to them for faster start-up
+snapshot_cache = True
+
+# Order service: stock held by add-to-cart expires after this many seconds; number of SKU lock stripes
+reservation_ttl_seconds = 900
+sku_lock_stripes = 64
+# Admin sales reports: products listed in the rankings, and recent days in the daily report
+top_sellers_count = 10
+sales_report_days = 14
+
+# Low-stock monitor: default threshold per size, per-product/per-size overrides, and the sales window used to forecast stockouts
+low_stock_threshold = 3
+stock_thresholds_file = "stock_thresholds.json"
+forecast_window_days = 30
+
+# Users are kept in this many bucket files (by a hash of the username) inside user_bucket_dir
+user_bucket_dir = "users"
+user_bucket_count = 64
+
+# Promotion rules (size prices, percentage off, buy-X-get-Y, cart thresholds) applied when carts are priced
+promotions_file = "promotions.json"
+
+# Largest stock quantity a bulk import accepts for one size
+max_stock_quantity = 1000000
@@ -0,0 +1,10 @@
+import pytest
+
+from benchmark import use_directory
+
+
+# Every test works on its own data files (catalog, journal, users, history) in a temporary folder
+@pytest.fixture
+def data_dir(tmp_path):
+    with use_directory(tmp_path):
+        yield tmp_path
@@ -0,0 +1,113 @@
+from bisect import bisect_left, bisect_right, insort
+
+from inventory import CatalogListener
+from metrics import timed
+
+
+class FilterIndex(CatalogListener):
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        # Sorted (price, product ID) pairs, searched with bisect for price ranges
+        self.price_keys = []
+        # Size -> IDs of products offered in that size
+        self.size_sets = {}
+        # Size -> IDs of products with stock > 0 in that size
+        self.size_in_stock = {}
+        # Product ID -> number of its sizes that still have stock
+        self.sizes_in_stock_count = {}
+        # IDs of products with stock in at least one size
+        self.in_stock = set()
+
+        for product in catalog:
+            self.product_added(product)
+        catalog.subscribe(self)
+
+    # Incremental Index Maintenance (called by ProductCatalog)
+    def product_added(self, product):
+        product_id = product["id"]
+        insort(self.price_keys, (product["price"], product_id))
+
+        for size in product["sizes"]:
+            self.size_sets.setdefault(size, set()).add(product_id)
+
+        count = 0
+        for size, quantity in product["stock"].items():
+            if quantity > 0:
+                self.size_in_stock.setdefault(size, set()).add(product_id)
+                count += 1
+        self.sizes_in_stock_count[product_id] = count
+        if count:
+            self.in_stock.add(product_id)
+
+    def product_removed(self, product):
+        product_id = product["id"]
+        key = (product["price"], product_id)
+        position = bisect_left(self.price_keys, key)
+        if position < len(self.price_keys) and self.price_keys[position] == key:
+            del self.price_keys[position]
+
+        for size in product["sizes"]:
+            self.discard(self.size_sets, size, product_id)
+        for size in product["stock"]:
+            self.discard(self.size_in_stock, size, product_id)
+        self.sizes_in_stock_count.pop(product_id, None)
+        self.in_stock.discard(product_id)
+
+    def product_changed(self, product, previous):
+        self.product_removed(previous)
+        self.product_added(product)
+
+    def stock_changed(self, product, size, old_quantity):
+        product_id = product["id"]
+        was_available = old_quantity > 0
+        is_available = product["stock"].get(size, 0) > 0
+        if was_available == is_available:
+            return
+
+        if is_available:
+            self.size_in_stock.setdefault(size, set()).add(product_id)
+            self.sizes_in_stock_count[product_id] += 1
+            self.in_stock.add(product_id)
+        else:
+            self.discard(self.size_in_stock, size, product_id)
+            self.sizes_in_stock_count[product_id] -= 1
+            if not self.sizes_in_stock_count[product_id]:
+                self.in_stock.discard(product_id)
+
+    @staticmethod
+    def discard(index, key, product_id):
+        postings = index.get(key)
+        if postings is None:
+            return
+        postings.discard(product_id)
+        if not postings:
+            del index[key]
+
+    # Query: any combination of price range, size and availability, cheapest first
+    @timed
+    def query(self, min_price=None, max_price=None, size=None, in_stock=False):
+        low = 0 if min_price is None else bisect_left(self.price_keys, (min_price, float("-inf")))
+        high = len(self.price_keys) if max_price is None else bisect_right(self.price_keys, (max_price, float("inf")))
+        if low >= high:
+            return []
+
+        # Candidate set from the size / stock indexes
+        if size is not None:
+            candidates = self.size_in_stock.get(size, set()) if in_stock else self.size_sets.get(size, set())
+        elif in_stock:
+            candidates = self.in_stock
+        else:
+            return [self.catalog.get(product_id) for _, product_id in self.price_keys[low:high]]
+
+        if len(candidates) < high - low:
+            # Fewer set members than prices in range: check each candidate's price directly
+            matches = []
+            for product_id in candidates:
+                product = self.catalog.get(product_id)
+                if (min_price is None or product["price"] >= min_price) and (max_price is None or product["price"] <= max_price):
+                    matches.append(product)
+            matches.sort(key=lambda product: (product["price"], product["id"]))
+            return matches
+
+        return [self.catalog.get(product_id) for _, product_id in self.price_keys[low:high] if product_id in candidates]
@@ -0,0 +1,703 @@
+import json
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+import config
+from metrics import count_io, timed
+from persistence import file_lock
+
+
+# Display format of the "timestamp" field; "epoch" (seconds since 1970) is the one to compare
+TIMESTAMP_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+
+# Epoch and display timestamp of the same moment, for new records
+def timestamp_fields(epoch=None):
+    epoch = int(time.time()) if epoch is None else epoch
+    return {"timestamp": datetime.fromtimestamp(epoch).strftime(TIMESTAMP_FORMAT), "epoch": epoch}
+
+
+# Local time string of an older record as epoch seconds (0 when it cannot be read)
+def parse_timestamp(text):
+    try:
+        return int(datetime.strptime(text, TIMESTAMP_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+def epoch_of(record):
+    epoch = record.get("epoch")
+    return epoch if epoch is not None else parse_timestamp(record.get("timestamp"))
+
+
+# Orders saved before order IDs existed are identified by their log offset
+def order_id_of(offset, record):
+    return record.get("order_id") or f"@{offset}"
+
+
+# Line IDs start at 1; older records fall back to the item position
+def line_id_of(position, item):
+    return item.get("line_id", position + 1)
+
+
+# Order ID -> record offset, (product ID, size) -> purchase lines, and quantities already returned
+class OrderIndex:
+
+    def __init__(self):
+        self.orders = {}
+        self.lines = {}
+        self.returned = {}
+        # Offset of the last record indexed; later records are added incrementally
+        self.last_offset = -1
+
+    def refresh(self, history):
+        for offset, record in history.iter_after(self.last_offset):
+            self.add(offset, record)
+        return self
+
+    def add(self, offset, record):
+        self.last_offset = offset
+        if record.get("type", "purchase") == "purchase":
+            order_id = order_id_of(offset, record)
+            self.orders[order_id] = offset
+            for position, item in enumerate(record['items']):
+                if "product_id" in item:
+                    self.lines.setdefault((item['product_id'], item.get('size')), set()).add((order_id, line_id_of(position, item)))
+        elif record.get("type") == "return" and "order_id" in record:
+            for item in record['items']:
+                key = (record['order_id'], item.get('line_id'))
+                self.returned[key] = self.returned.get(key, 0) + item['quantity']
+
+    def remaining(self, order_id, line_id, quantity):
+        return quantity - self.returned.get((order_id, line_id), 0)
+
+    # Purchase lines of one product and size as (order ID, line ID)
+    def lines_for(self, product_id, size):
+        return self.lines.get((product_id, size), set())
+
+    # The purchased item of one order line as saved (read at the order's offset), or None. With a
+    # product ID and size, a line not bought as that product and size is rejected without a read.
+    def find_line(self, history, order_id, line_id, product_id=None, size=None):
+        offset = self.orders.get(order_id)
+        if offset is None:
+            return None
+        if product_id is not None and (order_id, line_id) not in self.lines_for(product_id, size):
+            return None
+        record = history.read_at(offset) or {"items": []}
+        for position, item in enumerate(record['items']):
+            if line_id_of(position, item) == line_id:
+                return item
+        return None
+
+
+# Base for views kept in step with records appended to the history (checkouts, returns)
+class HistoryListener:
+
+    def records_added(self, records):
+        pass
+
+
+# Record offsets sorted by epoch (parallel arrays), so a date range is two bisects
+class TimeIndex:
+
+    def __init__(self):
+        self.epochs = array('q')
+        self.offsets = array('Q')
+        # Offset of the last record indexed; later records are added incrementally
+        self.last_offset = -1
+        # Leading entries already in the index file, and whether the file can simply be appended to
+        self.saved = 0
+        self.in_order = True
+
+    def __len__(self):
+        return len(self.epochs)
+
+    # The file holds (epoch, offset) pairs in epoch order; it is used only if it covers
+    # exactly the first records of the log
+    @classmethod
+    def load(cls, path, log_offsets):
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        pairs = array('q')
+        with open(path, 'rb') as f:
+            pairs.frombytes(f.read())
+        count_io(path, read=len(pairs) * pairs.itemsize)
+
+        offsets = array('Q', pairs[1::2])
+        count = len(offsets)
+        if count and (count > len(log_offsets) or max(offsets) != log_offsets[count - 1]):
+            return index
+        index.epochs = pairs[0::2]
+        index.offsets = offsets
+        index.last_offset = log_offsets[count - 1] if count else -1
+        index.saved = count
+        return index
+
+    def refresh(self, history):
+        for offset, record in history.iter_after(self.last_offset):
+            self.add(epoch_of(record), offset)
+        return self
+
+    def add(self, epoch, offset):
+        self.last_offset = offset
+        if not self.epochs or epoch >= self.epochs[-1]:
+            self.epochs.append(epoch)
+            self.offsets.append(offset)
+            return
+        # Rare: a record older than the newest indexed one (clock change, migrated records)
+        position = bisect_right(self.epochs, epoch)
+        self.epochs.insert(position, epoch)
+        self.offsets.insert(position, offset)
+        if position < self.saved:
+            self.in_order = False
+
+    def save(self, path):
+        if self.saved == len(self.epochs):
+            return
+        with file_lock(path):
+            appendable = self.in_order and os.path.exists(path) and os.path.getsize(path) == self.saved * 16
+            start = self.saved if appendable else 0
+            pairs = array('q')
+            for epoch, offset in zip(self.epochs[start:], self.offsets[start:]):
+                pairs.append(epoch)
+                pairs.append(offset)
+            if appendable:
+                with open(path, 'ab') as f:
+                    pairs.tofile(f)
+            else:
+                with open(path + ".tmp", 'wb') as f:
+                    pairs.tofile(f)
+                os.replace(path + ".tmp", path)
+            count_io(path, written=len(pairs) * pairs.itemsize)
+        self.saved = len(self.epochs)
+        self.in_order = True
+
+    # Offsets of records with start <= epoch < end (either bound may be None)
+    def between(self, start=None, end=None):
+        low = bisect_left(self.epochs, start) if start is not None else 0
+        high = bisect_left(self.epochs, end) if end is not None else len(self.epochs)
+        return self.offsets[low:high]
+
+
+# One time index for every shard of a ShardedPurchaseHistory, appended on each write: entries are
+# (epoch, shard number, offset) and shard numbers map to shard file names, so a date range across
+# all users is two bisects with no per-shard file to open. Missing files are rebuilt from the shards.
+class ShardTimeIndex:
+    ENTRY_SIZE = 24
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, ".time_index")
+        self.names_file = self.path + ".shards"
+        self.clear()
+
+    def clear(self):
+        # Shard number -> shard file name, and back
+        self.names = []
+        self.numbers = {}
+        # Entries sorted by epoch (parallel arrays)
+        self.epochs = array('q')
+        self.shard_numbers = array('q')
+        self.offsets = array('Q')
+        # Which index file was loaded (a rebuild replaces it) and how much of it
+        self.file_id = None
+        self.loaded = 0
+
+    def __len__(self):
+        return len(self.epochs)
+
+    # Bring memory up to date with the files, building them first if they are missing (caller holds the lock)
+    def load_locked(self, shards):
+        if not os.path.exists(self.path) or not os.path.exists(self.names_file):
+            self.rebuild_locked(shards)
+            return self
+        stat = os.stat(self.path)
+        if (stat.st_dev, stat.st_ino) != self.file_id or stat.st_size < self.loaded:
+            self.clear()
+            self.file_id = (stat.st_dev, stat.st_ino)
+
+        # Complete entries only; a torn tail left by a crash is cut off by the next append
+        end = stat.st_size - stat.st_size % self.ENTRY_SIZE
+        if end > self.loaded:
+            entries = array('q')
+            with open(self.path, 'rb') as f:
+                f.seek(self.loaded)
+                entries.frombytes(f.read(end - self.loaded))
+            count_io(self.path, read=end - self.loaded)
+            self.loaded = end
+            for position in range(0, len(entries), 3):
+                self.add(entries[position], entries[position + 1], entries[position + 2])
+
+        with open(self.names_file, 'r') as f:
+            for name in f.read().splitlines()[len(self.names):]:
+                self.numbers[name] = len(self.names)
+                self.names.append(name)
+        return self
+
+    def add(self, epoch, shard_number, offset):
+        position = len(self.epochs)
+        if self.epochs and epoch < self.epochs[-1]:
+            # Rare: a record older than the newest indexed one (clock change, migrated records)
+            position = bisect_right(self.epochs, epoch)
+        self.epochs.insert(position, epoch)
+        self.shard_numbers.insert(position, shard_number)
+        self.offsets.insert(position, offset)
+
+    # Index records just written to one shard at the given offsets (caller holds the lock and loaded the index)
+    def append_locked(self, shard_name, records, offsets):
+        number = self.numbers.get(shard_name)
+        if number is None:
+            number = self.numbers[shard_name] = len(self.names)
+            self.names.append(shard_name)
+            with open(self.names_file, 'a') as f:
+                f.write(shard_name + "\n")
+
+        entries = array('q')
+        for record, offset in zip(records, offsets):
+            entries.extend((epoch_of(record), number, offset))
+            self.add(entries[-3], number, offset)
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.loaded)
+            f.seek(self.loaded)
+            entries.tofile(f)
+        self.loaded += len(entries) * entries.itemsize
+        count_io(self.path, written=len(entries) * entries.itemsize)
+
+    # Index every record of every shard (first use, or after logs were rewritten); per-shard time
+    # index files of the earlier layout are removed
+    def rebuild_locked(self, shards):
+        self.clear()
+        entries = []
+        for name, shard in shards:
+            self.numbers[name] = len(self.names)
+            self.names.append(name)
+            entries.extend((epoch_of(record), self.numbers[name], offset) for offset, record in shard.iter_with_offsets())
+        entries.sort(key=lambda entry: entry[0])
+
+        data = array('q')
+        for entry in entries:
+            data.extend(entry)
+            self.add(*entry)
+        with open(self.names_file, 'w') as f:
+            f.write("".join(name + "\n" for name in self.names))
+        with open(self.path + ".tmp", 'wb') as f:
+            data.tofile(f)
+        os.replace(self.path + ".tmp", self.path)
+        count_io(self.path, written=len(data) * data.itemsize)
+        stat = os.stat(self.path)
+        self.file_id = (stat.st_dev, stat.st_ino)
+        self.loaded = stat.st_size
+
+        for name in os.listdir(self.directory):
+            if name.endswith(".jsonl.tidx"):
+                os.remove(os.path.join(self.directory, name))
+
+    # Shard logs were rewritten (offsets moved): the next use rebuilds the index (caller holds the lock)
+    def drop_locked(self):
+        self.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    # (shard file names, shard numbers, offsets) of the records with start <= epoch < end
+    def between(self, start=None, end=None):
+        low = bisect_left(self.epochs, start) if start is not None else 0
+        high = bisect_left(self.epochs, end) if end is not None else len(self.epochs)
+        return list(self.names), self.shard_numbers[low:high], self.offsets[low:high]
+
+
+class PurchaseHistory:
+
+    def __init__(self, log_file=None, legacy_file=None, listeners=None):
+        self.log_file = log_file or config.purchase_log_file
+        self.index_file = self.log_file + ".idx"
+        self.time_index_file = self.log_file + ".tidx"
+        # Old JSON array file converted into this log on first use (if given)
+        self.legacy_file = legacy_file
+        # HistoryListeners told about every append (shared by all shards of a ShardedPurchaseHistory)
+        self.listeners = listeners if listeners is not None else []
+
+        # Byte offset of every record in the log, in write order
+        self.offsets = array('Q')
+        # Built on first use by order_index() and time_index()
+        self.index = None
+        self.times = None
+
+        self.migrate_legacy_history()
+        self.load_index()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # One-shot Migration from the old JSON array file
+    def migrate_legacy_history(self):
+        if not self.legacy_file or os.path.exists(self.log_file) or not os.path.exists(self.legacy_file):
+            return
+
+        with open(self.legacy_file, 'r') as f:
+            try:
+                history = json.load(f)
+            except json.JSONDecodeError:
+                history = []
+
+        temp_file = self.log_file + ".tmp"
+        with open(temp_file, 'w') as f:
+            for record in history:
+                f.write(json.dumps(record) + "\n")
+        os.replace(temp_file, self.log_file)
+
+        if os.path.exists(self.index_file):
+            os.remove(self.index_file)
+
+    # Load Offset Index (rebuilt when it does not match the log)
+    def load_index(self):
+        self.offsets = array('Q')
+        self.index = None
+        self.times = None
+        if not os.path.exists(self.log_file):
+            return
+
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as f:
+                self.offsets.frombytes(f.read())
+            if self.index_matches_log():
+                return
+
+        self.rebuild_index()
+
+    def index_matches_log(self):
+        log_size = os.path.getsize(self.log_file)
+        if not self.offsets:
+            return log_size == 0
+
+        last_offset = self.offsets[-1]
+        if last_offset >= log_size:
+            return False
+
+        # The last indexed record must end exactly where the log ends
+        with open(self.log_file, 'rb') as f:
+            f.seek(last_offset)
+            f.readline()
+            return f.tell() == log_size
+
+    def rebuild_index(self):
+        self.offsets = array('Q')
+        with open(self.log_file, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    self.offsets.append(offset)
+                offset += len(line)
+
+        with open(self.index_file, 'wb') as f:
+            self.offsets.tofile(f)
+
+    # Append Records (one write for the log, one for the index); returns their offsets
+    def append(self, record):
+        return self.extend([record])
+
+    @timed
+    def extend(self, records):
+        lines = [(json.dumps(record) + "\n").encode() for record in records]
+        if not lines:
+            return array('Q')
+
+        # Other sessions append to the same log, so offsets are taken under the lock
+        with file_lock(self.log_file):
+            self.sync_index()
+
+            new_offsets = array('Q')
+            with open(self.log_file, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                for line in lines:
+                    new_offsets.append(offset)
+                    offset += len(line)
+                f.write(b"".join(lines))
+            count_io(self.log_file, written=offset - new_offsets[0])
+
+            with open(self.index_file, 'ab') as f:
+                new_offsets.tofile(f)
+            self.offsets.extend(new_offsets)
+
+        for listener in self.listeners:
+            listener.records_added(records)
+        return new_offsets
+
+    # Pick up records another session appended since the index was loaded
+    def sync_index(self):
+        if os.path.exists(self.index_file) and os.path.getsize(self.index_file) != len(self.offsets) * self.offsets.itemsize:
+            self.load_index()
+
+    # Streaming Readers
+    def iter_records(self, newest_first=False):
+        for _, record in self.iter_with_offsets(newest_first):
+            yield record
+
+    def iter_with_offsets(self, newest_first=False):
+        if not os.path.exists(self.log_file):
+            return
+        if newest_first:
+            yield from self.iter_newest_first()
+            return
+
+        offset = 0
+        try:
+            with open(self.log_file, 'rb') as f:
+                for line in f:
+                    line_offset = offset
+                    offset += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        yield line_offset, json.loads(line)
+                    except json.JSONDecodeError:
+                        # Skip a torn trailing write instead of failing the whole history
+                        continue
+        finally:
+            count_io(self.log_file, read=offset)
+
+    # Walk the offset index backwards: newest record first, one seek per record
+    def iter_newest_first(self):
+        self.sync_index()
+        yield from self.read_offsets(reversed(self.offsets))
+
+    # Records written after the given offset (the log is append-only, so offsets only grow)
+    def iter_after(self, offset):
+        self.sync_index()
+        start = bisect_right(self.offsets, offset)
+        if start < len(self.offsets):
+            yield from self.read_offsets(self.offsets[start:])
+
+    def read_at(self, offset):
+        for _, record in self.read_offsets([offset]):
+            return record
+        return None
+
+    # One seek and one line per offset
+    def read_offsets(self, offsets):
+        read = 0
+        try:
+            with open(self.log_file, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    line = f.readline()
+                    read += len(line)
+                    try:
+                        yield offset, json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        finally:
+            count_io(self.log_file, read=read)
+
+    # Order index, brought up to date with records appended since the last call
+    @timed
+    def order_index(self):
+        if self.index is None:
+            self.index = OrderIndex()
+        return self.index.refresh(self)
+
+    # Time index, brought up to date with records appended since it was saved
+    @timed
+    def time_index(self):
+        self.sync_index()
+        if self.times is None:
+            self.times = TimeIndex.load(self.time_index_file, self.offsets)
+        self.times.refresh(self).save(self.time_index_file)
+        return self.times
+
+    # Records with start <= epoch < end, oldest first (or newest first); reads only the matching lines
+    def iter_between(self, start=None, end=None, newest_first=False):
+        offsets = self.time_index().between(start, end)
+        if newest_first:
+            offsets = reversed(offsets)
+        for _, record in self.read_offsets(offsets):
+            yield record
+
+    def drop_time_index(self):
+        self.times = None
+        if os.path.exists(self.time_index_file):
+            os.remove(self.time_index_file)
+
+    # Converter: give every record an "epoch" field; returns the number of records changed.
+    # Rewriting moves offsets, so orders still identified by their offset keep that ID explicitly.
+    def upgrade_timestamps(self):
+        if not os.path.exists(self.log_file):
+            return 0
+        upgraded = 0
+        with file_lock(self.log_file):
+            temp_file = self.log_file + ".tmp"
+            with open(temp_file, 'w') as out:
+                for offset, record in self.iter_with_offsets():
+                    if "epoch" not in record:
+                        record["epoch"] = parse_timestamp(record.get("timestamp"))
+                        if record.get("type", "purchase") == "purchase":
+                            record["order_id"] = order_id_of(offset, record)
+                        upgraded += 1
+                    out.write(json.dumps(record) + "\n")
+            if not upgraded:
+                os.remove(temp_file)
+                return 0
+            os.replace(temp_file, self.log_file)
+            count_io(self.log_file, written=os.path.getsize(self.log_file))
+            self.rebuild_index()
+            self.index = None
+            self.drop_time_index()
+        return upgraded
+
+
+# Purchase history split into one log per username
+class ShardedPurchaseHistory:
+
+    # Shard for records without a username. quote() always escapes "%", so a "%" followed by
+    # letters never comes out of a registered username.
+    SHARED_SHARD = "%shared"
+    # Name the shared shard had before; a user may register it
+    OLD_SHARED_SHARD = "_shared"
+
+    def __init__(self, directory=None):
+        self.directory = directory or config.purchase_history_dir
+        self.shards = {}
+        self.listeners = []
+        os.makedirs(self.directory, exist_ok=True)
+        self.times = ShardTimeIndex(self.directory)
+        self.migrate_shared_log()
+        self.move_old_shared_shard()
+
+    # Usernames are URL-quoted into file names; usernames() reverses it
+    def shard_file(self, username):
+        name = quote(username, safe="") if username else self.SHARED_SHARD
+        return os.path.join(self.directory, name + ".jsonl")
+
+    def for_user(self, username):
+        username = username or None
+        shard = self.shards.get(username)
+        if shard is None:
+            shard = self.shards[username] = PurchaseHistory(self.shard_file(username), listeners=self.listeners)
+        return shard
+
+    # Register a HistoryListener for appends to any shard
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def __len__(self):
+        return sum(len(self.for_user(username)) for username in self.usernames())
+
+    def usernames(self):
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".jsonl"):
+                name = name[:-len(".jsonl")]
+                yield None if name == self.SHARED_SHARD else unquote(name)
+
+    # Records are routed by their "username" field; one append per shard
+    def append(self, record):
+        self.extend([record])
+
+    # The time index lock is held across the shard writes, so its entries follow the logs exactly
+    def extend(self, records):
+        by_user = {}
+        for record in records:
+            by_user.setdefault(record.get("username"), []).append(record)
+        if not by_user:
+            return
+        with file_lock(self.times.path):
+            self.times.load_locked(self.shard_files())
+            for username, user_records in by_user.items():
+                shard = self.for_user(username)
+                offsets = shard.extend(user_records)
+                self.times.append_locked(os.path.basename(shard.log_file), user_records, offsets)
+
+    def iter_records(self):
+        for username in self.usernames():
+            yield from self.for_user(username).iter_records()
+
+    # (shard file name, shard) for every shard on disk
+    def shard_files(self):
+        for username in self.usernames():
+            shard = self.for_user(username)
+            yield os.path.basename(shard.log_file), shard
+
+    # Records of every user with start <= epoch < end, in time order, found through the time index
+    @timed
+    def iter_between(self, start=None, end=None, newest_first=False):
+        with file_lock(self.times.path):
+            names, shard_numbers, offsets = self.times.load_locked(self.shard_files()).between(start, end)
+        locations = zip(shard_numbers, offsets)
+        return self.read_locations(names, reversed(list(locations)) if newest_first else locations)
+
+    # One seek and one line per (shard number, offset); each shard file is opened once
+    def read_locations(self, names, locations):
+        files = {}
+        try:
+            for shard_number, offset in locations:
+                f = files.get(shard_number)
+                if f is None:
+                    f = files[shard_number] = open(os.path.join(self.directory, names[shard_number]), 'rb')
+                f.seek(offset)
+                line = f.readline()
+                count_io(f.name, read=len(line))
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+        finally:
+            for f in files.values():
+                f.close()
+
+    def upgrade_timestamps(self):
+        with file_lock(self.times.path):
+            upgraded = sum(self.for_user(username).upgrade_timestamps() for username in self.usernames())
+            if upgraded:
+                self.times.drop_locked()
+        return upgraded
+
+    # One-shot split of the single shared log (and the older JSON array file) into shards
+    def migrate_shared_log(self):
+        marker = os.path.join(self.directory, ".migrated")
+        if os.path.exists(marker):
+            return
+
+        shared_log = PurchaseHistory(config.purchase_log_file, config.purchase_history_file)
+        self.extend(shared_log.iter_records())
+        with open(marker, 'w') as f:
+            f.write(shared_log.log_file + "\n")
+
+    # One-shot move of "_shared.jsonl" from earlier layouts: records without a username go to the
+    # shared shard, those of a user actually called "_shared" stay in theirs. Rewriting moves
+    # offsets, so orders still identified by their offset keep that ID explicitly.
+    def move_old_shared_shard(self):
+        old_file = os.path.join(self.directory, self.OLD_SHARED_SHARD + ".jsonl")
+        if not os.path.exists(old_file) or os.path.exists(self.shard_file(None)):
+            return
+
+        old_shard = PurchaseHistory(old_file)
+        anonymous, own = [], []
+        for offset, record in old_shard.iter_with_offsets():
+            if record.get("type", "purchase") == "purchase":
+                record["order_id"] = order_id_of(offset, record)
+            (own if record.get("username") else anonymous).append(record)
+        if not anonymous:
+            return
+
+        self.extend(anonymous)
+        with file_lock(self.times.path), file_lock(old_file):
+            self.times.drop_locked()
+            old_shard.drop_time_index()
+            if not own:
+                os.remove(old_file)
+                os.remove(old_shard.index_file)
+                return
+            temp_file = old_file + ".tmp"
+            with open(temp_file, 'w') as out:
+                for record in own:
+                    out.write(json.dumps(record) + "\n")
+            os.replace(temp_file, old_file)
+            old_shard.rebuild_index()
+
+
+if __name__ == "__main__":
+    history = ShardedPurchaseHistory()
+    print(f"Purchase history ready: {len(history)} records in {history.directory}")
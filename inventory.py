@@ -0,0 +1,159 @@
+from models import Product
+
+
+# Base for secondary indexes kept in step with a ProductCatalog
+class CatalogListener:
+
+    def product_added(self, product):
+        pass
+
+    def product_changed(self, product, previous):
+        pass
+
+    def product_removed(self, product):
+        pass
+
+    def stock_changed(self, product, size, old_quantity):
+        pass
+
+
+def stock_units(stock):
+    return sum(stock.values())
+
+
+# Running inventory aggregates, updated with O(1) deltas
+class InventoryTotals(CatalogListener):
+
+    def __init__(self):
+        self.total_units = 0
+        self.total_value = 0.0
+        # Product ID -> units across all sizes
+        self.product_units = {}
+
+    def units_for(self, product_id):
+        return self.product_units.get(product_id, 0)
+
+    def product_added(self, product):
+        units = stock_units(product["stock"])
+        self.product_units[product["id"]] = units
+        self.total_units += units
+        self.total_value += product["price"] * units
+
+    def product_removed(self, product):
+        units = self.product_units.pop(product["id"], 0)
+        self.total_units -= units
+        self.total_value -= product["price"] * units
+
+    def product_changed(self, product, previous):
+        self.product_removed(previous)
+        self.product_added(product)
+
+    def stock_changed(self, product, size, old_quantity):
+        delta = product["stock"][size] - old_quantity
+        self.product_units[product["id"]] += delta
+        self.total_units += delta
+        self.total_value += product["price"] * delta
+
+
+class ProductCatalog:
+
+    def __init__(self, products=()):
+        # Products keyed by ID (insertion ordered, so the catalog keeps its display order)
+        self.by_id = {}
+        # Lowercased product name -> product
+        self.by_name = {}
+        # Highest ID ever handed out; IDs of deleted products are not reused
+        self.max_id = 0
+        # Secondary indexes notified on every add / edit / delete
+        self.listeners = []
+        self.totals = InventoryTotals()
+        self.subscribe(self.totals)
+
+        for product in products:
+            self.add(product)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, product_id):
+        return product_id in self.by_id
+
+    # Plain dicts in the catalog.json format
+    def to_list(self):
+        return [product.to_dict() for product in self.by_id.values()]
+
+    # Register a secondary index (a CatalogListener)
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    # Lookups
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+    def find_by_name(self, name):
+        return self.by_name.get(name.lower())
+
+    def name_exists(self, name):
+        return name.lower() in self.by_name
+
+    def next_id(self):
+        return self.max_id + 1
+
+    # Add / Edit / Delete (keep every index in step with the products)
+    # Plain dicts are stored as compact Product objects; the stored Product is returned
+    def add(self, product):
+        if not isinstance(product, Product):
+            product = Product.from_dict(product)
+        product_id = product["id"]
+        if product_id in self.by_id:
+            raise ValueError(f"Duplicate product ID {product_id}")
+
+        self.by_id[product_id] = product
+        self.by_name.setdefault(product["name"].lower(), product)
+        self.max_id = max(self.max_id, product_id)
+        for listener in self.listeners:
+            listener.product_added(product)
+        return product
+
+    def update(self, product, **changes):
+        new_name = changes.get("name", product["name"])
+        old_key = product["name"].lower()
+        new_key = new_name.lower()
+
+        if new_key != old_key and new_key in self.by_name:
+            raise ValueError(f'Product Name "{new_name}" already exists')
+
+        # Built and checked on its own first: a bad value leaves the product and indexes as they were
+        previous = product.to_dict()
+        updated = Product.from_dict({**previous, **changes})
+        product.assign(updated)
+        if new_key != old_key:
+            if self.by_name.get(old_key) is product:
+                del self.by_name[old_key]
+            self.by_name[new_key] = product
+
+        for listener in self.listeners:
+            listener.product_changed(product, previous)
+        return product
+
+    def remove(self, product_id):
+        product = self.by_id.pop(product_id, None)
+        if product is None:
+            return None
+
+        if self.by_name.get(product["name"].lower()) is product:
+            del self.by_name[product["name"].lower()]
+        for listener in self.listeners:
+            listener.product_removed(product)
+        return product
+
+    # Change the stock of one size (checkout, returns) and notify the indexes
+    def adjust_stock(self, product, size, delta):
+        old_quantity = product["stock"].get(size, 0)
+        product["stock"][size] = old_quantity + delta
+        for listener in self.listeners:
+            listener.stock_changed(product, size, old_quantity)
+        return product["stock"][size]
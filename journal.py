@@ -0,0 +1,108 @@
+import json
+import os
+
+from metrics import count_io
+
+# Journal operations (one JSON object per line):
+#   {"op": "stock", "base": V, "id": 1, "size": "M", "delta": -2}
+#   {"op": "upsert", "base": V, "product": {...}}
+#   {"op": "delete", "base": V, "id": 1}
+# "base" is the snapshot version the entry was written against; entries with another
+# base were already folded into a newer snapshot and are skipped on replay.
+
+
+def op_product_id(op):
+    return op["product"]["id"] if op["op"] == "upsert" else op["id"]
+
+
+# Replay one operation onto plain products keyed by ID (used while loading)
+def apply_to_products(products_by_id, op):
+    if op["op"] == "stock":
+        product = products_by_id.get(op["id"])
+        if product is not None:
+            product["stock"][op["size"]] = product["stock"].get(op["size"], 0) + op["delta"]
+    elif op["op"] == "upsert":
+        products_by_id[op["product"]["id"]] = op["product"]
+    elif op["op"] == "delete":
+        products_by_id.pop(op["id"], None)
+
+
+# Replay one operation onto a live ProductCatalog (through its indexes)
+def apply_to_catalog(catalog, op):
+    if op["op"] == "stock":
+        product = catalog.get(op["id"])
+        if product is not None:
+            catalog.adjust_stock(product, op["size"], op["delta"])
+    elif op["op"] == "upsert":
+        product = op["product"]
+        current = catalog.get(product["id"])
+        if current is None:
+            catalog.add(product)
+        else:
+            catalog.update(current, name=product["name"], price=product["price"], sizes=product["sizes"], stock=product["stock"])
+    elif op["op"] == "delete":
+        catalog.remove(op["id"])
+
+
+class CatalogJournal:
+
+    def __init__(self, path):
+        self.path = path
+        # Bytes of the journal already applied by this process
+        self.offset = 0
+        # Entries currently in the journal file (drives compaction)
+        self.entries = 0
+
+    # Read complete entries written after the given offset; a torn final line is cut off
+    def read_from(self, offset):
+        ops = []
+        if not os.path.exists(self.path):
+            return ops, offset
+
+        start = offset
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if line.strip():
+                    ops.append(json.loads(line))
+        count_io(self.path, read=offset - start)
+
+        if os.path.getsize(self.path) > offset:
+            # Left behind by a crash mid-append; callers hold the catalog lock
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+        return ops, offset
+
+    # Read everything appended since this process last looked
+    def read_new(self):
+        ops, self.offset = self.read_from(self.offset)
+        self.entries += len(ops)
+        return ops
+
+    def read_all(self):
+        self.offset = 0
+        self.entries = 0
+        return self.read_new()
+
+    # Durable append: the entries are on disk before the save returns
+    def append(self, ops):
+        if not ops:
+            return
+        data = "".join(json.dumps(op) + "\n" for op in ops).encode()
+        with open(self.path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        count_io(self.path, written=len(data))
+        self.offset += len(data)
+        self.entries += len(ops)
+
+    def truncate(self):
+        with open(self.path, 'wb') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.offset = 0
+        self.entries = 0
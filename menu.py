@@ -0,0 +1,91 @@
+import sys
+from itertools import chain, repeat
+
+# State name that ends the session
+EXIT = None
+
+
+# One menu screen: numbered options, each an action plus the state to go to afterwards
+class Menu:
+
+    def __init__(self, name, header, options):
+        self.name = name
+        # Lines printed above the options
+        self.header = header
+        # [(label, action or None, next state)]; an action may return a state to override next state
+        self.options = options
+
+    def show(self):
+        lines = list(self.header)
+        lines += [f"\t{number}.  {label}" for number, (label, _, _) in enumerate(self.options, start=1)]
+        print("\n".join(lines))
+
+        choice = input("\n\033[1m  Enter your choice: \033[0m").strip()
+        if not choice.isdigit() or not 1 <= int(choice) <= len(self.options):
+            print("\n\033[31m Sorry, invalid option. Please try again.\033[0m")
+            return self.name
+
+        label, action, next_state = self.options[int(choice) - 1]
+        if action is not None:
+            result = action()
+            if isinstance(result, str):
+                return result
+        return next_state
+
+
+# Iterative dispatcher: every screen returns the next state, so the stack never grows with the session
+class MenuMachine:
+
+    def __init__(self, states, start):
+        # State name -> Menu, or a callable returning the next state name
+        self.states = states
+        self.start = start
+        self.transitions = 0
+        self.max_depth = 0
+
+    def run(self, state=None):
+        state = state or self.start
+        try:
+            while state is not EXIT:
+                handler = self.states[state]
+                state = handler.show() if isinstance(handler, Menu) else handler()
+                self.transitions += 1
+                self.max_depth = max(self.max_depth, frame_depth())
+        except EOFError:
+            # End of piped or scripted input
+            print("\n\033[33mInput finished. Exiting from the System...\033[0m")
+
+
+def frame_depth():
+    depth = 0
+    frame = sys._getframe()
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+# input() replacement answering prompts from a script (unattended soak runs, benchmarks)
+class ScriptedInput:
+
+    def __init__(self, answers=(), repeat_count=1):
+        self.answers = chain.from_iterable(repeat(list(answers), repeat_count))
+        self.answered = 0
+
+    @classmethod
+    def from_file(cls, path, repeat_count=1):
+        with open(path, 'r') as f:
+            return cls([line.rstrip("\n") for line in f], repeat_count)
+
+    def feed(self, *answers):
+        self.answers = iter(answers)
+
+    def __call__(self, prompt=""):
+        try:
+            answer = next(self.answers)
+        except StopIteration:
+            raise EOFError("Input script finished")
+        self.answered += 1
+        # Echo like a terminal would, so transcripts read the same as a live session
+        sys.stdout.write(f"{prompt}{answer}\n")
+        return answer
@@ -0,0 +1,114 @@
+import json
+from functools import wraps
+from time import perf_counter_ns
+
+import config
+
+# Read once at start-up: when off, @timed returns the method unchanged and count_io returns at once
+ENABLED = config.metrics_enabled
+
+
+# Call count, total time and a log-scale latency histogram for one operation
+class LatencyHistogram:
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        # Bucket index -> calls; four buckets per power of two of nanoseconds (each about 19% wide)
+        self.buckets = {}
+
+    def add(self, ns):
+        self.calls += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        bits = ns.bit_length()
+        index = bits * 4 + ((ns >> (bits - 3)) & 3 if bits > 3 else 0)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    @staticmethod
+    def upper_bound(index):
+        bits, sub = divmod(index, 4)
+        if bits <= 3:
+            return (1 << bits) - 1
+        return ((5 + sub) << (bits - 3)) - 1
+
+    # Latency (ns) below which the given fraction of calls finished
+    def percentile(self, fraction):
+        target = fraction * self.calls
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(self.upper_bound(index), self.max_ns)
+        return self.max_ns
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "total_seconds": self.total_ns / 1e9,
+            "mean_ms": self.total_ns / self.calls / 1e6 if self.calls else 0.0,
+            "p50_ms": self.percentile(0.50) / 1e6,
+            "p95_ms": self.percentile(0.95) / 1e6,
+            "p99_ms": self.percentile(0.99) / 1e6,
+            "max_ms": self.max_ns / 1e6
+        }
+
+
+class Metrics:
+
+    def __init__(self):
+        # Operation name -> LatencyHistogram
+        self.operations = {}
+        # File path -> [bytes read, bytes written]
+        self.files = {}
+
+    def operation(self, name):
+        histogram = self.operations.get(name)
+        if histogram is None:
+            histogram = self.operations[name] = LatencyHistogram()
+        return histogram
+
+    def count_io(self, path, read, written):
+        counts = self.files.get(path)
+        if counts is None:
+            counts = self.files[path] = [0, 0]
+        counts[0] += read
+        counts[1] += written
+
+    def to_dict(self):
+        return {
+            "operations": {name: histogram.to_dict() for name, histogram in sorted(self.operations.items())},
+            "files": {path: {"bytes_read": read, "bytes_written": written} for path, (read, written) in sorted(self.files.items())}
+        }
+
+    def export(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+
+METRICS = Metrics()
+
+
+# Method decorator recording the latency of every call under Class.method
+def timed(function):
+    if not ENABLED:
+        return function
+
+    histogram = METRICS.operation(function.__qualname__)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        started = perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.add(perf_counter_ns() - started)
+    return wrapper
+
+
+# Bytes read from / written to a data file
+def count_io(path, read=0, written=0):
+    if ENABLED:
+        METRICS.count_io(path, read, written)
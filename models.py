@@ -0,0 +1,184 @@
+import sys
+from array import array
+from collections.abc import Mapping, MutableMapping
+
+
+# Every distinct size string is stored once; products keep small integer codes
+class SizeVocabulary:
+
+    def __init__(self):
+        self.codes = {}
+        self.sizes = []
+        # Identical code tuples are shared, so products with the same size set pay for it once
+        self.code_tuples = {}
+
+    def code(self, size):
+        code = self.codes.get(size)
+        if code is None:
+            code = self.codes[size] = len(self.sizes)
+            self.sizes.append(sys.intern(size))
+        return code
+
+    def size(self, code):
+        return self.sizes[code]
+
+    def code_tuple(self, sizes):
+        return self.share(tuple(self.code(size) for size in sizes))
+
+    def share(self, codes):
+        return self.code_tuples.setdefault(codes, codes)
+
+
+SIZES = SizeVocabulary()
+
+
+# Live dict-like view of a product's per-size stock (backed by the product's count array)
+class StockView(MutableMapping):
+    __slots__ = ("product",)
+
+    def __init__(self, product):
+        self.product = product
+
+    def position(self, size):
+        code = SIZES.codes.get(size)
+        if code is None:
+            return -1
+        try:
+            return self.product.stock_codes.index(code)
+        except ValueError:
+            return -1
+
+    def __getitem__(self, size):
+        position = self.position(size)
+        if position < 0:
+            raise KeyError(size)
+        return self.product.counts[position]
+
+    def __setitem__(self, size, quantity):
+        position = self.position(size)
+        if position < 0:
+            self.product.stock_codes = SIZES.share(self.product.stock_codes + (SIZES.code(size),))
+            self.product.counts.append(quantity)
+        else:
+            self.product.counts[position] = quantity
+
+    def __delitem__(self, size):
+        position = self.position(size)
+        if position < 0:
+            raise KeyError(size)
+        codes = self.product.stock_codes
+        self.product.stock_codes = SIZES.share(codes[:position] + codes[position + 1:])
+        del self.product.counts[position]
+
+    def __iter__(self):
+        return (SIZES.size(code) for code in self.product.stock_codes)
+
+    def __len__(self):
+        return len(self.product.stock_codes)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def values(self):
+        return list(self.product.counts)
+
+
+class Product(MutableMapping):
+    FIELDS = ("id", "name", "price", "sizes", "stock")
+    __slots__ = ("id", "name", "price", "size_codes", "stock_codes", "counts")
+
+    def __init__(self, product_id, name, price, sizes=(), stock=None):
+        self.id = product_id
+        self.name = name
+        self.price = price
+        self.set_sizes(sizes)
+        self.set_stock(stock or {})
+
+    @classmethod
+    def from_dict(cls, data):
+        stock = data.get("stock", {})
+        if not isinstance(stock, Mapping):
+            # Old single-number stock: keep it on the first size
+            sizes = data.get("sizes") or [""]
+            stock = {sizes[0]: stock}
+        return cls(data["id"], data["name"], data["price"], data.get("sizes", []), stock)
+
+    # Plain dict in the catalog.json format (a copy, safe to serialize or keep)
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "price": self.price,
+            "sizes": [SIZES.size(code) for code in self.size_codes],
+            "stock": {SIZES.size(code): count for code, count in zip(self.stock_codes, self.counts)}
+        }
+
+    def set_sizes(self, sizes):
+        self.size_codes = SIZES.code_tuple(sizes)
+
+    # 64-bit counts: a quantity that does not fit raises OverflowError instead of wrapping
+    def set_stock(self, stock):
+        counts = array('q', stock.values())
+        self.stock_codes = SIZES.code_tuple(stock)
+        self.counts = counts
+
+    # Take every field of another product (this object stays the one the catalog indexes hold)
+    def assign(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(other, name))
+
+    # Dict-compatible access: product['name'], product['stock'][size] -= 1, product.update(...)
+    def __getitem__(self, key):
+        if key == "sizes":
+            return [SIZES.size(code) for code in self.size_codes]
+        if key == "stock":
+            return StockView(self)
+        if key in ("id", "name", "price"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "sizes":
+            self.set_sizes(value)
+        elif key == "stock":
+            self.set_stock(dict(value))
+        elif key in ("id", "name", "price"):
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        raise KeyError(f"Product field {key} cannot be removed")
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return f"Product({self.to_dict()})"
+
+
+# One cart entry; the same keys as the old cart dicts
+class CartLine:
+    __slots__ = ("product", "size", "quantity")
+
+    def __init__(self, product, size, quantity):
+        self.product = product
+        self.size = size
+        self.quantity = quantity
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
@@ -0,0 +1,243 @@
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import config
+from inventory import CatalogListener
+
+OVERSOLD_MESSAGE = "Sorry! Requested quantity exceeds available stock."
+
+
+# Striped locks: each (product ID, size) maps to one of a fixed set of locks
+class SkuLocks:
+
+    def __init__(self, stripes=None):
+        self.locks = [threading.Lock() for _ in range(stripes or config.sku_lock_stripes)]
+
+    def stripe(self, sku):
+        return hash(sku) % len(self.locks)
+
+    def lock_for(self, sku):
+        return self.locks[self.stripe(sku)]
+
+    # Hold the locks of several SKUs; always taken in stripe order so two carts cannot deadlock
+    @contextmanager
+    def holding(self, skus):
+        stripes = sorted({self.stripe(sku) for sku in skus})
+        for stripe in stripes:
+            self.locks[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self.locks[stripe].release()
+
+
+# Thread-safe reservations and checkout on top of a Catalog
+class OrderService:
+
+    def __init__(self, catalog, ttl=None):
+        # A Catalog instance (its ProductCatalog, storage and purchase history are used)
+        self.catalog = catalog
+        self.products = catalog.catalog
+        self.ttl = ttl or config.reservation_ttl_seconds
+        self.locks = SkuLocks()
+        # (product ID, size) -> {cart ID: (quantity, expiry time)}; each SKU's entry is guarded by its lock
+        self.reservations = {}
+        # Catalog indexes are shared by every SKU, so applying stock changes is serialized (briefly)
+        self.catalog_lock = threading.Lock()
+        # Group commit: whichever thread holds save_lock writes every pending record in one save
+        self.save_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+        self.pending = []
+
+    # Quantity held by other carts (expired holds are dropped); caller holds the SKU lock
+    def reserved(self, sku, now, cart_id=None):
+        holds = self.reservations.get(sku)
+        if not holds:
+            return 0
+        for holder in [holder for holder, (_, expires) in holds.items() if expires <= now]:
+            del holds[holder]
+        return sum(quantity for holder, (quantity, _) in holds.items() if holder != cart_id)
+
+    def available(self, product, size, cart_id=None):
+        sku = (product["id"], size)
+        with self.locks.lock_for(sku):
+            return product["stock"].get(size, 0) - self.reserved(sku, time.monotonic(), cart_id)
+
+    # Hold stock for a cart line until checkout or expiry; returns an error message or None
+    def reserve(self, cart_id, product, size, quantity):
+        sku = (product["id"], size)
+        with self.locks.lock_for(sku):
+            now = time.monotonic()
+            if quantity > product["stock"].get(size, 0) - self.reserved(sku, now, cart_id):
+                return OVERSOLD_MESSAGE
+            # Adding the same product and size again replaces the earlier hold, like the cart line
+            self.reservations.setdefault(sku, {})[cart_id] = (quantity, now + self.ttl)
+        return None
+
+    def release_cart(self, cart_id, cart):
+        for line in cart.values():
+            sku = (line["product"]["id"], line["size"])
+            with self.locks.lock_for(sku):
+                self.reservations.get(sku, {}).pop(cart_id, None)
+
+    # Price, deduct, then save; returns (record, None) or (None, error message)
+    def checkout(self, cart_id, cart, build_record):
+        # Priced before any stock moves, so a pricing error leaves the catalog as it was
+        record = build_record(cart)
+        error = self.deduct(cart_id, cart)
+        if error:
+            return None, error
+        error = self.persist(cart, record)
+        if error:
+            return None, error
+        return record, None
+
+    # All lines or none: every SKU of the cart is locked, checked, then deducted (in memory only)
+    def deduct(self, cart_id, cart):
+        skus = [(line["product"]["id"], line["size"]) for line in cart.values()]
+        with self.locks.holding(skus):
+            now = time.monotonic()
+            for line in cart.values():
+                product, size = line["product"], line["size"]
+                if line["quantity"] > product["stock"].get(size, 0) - self.reserved((product["id"], size), now, cart_id):
+                    return f"{product['name']} ({size}): {OVERSOLD_MESSAGE}"
+
+            with self.catalog_lock:
+                for line in cart.values():
+                    self.products.adjust_stock(line["product"], line["size"], -line["quantity"])
+            for sku in skus:
+                self.reservations.get(sku, {}).pop(cart_id, None)
+        return None
+
+    # Save stock and history; concurrent checkouts share one save. Returns an error message when
+    # other sessions sold the stock first (the cart's deduction has then been rolled back).
+    def persist(self, cart, record):
+        entry = {"cart": cart, "record": record, "error": None}
+        with self.pending_lock:
+            self.pending.append(entry)
+
+        with self.save_lock:
+            with self.pending_lock:
+                entries, self.pending = self.pending, []
+            # Empty when another thread's save already included this checkout
+            if entries:
+                self.commit(entries)
+        return entry["error"]
+
+    # Save several deducted carts at once (batch orders); each entry is {"cart", "record", "error"}
+    # and the carts other sessions' sales left short come back with "error" set
+    def persist_all(self, entries):
+        with self.save_lock:
+            self.commit(entries)
+
+    # Under the catalog's file lock (or transaction): replay what other sessions saved, undo the
+    # carts their sales left short (newest first), then save stock and the accepted records
+    def commit(self, entries):
+        store = self.catalog.catalog_store
+        with self.catalog_lock, self.catalog.storage.transaction(), store.locked():
+            store.catch_up()
+            for entry in reversed(entries):
+                short = [line for line in entry["cart"].values() if line["product"]["stock"].get(line["size"], 0) < 0]
+                if short:
+                    for line in entry["cart"].values():
+                        self.products.adjust_stock(line["product"], line["size"], line["quantity"])
+                    entry["error"] = f"{short[0]['product']['name']} ({short[0]['size']}): {OVERSOLD_MESSAGE}"
+
+            self.catalog.save_catalog()
+            records = [entry["record"] for entry in entries if entry["error"] is None]
+            if records:
+                self.catalog.purchase_history.extend(records)
+
+
+# Fails loudly if any stock level is ever seen below zero
+class NegativeStockWatch(CatalogListener):
+
+    def __init__(self):
+        self.violations = []
+
+    def stock_changed(self, product, size, old_quantity):
+        if product["stock"][size] < 0:
+            self.violations.append((product["id"], size, product["stock"][size]))
+
+
+# Many threads reserving and checking out overlapping carts against a small synthetic catalog
+def stress(threads=16, orders=2000, products=20, seed=0):
+    from benchmark import generate_dataset, use_directory
+    from catalog import Catalog
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_dataset(directory, products, 0, users=1, seed=seed)
+        with use_directory(directory):
+            catalog = Catalog(None)
+            watch = NegativeStockWatch()
+            catalog.catalog.subscribe(watch)
+            service = catalog.orders
+            initial_units = catalog.catalog.totals.total_units
+            outcomes = {"accepted": 0, "rejected": 0}
+            sold = [0]
+            counter_lock = threading.Lock()
+
+            def shopper(number):
+                rng = random.Random(seed * 100003 + number)
+                cart_id = f"stress-{number}"
+                cart = {}
+                for _ in range(rng.randint(1, 3)):
+                    product = catalog.catalog.get(rng.randint(1, products))
+                    size = rng.choice(product["sizes"])
+                    quantity = rng.randint(1, 3)
+                    if service.reserve(cart_id, product, size, quantity) is None:
+                        catalog.add_cart_line(cart, product, size, quantity)
+                if not cart:
+                    with counter_lock:
+                        outcomes["rejected"] += 1
+                    return
+                record, error = service.checkout(cart_id, cart, lambda cart: catalog.build_purchase_record(cart, "stress"))
+                with counter_lock:
+                    outcomes["rejected" if error else "accepted"] += 1
+                    if not error:
+                        sold[0] += sum(line["quantity"] for line in cart.values())
+                if error:
+                    service.release_cart(cart_id, cart)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(shopper, range(orders)))
+            elapsed = time.perf_counter() - started
+
+            # Reload from disk: the saved stock must match what was sold
+            saved = Catalog(None).catalog
+            negative = [(product["id"], size, quantity) for product in saved for size, quantity in product["stock"].items() if quantity < 0]
+            final_units = saved.totals.total_units
+
+    return {
+        "threads": threads,
+        "orders": orders,
+        "accepted": outcomes["accepted"],
+        "rejected": outcomes["rejected"],
+        "units_sold": sold[0],
+        "units_accounted": initial_units - final_units == sold[0],
+        "negative_stock": watch.violations + negative,
+        "orders_per_second": round(orders / elapsed, 2)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Order service stress check: concurrent checkouts must never oversell.")
+    parser.add_argument("command", choices=["stress"])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=20, help="Few products means heavy contention")
+    args = parser.parse_args()
+
+    result = stress(args.threads, args.orders, args.products)
+    print(json.dumps(result, indent=4))
+    if result["negative_stock"] or not result["units_accounted"]:
+        print("\033[31m Stock went negative or does not add up!\033[0m")
+        raise SystemExit(1)
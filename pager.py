@@ -0,0 +1,91 @@
+import sys
+from bisect import bisect_left, insort
+from itertools import islice
+
+import config
+from inventory import CatalogListener
+
+
+class Pager:
+
+    def __init__(self, page_size=None, output=None):
+        self.page_size = page_size or config.page_size
+        self.output = output or sys.stdout
+
+    def page_count(self, total):
+        return max(1, -(-total // self.page_size))
+
+    # One buffered write per page instead of one print() per row
+    def write(self, lines):
+        self.output.write("\n".join(lines) + "\n")
+        self.output.flush()
+
+    # Lazily split any iterable into pages; yields (rows, more_pages_follow)
+    def iter_pages(self, rows):
+        rows = iter(rows)
+        page = list(islice(rows, self.page_size))
+        while page:
+            next_page = list(islice(rows, self.page_size))
+            yield page, bool(next_page)
+            page = next_page
+
+
+# Formatted catalog rows and sort orders, kept current through catalog notifications
+class CatalogView(CatalogListener):
+
+    SORT_ORDERS = ("id", "name", "price")
+
+    def __init__(self, catalog, price_keys):
+        self.catalog = catalog
+        # Product ID -> formatted table row (dropped when the product or its stock changes)
+        self.rows = {}
+        self.ids = sorted(product["id"] for product in catalog)
+        self.name_keys = sorted((product["name"].lower(), product["id"]) for product in catalog)
+        # The filter index already keeps (price, id) sorted; reuse it for the price order
+        self.price_keys = price_keys
+        catalog.subscribe(self)
+
+    def product_added(self, product):
+        insort(self.ids, product["id"])
+        insort(self.name_keys, (product["name"].lower(), product["id"]))
+
+    def product_removed(self, product):
+        self.rows.pop(product["id"], None)
+        self.discard(self.ids, product["id"])
+        self.discard(self.name_keys, (product["name"].lower(), product["id"]))
+
+    def product_changed(self, product, previous):
+        self.product_removed(previous)
+        self.product_added(product)
+
+    def stock_changed(self, product, size, old_quantity):
+        self.rows.pop(product["id"], None)
+
+    @staticmethod
+    def discard(keys, key):
+        position = bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, product_id):
+        row = self.rows.get(product_id)
+        if row is None:
+            item = self.catalog.get(product_id)
+            sizes = ", ".join(item['sizes'])
+            total_stock = self.catalog.totals.units_for(product_id)
+            row = self.rows[product_id] = f"{item['id']:<5} {item['name']:<10} Ұ{item['price']:<10,.2f} {sizes:<12} {total_stock:<6}"
+        return row
+
+    # Rows of one page (0-based) in the chosen order; only that page is formatted
+    def page(self, number, page_size, order="id"):
+        start = number * page_size
+        if order == "name":
+            ids = [product_id for _, product_id in self.name_keys[start:start + page_size]]
+        elif order == "price":
+            ids = [product_id for _, product_id in self.price_keys[start:start + page_size]]
+        else:
+            ids = self.ids[start:start + page_size]
+        return [self.row(product_id) for product_id in ids]
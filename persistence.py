@@ -0,0 +1,498 @@
+import json
+import os
+import pickle
+import threading
+import zlib
+from contextlib import contextmanager, nullcontext
+
+import config
+from inventory import CatalogListener
+from journal import CatalogJournal, apply_to_catalog, apply_to_products, op_product_id
+from metrics import count_io, timed
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: fall back to msvcrt byte-range locks
+    fcntl = None
+    import msvcrt
+
+
+# Advisory lock shared by every process using the same data file
+@contextmanager
+def file_lock(path):
+    with open(path + ".lock", 'a+b') as lock:
+        if fcntl:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        else:
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Write a whole file so readers only ever see the old or the new content
+def write_atomic(path, text):
+    temp_file = path + ".tmp"
+    data = text.encode()
+    with open(temp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+    count_io(path, written=len(data))
+
+
+class VersionedJSONFile:
+
+    # Documents are stored as {"version": N, key: data}; files without a stamp are version 0
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        # Pickled copy of the parsed document, used while the JSON file's (mtime, size) is unchanged
+        self.cache_file = path + ".cache"
+        # Version this process last read or wrote
+        self.version = None
+        self.stamp = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self):
+        stamp = self.file_stamp()
+        cached = self.read_cache(stamp)
+        if cached is not None:
+            return cached
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        count_io(self.path, read=len(data))
+        document = json.loads(data)
+        if isinstance(document, dict) and set(document) == {"version", self.key}:
+            version, document = document["version"], document[self.key]
+        else:
+            version = 0
+        self.write_cache(stamp, version, document)
+        return version, document
+
+    # The stamp is pickled first, so a stale cache is rejected without loading the data
+    def read_cache(self, stamp):
+        if not config.snapshot_cache or stamp is None:
+            return None
+        try:
+            with open(self.cache_file, 'rb') as f:
+                if pickle.load(f) != stamp:
+                    return None
+                cached = pickle.load(f)
+                count_io(self.cache_file, read=f.tell())
+                return cached
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+            # Missing or unreadable cache: fall back to the JSON file
+            return None
+
+    def write_cache(self, stamp, version, data):
+        if not config.snapshot_cache or stamp is None:
+            return
+        temp_file = self.cache_file + ".tmp"
+        try:
+            with open(temp_file, 'wb') as f:
+                pickle.dump(stamp, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump((version, data), f, pickle.HIGHEST_PROTOCOL)
+                count_io(self.cache_file, written=f.tell())
+            os.replace(temp_file, self.cache_file)
+        except OSError:
+            # The cache is only an optimisation
+            pass
+
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        with file_lock(self.path):
+            return self.load_locked()
+
+    def load_locked(self):
+        version, data = self.read()
+        self.version = version
+        self.stamp = self.file_stamp()
+        return data
+
+    def write_locked(self, version, data):
+        write_atomic(self.path, json.dumps({"version": version, self.key: data}, indent=4))
+        self.version = version
+        self.stamp = self.file_stamp()
+        self.write_cache(self.stamp, version, data)
+
+    # Cheap check (stat only) for a write made by another process
+    def changed_on_disk(self):
+        return self.file_stamp() != self.stamp
+
+    # Compare-and-swap: write data if the file is still at our version, else write merge(disk data)
+    def save(self, data, merge=None):
+        with file_lock(self.path):
+            if self.exists():
+                version, disk_data = self.read()
+            else:
+                version, disk_data = 0, None
+
+            if version != self.version and merge is not None and disk_data is not None:
+                data = merge(disk_data)
+
+            self.write_locked(version + 1, data)
+        return data
+
+
+# Records the catalog changes made by this process since its last save
+class ChangeTracker(CatalogListener):
+
+    def __init__(self):
+        self.paused = False
+        self.clear()
+
+    def clear(self):
+        # (product ID, size) -> net stock change (edited products included, new ones are not)
+        self.stock_deltas = {}
+        # Product ID -> product added or edited here; its name, price and sizes win on merge
+        self.upserts = {}
+        # Products created here: saved with their stock as it is, not as deltas
+        self.added = set()
+        self.deletes = set()
+
+    def has_changes(self):
+        return bool(self.stock_deltas or self.upserts or self.deletes)
+
+    def product_added(self, product):
+        if not self.paused:
+            self.upserts[product["id"]] = product
+            self.added.add(product["id"])
+            self.deletes.discard(product["id"])
+
+    def product_changed(self, product, previous):
+        if not self.paused:
+            self.upserts[product["id"]] = product
+            for size in set(previous["stock"]) | set(product["stock"]):
+                self.add_delta(product, size, product["stock"].get(size, 0) - previous["stock"].get(size, 0))
+
+    def product_removed(self, product):
+        if not self.paused:
+            self.upserts.pop(product["id"], None)
+            self.added.discard(product["id"])
+            self.stock_deltas = {key: delta for key, delta in self.stock_deltas.items() if key[0] != product["id"]}
+            self.deletes.add(product["id"])
+
+    def stock_changed(self, product, size, old_quantity):
+        if not self.paused:
+            self.add_delta(product, size, product["stock"][size] - old_quantity)
+
+    def add_delta(self, product, size, delta):
+        if delta and product["id"] not in self.added:
+            key = (product["id"], size)
+            self.stock_deltas[key] = self.stock_deltas.get(key, 0) + delta
+
+    # Journal operations for the tracked changes (products are copied as they are now, so
+    # an upsert is only built after catching up)
+    def to_ops(self, base):
+        ops = [{"op": "delete", "base": base, "id": product_id} for product_id in self.deletes]
+        ops += [
+            {"op": "stock", "base": base, "id": product_id, "size": size, "delta": delta}
+            for (product_id, size), delta in self.stock_deltas.items() if delta and product_id not in self.upserts
+        ]
+        ops += [{"op": "upsert", "base": base, "product": product.to_dict()} for product in self.upserts.values()]
+        return ops
+
+
+# catalog.json snapshot plus a journal of small deltas, compacted into a new snapshot
+class CatalogFile:
+
+    def __init__(self, path, journal_path=None, compact_threshold=None):
+        self.path = path
+        self.document = VersionedJSONFile(path, "products")
+        self.journal = CatalogJournal(journal_path or path + ".journal")
+        self.compact_threshold = compact_threshold or config.journal_compact_threshold
+        self.tracker = ChangeTracker()
+        self.catalog = None
+        # The file lock is not reentrant; a save inside locked() joins the hold it is in
+        self.thread_lock = threading.RLock()
+        self.lock_depth = 0
+
+    def exists(self):
+        return self.document.exists()
+
+    # Hold the catalog lock across a read-check-write (checkout); nested saves join it
+    @contextmanager
+    def locked(self):
+        with self.thread_lock:
+            outer = self.lock_depth == 0
+            self.lock_depth += 1
+            try:
+                with file_lock(self.path) if outer else nullcontext():
+                    yield
+            finally:
+                self.lock_depth -= 1
+
+    # Snapshot with the journal tail replayed on top
+    @timed
+    def load(self):
+        with file_lock(self.path):
+            return self.load_locked()
+
+    def load_locked(self):
+        products = self.document.load_locked()
+        products_by_id = {product["id"]: product for product in products}
+        for op in self.journal.read_all():
+            if op["base"] == self.document.version:
+                apply_to_products(products_by_id, op)
+        return list(products_by_id.values())
+
+    def create(self, products):
+        with file_lock(self.path):
+            self.document.write_locked(1, products)
+            self.journal.truncate()
+
+    # Start tracking changes made to the loaded catalog
+    def attach(self, catalog):
+        self.catalog = catalog
+        catalog.subscribe(self.tracker)
+
+    # Save: catch up with other sessions, then append only this session's deltas
+    @timed
+    def save(self):
+        with self.locked():
+            self.catch_up()
+            ops = self.tracker.to_ops(self.document.version)
+            self.tracker.clear()
+
+            # A save that would reach the threshold (bulk imports) goes straight to a new snapshot
+            if self.journal.entries + len(ops) >= self.compact_threshold:
+                self.compact_locked()
+            else:
+                self.journal.append(ops)
+
+    # Apply what other sessions saved since our last load or save (caller holds the lock).
+    # Memory ends up as a reload would leave it once this session's unsaved changes are
+    # journaled after theirs.
+    def catch_up(self):
+        tracker = self.tracker
+        deltas = dict(tracker.stock_deltas)
+        # Copies: replaying the other sessions' changes updates the live products in place
+        upserts = {product_id: product.to_dict() for product_id, product in tracker.upserts.items()}
+        deletes = set(tracker.deletes)
+        tracker.paused = True
+        try:
+            if self.document.changed_on_disk():
+                # Another session compacted: start over from its snapshot, then reapply ours
+                self.replace_products(self.load_locked())
+                replaced = deletes | set(upserts) | {product_id for product_id, _ in deltas}
+            else:
+                # Stock deltas add up in any order, but an upsert or delete carries the whole
+                # product, so our own changes to a product it replaced go on top again
+                replaced = set()
+                for op in self.journal.read_new():
+                    if op["base"] == self.document.version:
+                        apply_to_catalog(self.catalog, op)
+                        if op["op"] != "stock":
+                            replaced.add(op_product_id(op))
+
+            for product_id in replaced:
+                self.reapply(product_id, deltas, upserts, deletes)
+        finally:
+            tracker.paused = False
+
+    # Our edit keeps its name, price and sizes; its stock is the merged stock plus our own
+    # deltas, so the other sessions' sales are not overwritten
+    def reapply(self, product_id, deltas, upserts, deletes):
+        current = self.catalog.get(product_id)
+        if product_id in deletes:
+            self.catalog.remove(product_id)
+        elif product_id in upserts:
+            product = upserts[product_id]
+            if current is not None and product_id not in self.tracker.added:
+                product["stock"] = {
+                    size: current["stock"].get(size, 0) + deltas.get((product_id, size), 0) for size in product["stock"]
+                }
+            apply_to_catalog(self.catalog, {"op": "upsert", "product": product})
+        elif current is not None:
+            for (delta_id, size), delta in deltas.items():
+                if delta_id == product_id:
+                    self.catalog.adjust_stock(current, size, delta)
+
+    @timed
+    def compact_locked(self):
+        self.document.write_locked(self.document.version + 1, self.catalog.to_list())
+        self.journal.truncate()
+
+    # Bring the in-memory catalog in line with saved products (through its indexes)
+    def replace_products(self, products):
+        incoming = {product["id"]: product for product in products}
+        for product_id in [product_id for product_id in self.catalog.by_id if product_id not in incoming]:
+            self.catalog.remove(product_id)
+
+        for product_id, product in incoming.items():
+            current = self.catalog.get(product_id)
+            if current is None:
+                self.catalog.add(product)
+            elif current != product:
+                self.catalog.update(current, name=product["name"], price=product["price"], sizes=product["sizes"], stock=product["stock"])
+
+
+# users.json snapshot plus an append log of registrations, cached in memory for every reader
+class UserRepository:
+
+    def __init__(self, path, log_path=None, compact_threshold=None):
+        self.path = path
+        self.document = VersionedJSONFile(path, "users")
+        # Log entries: {"base": V, "username": ..., "user": {...}}
+        self.log = CatalogJournal(log_path or path + ".log")
+        self.compact_threshold = compact_threshold or config.user_log_compact_threshold
+        # The cache every caller shares
+        self.users = {}
+
+    def exists(self):
+        return self.document.exists()
+
+    # Stat-only check of the snapshot and the log against what was last read
+    def changed_on_disk(self):
+        if self.document.changed_on_disk():
+            return True
+        log_size = os.path.getsize(self.log.path) if os.path.exists(self.log.path) else 0
+        return log_size != self.log.offset
+
+    # Read-through: the files are only read when another process has written them
+    @timed
+    def refresh(self):
+        if self.exists() and self.changed_on_disk():
+            with file_lock(self.path):
+                self.refresh_locked()
+        return self.users
+
+    def refresh_locked(self):
+        if self.document.changed_on_disk():
+            users = self.document.load_locked()
+            entries = self.log.read_all()
+            self.users.clear()
+            self.users.update(users)
+        else:
+            entries = self.log.read_new()
+        for entry in entries:
+            if entry["base"] == self.document.version:
+                self.users[entry["username"]] = entry["user"]
+
+    def get(self, username):
+        return self.refresh().get(username)
+
+    def load(self):
+        return dict(self.refresh())
+
+    # Write a fresh snapshot (first start, imports)
+    def create(self, users):
+        with file_lock(self.path):
+            self.document.write_locked(1, users)
+            self.log.truncate()
+        self.users.clear()
+        self.users.update(users)
+
+    # Register one user with a single log append; False if the name was taken meanwhile
+    @timed
+    def add(self, username, details):
+        with file_lock(self.path):
+            if self.changed_on_disk():
+                self.refresh_locked()
+            if username in self.users:
+                return False
+
+            self.log.append([{"base": self.document.version, "username": username, "user": details}])
+            self.users[username] = details
+            if self.log.entries >= self.compact_threshold:
+                self.compact_locked()
+        return True
+
+    def compact_locked(self):
+        self.document.write_locked(self.document.version + 1, self.users)
+        self.log.truncate()
+
+    # A bucket file is made before its first registration; an existing one is left alone
+    def create_if_missing(self):
+        with file_lock(self.path):
+            if not self.document.exists():
+                self.document.write_locked(1, {})
+                self.log.truncate()
+
+
+# Users split by a hash of the username into bucket files, each a UserRepository (snapshot + log).
+# A login reads one bucket and a registration appends to one bucket's log.
+class ShardedUserStore:
+
+    def __init__(self, directory=None, bucket_count=None, legacy_file=None):
+        self.directory = directory or config.user_bucket_dir
+        self.bucket_count = bucket_count or config.user_bucket_count
+        # users.json from before users were sharded; split into the buckets on first use
+        self.legacy_file = legacy_file
+        self.marker = os.path.join(self.directory, ".created")
+        # Bucket number -> UserRepository, opened on first use
+        self.buckets = {}
+        os.makedirs(self.directory, exist_ok=True)
+        self.migrate_legacy_users()
+
+    # Stable across processes (unlike hash(), which is salted per run)
+    def bucket_of(self, username):
+        return zlib.crc32(username.encode()) % self.bucket_count
+
+    def bucket_file(self, number):
+        return os.path.join(self.directory, f"users_{number:03d}.json")
+
+    def bucket(self, number):
+        repository = self.buckets.get(number)
+        if repository is None:
+            repository = self.buckets[number] = UserRepository(self.bucket_file(number))
+        return repository
+
+    def exists(self):
+        return os.path.exists(self.marker)
+
+    def get(self, username):
+        return self.bucket(self.bucket_of(username)).get(username)
+
+    # Register one user (one bucket, one log append); False if the name was taken meanwhile
+    def add(self, username, details):
+        repository = self.bucket(self.bucket_of(username))
+        if not repository.exists():
+            repository.create_if_missing()
+        return repository.add(username, details)
+
+    # Write every bucket afresh (first start, imports)
+    def create(self, users):
+        by_bucket = {}
+        for username, details in users.items():
+            by_bucket.setdefault(self.bucket_of(username), {})[username] = details
+        for number in range(self.bucket_count):
+            self.bucket(number).create(by_bucket.get(number, {}))
+        with open(self.marker, 'w') as f:
+            f.write(f"{self.bucket_count}\n")
+
+    # Stream (username, details) one bucket at a time; buckets not already open are not kept
+    def iter_users(self):
+        for number in range(self.bucket_count):
+            repository = self.buckets.get(number) or UserRepository(self.bucket_file(number))
+            if repository.exists():
+                yield from list(repository.refresh().items())
+
+    def load(self):
+        return dict(self.iter_users())
+
+    # One-shot split of users.json (snapshot and log) into the buckets
+    def migrate_legacy_users(self):
+        if self.exists() or not self.legacy_file:
+            return
+        legacy = UserRepository(self.legacy_file)
+        if legacy.exists():
+            self.create(legacy.load())
@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+from bisect import bisect_right
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+import config
+
+# Lookup keys: a rule for one size, for every size of a product, or for every product
+ANY = None
+
+# Promotions file (a JSON list); size is optional, and so is product_id except on prices:
+#   {"type": "price", "product_id": 1, "size": "XL", "price": 2700.00}               size-specific price
+#   {"type": "percent_off", "product_id": 1, "size": "M", "percent": 10}             percentage off
+#   {"type": "buy_x_get_y", "product_id": 2, "buy": 2, "get": 1}                     every 3rd unit free
+#   {"type": "cart_threshold", "min_total": 20000, "percent": 5, "amount_off": 0}    whole-cart discount
+RULE_TYPES = ("price", "percent_off", "buy_x_get_y", "cart_threshold")
+
+
+# Catalog prices are floats; money is handled as integer cents from here on
+@lru_cache(maxsize=65536)
+def to_cents(amount):
+    return int(Decimal(str(amount)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+
+
+def format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    whole, part = divmod(abs(cents), 100)
+    return f"{sign}{whole:,}.{part:02d}"
+
+
+# Percentages as basis points, so 12.5% stays exact
+def to_basis_points(percent):
+    return int((Decimal(str(percent)) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+# Share of amount (rounded half up) at the given basis points
+def share(amount, basis_points):
+    return (amount * basis_points + 5000) // 10000
+
+
+# Promotion rules compiled into dicts keyed by (product ID or ANY, size or ANY)
+class PriceBook:
+
+    def __init__(self, rules=()):
+        self.prices = {}
+        # Key -> (basis points, rule name); the largest percentage wins, percentages do not stack
+        self.percent_off = {}
+        # Key -> (buy, get, rule name)
+        self.bundles = {}
+        # Cart thresholds sorted by minimum total: parallel lists for bisect
+        self.threshold_totals = []
+        self.threshold_rules = []
+
+        # Rules that could not be used, as "Rule N: reason" (the rest of the file still applies)
+        self.errors = []
+
+        thresholds = []
+        for number, rule in enumerate(rules, start=1):
+            try:
+                self.add_rule(number, rule, thresholds)
+            except (KeyError, TypeError, ValueError, ArithmeticError) as error:
+                reason = f"missing {error}" if isinstance(error, KeyError) else str(error) or type(error).__name__
+                self.errors.append(f"Rule {number}: {reason}")
+
+        thresholds.sort()
+        self.threshold_totals = [threshold[0] for threshold in thresholds]
+        self.threshold_rules = [threshold[1:] for threshold in thresholds]
+
+    def add_rule(self, number, rule, thresholds):
+        if not isinstance(rule, dict):
+            raise TypeError("not a JSON object")
+        kind = rule.get("type")
+        if kind not in RULE_TYPES:
+            raise ValueError(f"unknown type {kind!r}")
+        name = str(rule.get("name") or f"{kind} #{number}")
+        key = (rule.get("product_id", ANY), rule.get("size", ANY))
+
+        if kind == "price":
+            if key[0] is ANY:
+                raise ValueError("a price needs a product_id")
+            price = to_cents(rule["price"])
+            if price < 0:
+                raise ValueError("price must not be negative")
+            self.prices[key] = price
+        elif kind == "percent_off":
+            basis_points = to_basis_points(rule["percent"])
+            if not 0 < basis_points <= 10000:
+                raise ValueError("percent must be between 0 and 100")
+            if basis_points > self.percent_off.get(key, (0, None))[0]:
+                self.percent_off[key] = (basis_points, name)
+        elif kind == "buy_x_get_y":
+            buy, get = int(rule["buy"]), int(rule["get"])
+            if buy < 1 or get < 1:
+                raise ValueError("buy and get must be at least 1")
+            self.bundles[key] = (buy, get, name)
+        else:
+            threshold = (to_cents(rule["min_total"]), to_basis_points(rule.get("percent", 0)), to_cents(rule.get("amount_off", 0)), name)
+            if not 0 <= threshold[1] <= 10000 or threshold[2] < 0:
+                raise ValueError("percent must be between 0 and 100 and amount_off not negative")
+            thresholds.append(threshold)
+
+    # Most specific entry: this size, then the whole product, then this size of every product,
+    # then every product
+    @staticmethod
+    def lookup(table, product_id, size):
+        for key in ((product_id, size), (product_id, ANY), (ANY, size), (ANY, ANY)):
+            value = table.get(key)
+            if value is not None:
+                return value
+        return None
+
+    # One cart line: (unit cents, gross cents, discount cents, promotion names)
+    def price_line(self, product, size, quantity):
+        product_id = product["id"]
+        unit = self.lookup(self.prices, product_id, size)
+        if unit is None:
+            unit = to_cents(product["price"])
+        gross = unit * quantity
+        discount = 0
+        promotions = []
+
+        bundle = self.lookup(self.bundles, product_id, size)
+        if bundle:
+            buy, get, name = bundle
+            free_units = quantity // (buy + get) * get
+            if free_units:
+                discount += unit * free_units
+                promotions.append(name)
+
+        percent = self.lookup(self.percent_off, product_id, size)
+        if percent:
+            basis_points, name = percent
+            discount += share(gross - discount, basis_points)
+            promotions.append(name)
+
+        return unit, gross, discount, promotions
+
+    # The best cart-total discount reached by the subtotal: (discount cents, rule name or None)
+    def cart_discount(self, subtotal):
+        position = bisect_right(self.threshold_totals, subtotal)
+        if not position:
+            return 0, None
+        basis_points, amount_off, name = self.threshold_rules[position - 1]
+        return min(subtotal, share(subtotal, basis_points) + amount_off), name
+
+
+class PricedLine:
+    __slots__ = ("key", "product", "size", "quantity", "unit_cents", "gross_cents", "discount_cents", "cart_share_cents", "total_cents", "promotions")
+
+    def __init__(self, key, product, size, quantity, unit_cents, gross_cents, discount_cents, promotions):
+        self.key = key
+        self.product = product
+        self.size = size
+        self.quantity = quantity
+        self.unit_cents = unit_cents
+        self.gross_cents = gross_cents
+        # Line promotions, then this line's part of the cart-total discount
+        self.discount_cents = discount_cents
+        self.cart_share_cents = 0
+        self.total_cents = gross_cents - discount_cents
+        self.promotions = promotions
+
+
+class PricedCart:
+
+    def __init__(self, lines, cart_discount_cents, cart_promotion):
+        self.lines = lines
+        self.subtotal_cents = sum(line.total_cents for line in lines)
+        self.cart_discount_cents = cart_discount_cents
+        self.cart_promotion = cart_promotion
+        self.total_cents = self.subtotal_cents - cart_discount_cents
+        self.spread_cart_discount()
+
+    # The cart discount is split over the lines (largest remainder), so line totals add up to
+    # what was paid and a return refunds exactly that line's share
+    def spread_cart_discount(self):
+        if not self.cart_discount_cents or not self.subtotal_cents:
+            return
+        shares = []
+        for line in self.lines:
+            amount, remainder = divmod(line.total_cents * self.cart_discount_cents, self.subtotal_cents)
+            shares.append([amount, remainder, line])
+        leftover = self.cart_discount_cents - sum(amount for amount, _, _ in shares)
+        for entry in sorted(shares, key=lambda entry: -entry[1])[:leftover]:
+            entry[0] += 1
+        for amount, _, line in shares:
+            line.cart_share_cents = amount
+            line.total_cents -= amount
+
+
+# Prices whole carts with the promotions file, recompiling it only when the file changes
+class PricingEngine:
+
+    def __init__(self, path=None):
+        self.path = path or config.promotions_file
+        self.stamp = None
+        self.book = PriceBook()
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self.stamp:
+            return self.book
+        self.stamp = stamp
+
+        rules = []
+        if stamp is not None:
+            try:
+                with open(self.path, 'r') as f:
+                    rules = json.load(f)
+                if not isinstance(rules, list):
+                    raise ValueError("expected a list of rules")
+            except (OSError, ValueError) as error:
+                # Broken or half-written file: keep pricing with the last promotions that loaded
+                print(f"\n\033[31m Promotions file could not be read ({error}); the previous promotions stay in effect.\033[0m")
+                return self.book
+
+        book = PriceBook(rules)
+        for error in book.errors:
+            print(f"\n\033[33m Promotions file: {error} (rule skipped)\033[0m")
+        self.book = book
+        return book
+
+    # One pass over the cart: per-line prices and promotions, then the cart-total discount
+    def price_cart(self, cart):
+        book = self.refresh()
+        lines = []
+        for key, item in cart.items():
+            unit, gross, discount, promotions = book.price_line(item["product"], item["size"], item["quantity"])
+            lines.append(PricedLine(key, item["product"], item["size"], item["quantity"], unit, gross, discount, promotions))
+        subtotal = sum(line.total_cents for line in lines)
+        cart_discount, cart_promotion = book.cart_discount(subtotal)
+        return PricedCart(lines, cart_discount, cart_promotion)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a promotions file: compile it and print its lookup tables.")
+    parser.add_argument("file", nargs="?", default=config.promotions_file)
+    args = parser.parse_args()
+
+    with open(args.file, 'r') as f:
+        book = PriceBook(json.load(f))
+    for error in book.errors:
+        print(f"\033[31m {error}\033[0m")
+    print(f"{len(book.prices)} prices, {len(book.percent_off)} percentage discounts, "
+          f"{len(book.bundles)} buy-X-get-Y offers, {len(book.threshold_totals)} cart thresholds")
+    if book.errors:
+        raise SystemExit(1)
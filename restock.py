@@ -0,0 +1,188 @@
+import argparse
+import heapq
+import json
+import os
+import time
+
+import config
+from history import HistoryListener, epoch_of
+from inventory import CatalogListener
+from persistence import write_atomic
+
+DAY_SECONDS = 86400
+HOUR_SECONDS = 3600
+
+# Key of a product-wide threshold in the thresholds file (applies to sizes without their own)
+ALL_SIZES = "*"
+
+
+# Low-stock thresholds: config.low_stock_threshold per size unless a product or size overrides it.
+# File layout: {"<product ID>": {"<size>" or "*": threshold}}
+class StockThresholds:
+
+    def __init__(self, path=None):
+        self.path = path or config.stock_thresholds_file
+        self.overrides = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                try:
+                    self.overrides = {int(product_id): sizes for product_id, sizes in json.load(f).items()}
+                except (json.JSONDecodeError, ValueError, AttributeError):
+                    self.overrides = {}
+
+    def limit(self, product_id, size):
+        sizes = self.overrides.get(product_id)
+        if not sizes:
+            return config.low_stock_threshold
+        return sizes.get(size, sizes.get(ALL_SIZES, config.low_stock_threshold))
+
+    # Set (or, with None, reset to the default) the threshold of one size or of the whole product
+    def set(self, product_id, size, threshold):
+        sizes = self.overrides.setdefault(product_id, {})
+        if threshold is None:
+            sizes.pop(size or ALL_SIZES, None)
+        else:
+            sizes[size or ALL_SIZES] = threshold
+        if not sizes:
+            del self.overrides[product_id]
+        write_atomic(self.path, json.dumps({str(product_id): sizes for product_id, sizes in self.overrides.items()}, indent=4))
+
+
+def stock_sizes(product):
+    return set(product["sizes"]) | set(product["stock"])
+
+
+# Sizes at or below their threshold, kept current by every stock change; listing them costs O(k)
+class LowStockIndex(CatalogListener):
+
+    def __init__(self, catalog, thresholds):
+        self.catalog = catalog
+        self.thresholds = thresholds
+        # (product ID, size) -> product, only for sizes that crossed their threshold
+        self.low = {}
+        for product in catalog:
+            self.product_added(product)
+        catalog.subscribe(self)
+
+    def check(self, product, size):
+        key = (product["id"], size)
+        if product["stock"].get(size, 0) <= self.thresholds.limit(product["id"], size):
+            self.low[key] = product
+        else:
+            self.low.pop(key, None)
+
+    def product_added(self, product):
+        for size in stock_sizes(product):
+            self.check(product, size)
+
+    def product_removed(self, product):
+        for size in stock_sizes(product):
+            self.low.pop((product["id"], size), None)
+
+    def product_changed(self, product, previous):
+        self.product_removed(previous)
+        self.product_added(product)
+
+    def stock_changed(self, product, size, old_quantity):
+        self.check(product, size)
+
+    def set_threshold(self, product, size, threshold):
+        self.thresholds.set(product["id"], size, threshold)
+        self.product_added(product)
+
+    # (product, size, quantity, threshold), emptiest first
+    def items(self):
+        rows = [
+            (product, size, product["stock"].get(size, 0), self.thresholds.limit(product_id, size))
+            for (product_id, size), product in self.low.items()
+        ]
+        return sorted(rows, key=lambda row: (row[2], row[0]["id"], str(row[1])))
+
+
+# Net units sold per (product ID, size) over the last few days, in hourly buckets: loaded once
+# from the time-indexed history, then kept current by every checkout and return of this process,
+# so the rate of sale of a size is a dictionary lookup
+class RollingSales(HistoryListener):
+
+    def __init__(self, history, days=None, now=None):
+        self.days = days or config.forecast_window_days
+        # (product ID, size) -> net units sold in the window
+        self.units = {}
+        # Hour -> {(product ID, size): net units}, and the hours as a heap (oldest expires first)
+        self.buckets = {}
+        self.hours = []
+
+        now = time.time() if now is None else now
+        for record in history.iter_between(int(now - self.days * DAY_SECONDS), None):
+            self.add_record(record)
+        history.subscribe(self)
+
+    def add_record(self, record):
+        sign = -1 if record.get("type") == "return" else 1
+        hour = epoch_of(record) // HOUR_SECONDS
+        bucket = self.buckets.get(hour)
+        if bucket is None:
+            bucket = self.buckets[hour] = {}
+            heapq.heappush(self.hours, hour)
+        for item in record["items"]:
+            if item.get("product_id") is not None:
+                key = (item["product_id"], item.get("size"))
+                bucket[key] = bucket.get(key, 0) + sign * item["quantity"]
+                self.units[key] = self.units.get(key, 0) + sign * item["quantity"]
+
+    def records_added(self, records):
+        for record in records:
+            self.add_record(record)
+
+    # Take the hours that fell out of the window off the running totals
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        first_hour = int(now - self.days * DAY_SECONDS) // HOUR_SECONDS
+        while self.hours and self.hours[0] < first_hour:
+            for key, units in self.buckets.pop(heapq.heappop(self.hours)).items():
+                remaining = self.units[key] - units
+                if remaining:
+                    self.units[key] = remaining
+                else:
+                    del self.units[key]
+
+    # Net units sold per day of one size (0.0 when it has not sold lately)
+    def per_day(self, product_id, size):
+        sold = self.units.get((product_id, size), 0)
+        return sold / self.days if sold > 0 else 0.0
+
+    # Every size that sold lately: {(product ID, size): units per day}
+    def velocity(self):
+        return {key: sold / self.days for key, sold in self.units.items() if sold > 0}
+
+
+# Days until a size runs out at its recent rate of sale (None when it has not sold lately)
+def days_until_stockout(quantity, per_day):
+    if quantity <= 0:
+        return 0.0
+    return quantity / per_day if per_day else None
+
+
+if __name__ == "__main__":
+    from catalog import Catalog
+
+    parser = argparse.ArgumentParser(description="Sizes at or below their low-stock threshold, with a stockout forecast.")
+    parser.add_argument("--days", type=int, default=None, help="Sales window for the forecast (default: config.forecast_window_days)")
+    args = parser.parse_args()
+
+    catalog = Catalog(None)
+    index = LowStockIndex(catalog.catalog, StockThresholds())
+    sales = RollingSales(catalog.purchase_history, args.days)
+    rows = []
+    for product, size, quantity, threshold in index.items():
+        per_day = sales.per_day(product["id"], size)
+        rows.append({
+            "product_id": product["id"],
+            "name": product["name"],
+            "size": size,
+            "stock": quantity,
+            "threshold": threshold,
+            "sold_per_day": round(per_day, 3),
+            "days_left": days_until_stockout(quantity, per_day)
+        })
+    print(json.dumps(rows, indent=4))
@@ -0,0 +1,135 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+
+from inventory import CatalogListener
+from metrics import timed
+
+# Longest character n-gram kept in the index; longer queries intersect their n-grams
+NGRAM_SIZE = 3
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def name_tokens(name):
+    return set(TOKEN_PATTERN.findall(name))
+
+
+def name_ngrams(name):
+    grams = set()
+    for size in range(1, NGRAM_SIZE + 1):
+        for start in range(len(name) - size + 1):
+            grams.add(name[start:start + size])
+    return grams
+
+
+class SearchIndex(CatalogListener):
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        # Product ID -> lowercased name (lowercased once, when the product is indexed)
+        self.names = {}
+        # Token -> product IDs, plus the sorted token vocabulary for prefix lookups
+        self.token_postings = {}
+        self.vocabulary = []
+        # Character n-gram (length 1..NGRAM_SIZE) -> product IDs
+        self.ngram_postings = {}
+
+        for product in catalog:
+            self.product_added(product)
+        catalog.subscribe(self)
+
+    # Incremental Index Maintenance (called by ProductCatalog)
+    def product_added(self, product):
+        product_id = product["id"]
+        name = product["name"].lower()
+        self.names[product_id] = name
+
+        for token in name_tokens(name):
+            postings = self.token_postings.get(token)
+            if postings is None:
+                postings = self.token_postings[token] = set()
+                insort(self.vocabulary, token)
+            postings.add(product_id)
+
+        for gram in name_ngrams(name):
+            self.ngram_postings.setdefault(gram, set()).add(product_id)
+
+    def product_removed(self, product):
+        product_id = product["id"]
+        name = self.names.pop(product_id, None)
+        if name is None:
+            return
+
+        for token in name_tokens(name):
+            postings = self.token_postings[token]
+            postings.discard(product_id)
+            if not postings:
+                del self.token_postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+        for gram in name_ngrams(name):
+            postings = self.ngram_postings[gram]
+            postings.discard(product_id)
+            if not postings:
+                del self.ngram_postings[gram]
+
+    def product_changed(self, product, previous):
+        if product["name"].lower() != self.names.get(product["id"]):
+            self.product_removed(previous)
+            self.product_added(product)
+
+    # Candidate Lookups
+    def substring_candidates(self, query):
+        if len(query) <= NGRAM_SIZE:
+            return self.ngram_postings.get(query, set())
+
+        grams = sorted(
+            (self.ngram_postings.get(query[start:start + NGRAM_SIZE], set())
+             for start in range(len(query) - NGRAM_SIZE + 1)),
+            key=len
+        )
+        candidates = set(grams[0])
+        for postings in grams[1:]:
+            if not candidates:
+                break
+            candidates &= postings
+        # n-gram intersection can over-match, so confirm against the name
+        return {product_id for product_id in candidates if query in self.names[product_id]}
+
+    def token_prefix_matches(self, query):
+        matches = set()
+        position = bisect_left(self.vocabulary, query)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(query):
+            matches |= self.token_postings[self.vocabulary[position]]
+            position += 1
+        return matches
+
+    # Ranked Search: exact name, then name prefix, then word prefix, then any substring
+    @timed
+    def search(self, query, limit=None):
+        query = query.strip().lower()
+        if not query:
+            products = list(self.catalog)
+            return products[:limit] if limit else products
+
+        candidates = self.substring_candidates(query)
+        token_matches = self.token_prefix_matches(query) if TOKEN_PATTERN.fullmatch(query) else set()
+
+        def rank(product_id):
+            name = self.names[product_id]
+            if name == query:
+                score = 0
+            elif name.startswith(query):
+                score = 1
+            elif product_id in token_matches:
+                score = 2
+            else:
+                score = 3
+            return score, name, product_id
+
+        if limit:
+            ranked = heapq.nsmallest(limit, candidates, key=rank)
+        else:
+            ranked = sorted(candidates, key=rank)
+        return [self.catalog.get(product_id) for product_id in ranked]
@@ -0,0 +1,504 @@
+import argparse
+import json
+import sqlite3
+from contextlib import contextmanager, nullcontext
+
+import config
+from history import OrderIndex, ShardedPurchaseHistory, epoch_of, parse_timestamp
+from metrics import timed
+from persistence import CatalogFile, ChangeTracker, ShardedUserStore
+
+
+# Current behaviour: catalog snapshot + journal, hashed user bucket files and one JSON Lines history log per user
+class JSONStorage:
+
+    def __init__(self):
+        self.catalog_store = CatalogFile(config.catalog_file)
+        self.purchase_history = None
+        self.users = None
+
+    # Set up on first use, so sessions that never open purchase history skip the shard migration check
+    @property
+    def history(self):
+        if self.purchase_history is None:
+            self.purchase_history = ShardedPurchaseHistory()
+        return self.purchase_history
+
+    # One user store (and its bucket caches) shared by every caller; users.json is split on first use
+    def user_store(self):
+        if self.users is None:
+            self.users = ShardedUserStore(legacy_file=config.user_files)
+        return self.users
+
+    # Files are saved one at a time; there is nothing to group
+    def transaction(self):
+        return nullcontext()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    price REAL NOT NULL,
+    sizes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_name ON products (name_lower);
+CREATE INDEX IF NOT EXISTS products_price ON products (price);
+CREATE TABLE IF NOT EXISTS product_stock (
+    product_id INTEGER NOT NULL,
+    size TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (product_id, size)
+);
+CREATE INDEX IF NOT EXISTS product_stock_size ON product_stock (size, quantity);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    role TEXT NOT NULL,
+    registered_date TEXT
+);
+CREATE TABLE IF NOT EXISTS purchase_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT,
+    timestamp TEXT NOT NULL,
+    type TEXT NOT NULL,
+    record TEXT NOT NULL,
+    epoch INTEGER
+);
+CREATE INDEX IF NOT EXISTS purchase_history_username ON purchase_history (username, id);
+CREATE INDEX IF NOT EXISTS purchase_history_timestamp ON purchase_history (timestamp);
+"""
+
+# Created once the epoch column exists (databases made before it get the column added first)
+EPOCH_INDEXES = """
+CREATE INDEX IF NOT EXISTS purchase_history_epoch ON purchase_history (epoch);
+CREATE INDEX IF NOT EXISTS purchase_history_username_epoch ON purchase_history (username, epoch);
+"""
+
+
+class SQLiteStorage:
+
+    def __init__(self, database_file=None):
+        self.database_file = database_file or config.sqlite_file
+        # Autocommit mode; transactions are opened explicitly by transaction()
+        # Worker threads of the order service share it; their writes are serialized by its save lock
+        self.connection = sqlite3.connect(self.database_file, isolation_level=None, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.depth = 0
+        self.add_epoch_column()
+        self.connection.executescript(EPOCH_INDEXES)
+        # Bumped on every user write made through this connection
+        self.users_generation = 0
+
+        self.catalog_store = SQLiteCatalogStore(self)
+        self.history = SQLiteHistory(self)
+        self.users = None
+
+    def user_store(self):
+        if self.users is None:
+            self.users = SQLiteUserStore(self)
+        return self.users
+
+    # One transaction for everything inside (nested calls join the outer one)
+    @contextmanager
+    def transaction(self):
+        if self.depth == 0:
+            self.connection.execute("BEGIN IMMEDIATE")
+        self.depth += 1
+        try:
+            yield self.connection
+        except BaseException:
+            self.depth -= 1
+            if self.depth == 0:
+                self.connection.execute("ROLLBACK")
+            raise
+        self.depth -= 1
+        if self.depth == 0:
+            self.connection.execute("COMMIT")
+
+    # One-shot migration: epoch seconds for every history row, so date ranges use an index
+    def add_epoch_column(self):
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(purchase_history)")]
+        if "epoch" in columns:
+            return
+        with self.transaction():
+            self.connection.execute("ALTER TABLE purchase_history ADD COLUMN epoch INTEGER")
+            rows = self.connection.execute("SELECT id, record FROM purchase_history").fetchall()
+            self.connection.executemany(
+                "UPDATE purchase_history SET epoch = ? WHERE id = ?",
+                [(epoch_of(json.loads(record)), row_id) for row_id, record in rows]
+            )
+
+    def data_version(self):
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+
+class SQLiteCatalogStore:
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.connection = storage.connection
+        self.tracker = ChangeTracker()
+        self.catalog = None
+
+    def exists(self):
+        return self.connection.execute("SELECT 1 FROM meta WHERE key = 'catalog_created'").fetchone() is not None
+
+    @timed
+    def load(self):
+        stock = {}
+        for product_id, size, quantity in self.connection.execute(
+                "SELECT product_id, size, quantity FROM product_stock ORDER BY rowid"):
+            stock.setdefault(product_id, {})[size] = quantity
+
+        return [
+            {"id": product_id, "name": name, "price": price, "sizes": json.loads(sizes), "stock": stock.get(product_id, {})}
+            for product_id, name, price, sizes in self.connection.execute(
+                "SELECT id, name, price, sizes FROM products ORDER BY id")
+        ]
+
+    def create(self, products):
+        with self.storage.transaction():
+            for product in products:
+                self.write_product(product)
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('catalog_created', '1')")
+
+    def attach(self, catalog):
+        self.catalog = catalog
+        catalog.subscribe(self.tracker)
+
+    # Same interface as CatalogFile: the write transaction is the lock
+    def locked(self):
+        return self.storage.transaction()
+
+    # Stock rows this session has unsaved deltas for (or edited products), as other sessions saved
+    # them, with our deltas on top
+    def catch_up(self):
+        tracker = self.tracker
+        deltas = dict(tracker.stock_deltas)
+        for product_id, product in tracker.upserts.items():
+            if product_id not in tracker.added:
+                for size in product["stock"]:
+                    deltas.setdefault((product_id, size), 0)
+        tracker.paused = True
+        try:
+            for (product_id, size), delta in deltas.items():
+                row = self.connection.execute(
+                    "SELECT quantity FROM product_stock WHERE product_id = ? AND size = ?", (product_id, size)
+                ).fetchone()
+                product = self.catalog.get(product_id)
+                if row and product is not None and product["stock"].get(size, 0) != row[0] + delta:
+                    self.catalog.adjust_stock(product, size, row[0] + delta - product["stock"].get(size, 0))
+        finally:
+            tracker.paused = False
+
+    def write_product(self, product):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO products (id, name, name_lower, price, sizes) VALUES (?, ?, ?, ?, ?)",
+            (product["id"], product["name"], product["name"].lower(), product["price"], json.dumps(product["sizes"]))
+        )
+        self.connection.execute("DELETE FROM product_stock WHERE product_id = ?", (product["id"],))
+        self.connection.executemany(
+            "INSERT INTO product_stock (product_id, size, quantity) VALUES (?, ?, ?)",
+            [(product["id"], size, quantity) for size, quantity in product["stock"].items()]
+        )
+
+    # Row-level save: only the changed products and stock rows are written
+    @timed
+    def save(self):
+        if not self.tracker.has_changes():
+            return
+
+        touched = []
+        with self.storage.transaction():
+            # Edited products are written whole, so their stock must include other sessions' sales
+            self.catch_up()
+            ops = self.tracker.to_ops(0)
+            self.tracker.clear()
+            for op in ops:
+                if op["op"] == "delete":
+                    self.connection.execute("DELETE FROM product_stock WHERE product_id = ?", (op["id"],))
+                    self.connection.execute("DELETE FROM products WHERE id = ?", (op["id"],))
+                elif op["op"] == "upsert":
+                    self.write_product(op["product"])
+                elif op["op"] == "stock":
+                    cursor = self.connection.execute(
+                        "UPDATE product_stock SET quantity = quantity + ? WHERE product_id = ? AND size = ?",
+                        (op["delta"], op["id"], op["size"])
+                    )
+                    if cursor.rowcount == 0:
+                        self.connection.execute(
+                            "INSERT INTO product_stock (product_id, size, quantity) VALUES (?, ?, ?)",
+                            (op["id"], op["size"], self.catalog.get(op["id"])["stock"][op["size"]])
+                        )
+                    touched.append((op["id"], op["size"]))
+
+            # Deltas were applied in the database, so pick up other sessions' changes to these rows
+            self.tracker.paused = True
+            try:
+                for product_id, size in touched:
+                    row = self.connection.execute(
+                        "SELECT quantity FROM product_stock WHERE product_id = ? AND size = ?", (product_id, size)
+                    ).fetchone()
+                    product = self.catalog.get(product_id)
+                    if row and product is not None and product["stock"].get(size) != row[0]:
+                        self.catalog.adjust_stock(product, size, row[0] - product["stock"].get(size, 0))
+            finally:
+                self.tracker.paused = False
+
+
+# Same interface as ShardedUserStore
+class SQLiteUserStore:
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.connection = storage.connection
+        self.seen = None
+        self.users = {}
+
+    def exists(self):
+        return self.connection.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None
+
+    def current_stamp(self):
+        return self.storage.data_version(), self.storage.users_generation
+
+    # Reload only if this or another connection wrote users since our last look
+    @timed
+    def refresh(self):
+        if self.current_stamp() != self.seen:
+            self.seen = self.current_stamp()
+            self.users.clear()
+            for username, password, role, registered_date in self.connection.execute(
+                    "SELECT username, password, role, registered_date FROM users ORDER BY rowid"):
+                self.users[username] = {"password": password, "role": role}
+                if registered_date is not None:
+                    self.users[username]["registered_date"] = registered_date
+        return self.users
+
+    # Point lookup through the primary key; nothing else is loaded
+    def get(self, username):
+        row = self.connection.execute(
+            "SELECT password, role, registered_date FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        user = {"password": row[0], "role": row[1]}
+        if row[2] is not None:
+            user["registered_date"] = row[2]
+        return user
+
+    def load(self):
+        return dict(self.refresh())
+
+    # Stream (username, details) straight from the cursor
+    def iter_users(self):
+        for username, password, role, registered_date in self.connection.execute(
+                "SELECT username, password, role, registered_date FROM users ORDER BY rowid"):
+            user = {"password": password, "role": role}
+            if registered_date is not None:
+                user["registered_date"] = registered_date
+            yield username, user
+
+    def create(self, users):
+        with self.storage.transaction():
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO users (username, password, role, registered_date) VALUES (?, ?, ?, ?)",
+                [(name, user["password"], user["role"], user.get("registered_date")) for name, user in users.items()]
+            )
+        self.storage.users_generation += 1
+        self.refresh()
+
+    # Register one user; False if the name was taken meanwhile
+    @timed
+    def add(self, username, details):
+        up_to_date = self.current_stamp() == self.seen
+        with self.storage.transaction():
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO users (username, password, role, registered_date) VALUES (?, ?, ?, ?)",
+                (username, details["password"], details["role"], details.get("registered_date"))
+            )
+        if cursor.rowcount == 0:
+            return False
+        self.storage.users_generation += 1
+        # Keep the cache only if nobody else wrote since it was loaded
+        if up_to_date:
+            self.seen = self.current_stamp()
+        self.users[username] = details
+        return True
+
+
+# Same interface as ShardedPurchaseHistory; the row ID plays the role of the file offset
+class SQLiteHistory:
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.connection = storage.connection
+        self.users = {}
+        self.listeners = []
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM purchase_history").fetchone()[0]
+
+    def for_user(self, username):
+        user_history = self.users.get(username)
+        if user_history is None:
+            user_history = self.users[username] = SQLiteUserHistory(self, username)
+        return user_history
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def append(self, record):
+        self.extend([record])
+
+    @timed
+    def extend(self, records):
+        records = list(records)
+        with self.storage.transaction():
+            self.connection.executemany(
+                "INSERT INTO purchase_history (username, timestamp, type, record, epoch) VALUES (?, ?, ?, ?, ?)",
+                [(record.get("username"), record["timestamp"], record.get("type", "purchase"), json.dumps(record), epoch_of(record)) for record in records]
+            )
+        for listener in self.listeners:
+            listener.records_added(records)
+
+    def iter_records(self):
+        for _, record in self.iter_with_offsets():
+            yield record
+
+    def iter_with_offsets(self):
+        for row_id, record in self.connection.execute("SELECT id, record FROM purchase_history ORDER BY id"):
+            yield row_id, json.loads(record)
+
+    def iter_between(self, start=None, end=None, newest_first=False):
+        return self.select_between("", (), start, end, newest_first)
+
+    # Records with start <= epoch < end (and an optional extra condition) through the epoch indexes, in time order
+    def select_between(self, condition, parameters, start, end, newest_first):
+        order = "DESC" if newest_first else "ASC"
+        bounds = (-2 ** 63 if start is None else start, 2 ** 63 - 1 if end is None else end)
+        for (record,) in self.connection.execute(
+                f"SELECT record FROM purchase_history WHERE {condition}epoch >= ? AND epoch < ? ORDER BY epoch {order}, id {order}",
+                (*parameters, *bounds)):
+            yield json.loads(record)
+
+    # Converter: add the "epoch" field to records stored before it existed
+    def upgrade_timestamps(self):
+        rows = self.connection.execute("SELECT id, record FROM purchase_history WHERE record NOT LIKE '%\"epoch\":%'").fetchall()
+        updates = []
+        for row_id, text in rows:
+            record = json.loads(text)
+            if "epoch" not in record:
+                record["epoch"] = parse_timestamp(record.get("timestamp"))
+                updates.append((json.dumps(record), record["epoch"], row_id))
+        with self.storage.transaction():
+            self.connection.executemany("UPDATE purchase_history SET record = ?, epoch = ? WHERE id = ?", updates)
+        return len(updates)
+
+
+# One user's rows (same interface as PurchaseHistory), read through the (username, id) index
+class SQLiteUserHistory:
+
+    def __init__(self, history, username):
+        self.history = history
+        self.connection = history.connection
+        self.username = username
+        self.index = None
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM purchase_history WHERE username IS ?", (self.username,)
+        ).fetchone()[0]
+
+    def append(self, record):
+        self.extend([record])
+
+    def extend(self, records):
+        self.history.extend(dict(record, username=self.username) for record in records)
+
+    def iter_records(self, newest_first=False):
+        for _, record in self.iter_with_offsets(newest_first):
+            yield record
+
+    def iter_with_offsets(self, newest_first=False):
+        order = "DESC" if newest_first else "ASC"
+        for row_id, record in self.connection.execute(
+                f"SELECT id, record FROM purchase_history WHERE username IS ? ORDER BY id {order}", (self.username,)):
+            yield row_id, json.loads(record)
+
+    def read_at(self, row_id):
+        row = self.connection.execute(
+            "SELECT record FROM purchase_history WHERE id = ? AND username IS ?", (row_id, self.username)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def iter_after(self, row_id):
+        for next_id, record in self.connection.execute(
+                "SELECT id, record FROM purchase_history WHERE username IS ? AND id > ? ORDER BY id", (self.username, row_id)):
+            yield next_id, json.loads(record)
+
+    @timed
+    def order_index(self):
+        if self.index is None:
+            self.index = OrderIndex()
+        return self.index.refresh(self)
+
+    def iter_between(self, start=None, end=None, newest_first=False):
+        return self.history.select_between("username IS ? AND ", (self.username,), start, end, newest_first)
+
+
+def open_storage():
+    if config.storage_backend == "sqlite":
+        return SQLiteStorage()
+    return JSONStorage()
+
+
+# Copy the JSON files (catalog, users, purchase history) into the SQLite database
+def import_json_into_sqlite(database_file=None):
+    source = JSONStorage()
+    target = SQLiteStorage(database_file)
+    if target.catalog_store.exists() or len(target.history):
+        raise ValueError(f"{target.database_file} already has data; import into a new database file")
+
+    with target.transaction():
+        products = source.catalog_store.load() if source.catalog_store.exists() else []
+        target.catalog_store.create(products)
+
+        user_file = source.user_store()
+        if user_file.exists():
+            target.user_store().create(user_file.load())
+
+        batch = []
+        for record in source.history.iter_records():
+            batch.append(record)
+            if len(batch) >= 1000:
+                target.history.extend(batch)
+                batch = []
+        target.history.extend(batch)
+
+    return target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Storage backend tools.")
+    parser.add_argument("command", choices=["import-json", "upgrade-timestamps"])
+    parser.add_argument("--database", default=config.sqlite_file)
+    args = parser.parse_args()
+
+    if args.command == "upgrade-timestamps":
+        # Whichever backend config.py selects: add epoch seconds to older history records
+        storage = SQLiteStorage(args.database) if config.storage_backend == "sqlite" else JSONStorage()
+        print(f"Added epoch timestamps to {storage.history.upgrade_timestamps()} history records")
+        raise SystemExit(0)
+
+    try:
+        storage = import_json_into_sqlite(args.database)
+    except ValueError as e:
+        print(f"\033[31m {e}\033[0m")
+        raise SystemExit(1)
+    print(f"Imported {len(storage.catalog_store.load())} products and {len(storage.history)} history records into {storage.database_file}")
@@ -1,24 +1,40 @@
-import json
-import os
-import config
+import argparse
+import builtins
+from uuid import uuid4
 from catalog import Catalog
-from admin import Admin
+from storage import open_storage
+from metrics import timed
+from menu import EXIT, Menu, MenuMachine, ScriptedInput
 from datetime import datetime
 
 
 class Store():
 
     def __init__(self):
-        self.user_file = config.user_files
-        self.users = self.load_users()
+        self.storage = open_storage()
+        # Shared with Admin; users are read one bucket at a time, when someone logs in or registers
+        self.user_store = self.storage.user_store()
+        self.load_users()
         self.current_user = None
 
         self.cart = {}
-        self.catalog = Catalog(self)
-        self.admin = Admin(self.catalog.catalog)
-
+        # Key of this session's stock reservations
+        self.cart_id = uuid4().hex
+        self.catalog = Catalog(self, self.storage)
+        # Created on first use by an admin
+        self.admin_instance = None
+
+    # Admin pages are only built (and admin.py only imported) when an admin opens them
+    @property
+    def admin(self):
+        if self.admin_instance is None:
+            from admin import Admin
+            self.admin_instance = Admin(self.catalog.catalog, self.storage)
+        return self.admin_instance
+
+    @timed
     def load_users(self):
-        if not os.path.exists(self.user_file):
+        if not self.user_store.exists():
             # Create default admin user
             default_admin_user = {
                 "admin": {
@@ -26,145 +42,121 @@ class Store():
                     "role": "admin",
                 }
             }
-            with open(self.user_file, 'w') as f:
-                json.dump(default_admin_user, f, indent=4)
-            return default_admin_user
-
-        with open(self.user_file, 'r') as f:
-            return json.load(f)
-
-    def save_users(self):
-        with open(self.user_file, 'w') as f:
-            json.dump(self.users, f, indent=4)
+            self.user_store.create(default_admin_user)
 
-    # Login Function
+    # Login Function (returns the next menu state)
     def login(self):
         print("\n\033[1;95m----------  Login Page ----------\033[0m")
         username = input("\n\033[1m  Username: \033[0m")
         password = input("\033[1m  Password: \033[0m")
 
-        user = self.users.get(username)
+        # Reads only the user's bucket (cached; re-read only after another session wrote it)
+        user = self.user_store.get(username)
         if user and user['password'] == password:
             print(f'\n\033[34m Welcome {username}! You are now logged in.\033[0m')
             self.current_user = {"username": username, "role": user['role']}
-            self.user_menu()
-        else:
-            print("\n\033[31m Invalid Username or Password. Please try again!\033[0m")
-            # Returning to main menu
-            self.main_menu()
+            return user['role']
+
+        print("\n\033[31m Invalid Username or Password. Please try again!\033[0m")
+        # Returning to main menu
+        return "main"
 
-    # Register New User Function
+    # Register New User Function (returns the next menu state)
     def register_new_user(self):
         print("\n\033[1;95m----------  Register Page ----------\033[0m")
         username = input("\n\033[1m  Enter Username : \033[0m")
 
-        if username in self.users:
+        if self.user_store.get(username):
             print("\n\033[31m Username Already Exists.\033[0m")
             # Returning to main menu
-            self.main_menu()
+            return "main"
 
         password = input("\033[1m  Enter Password: \033[0m")
 
-        self.users[username] = {
+        new_user = {
             "password": password,
             "role": "user", # When registering, default role is normal user
             "registered_date": datetime.now().strftime("%m/%d/%Y %I:%M%p")
         }
-        self.save_users()
+        # One appended log entry in one bucket, not a rewrite of every user
+        if not self.user_store.add(username, new_user):
+            print("\n\033[31m Username Already Exists.\033[0m")
+            return "main"
 
         print(f'\n\033[34m User "{username}" registered successfully.\033[0m')
-        self.login()
+        return "login"
+
+    # Logout: the next user starts with no session and an empty cart
+    def logout(self):
+        print("\n\033[33m Logging out... \nReturning to Main Menu...\033[0m")
+        self.current_user = None
+        self.catalog.orders.release_cart(self.cart_id, self.cart)
+        self.cart.clear()
 
     # Exit from the Page Function
     def exit_page(self):
         print("\n\033[33mExiting from the System...\033[0m")
-        exit()
 
-    # Display Main Menu
+    # Menu states and transitions; option actions run and then the listed state is shown
+    def build_states(self):
+        main_header = [
+            "\n\033[1;95m==========   Welcome to the Sakura Clothing Store   ️==========\033[0m",
+            "\n\033[1mPlease select from the following options:\033[0m"
+        ]
+        user_header = ["\n\033[1;95m---------- User Menu Page ----------\033[0m\n"]
+        admin_header = ["\n\033[1;95m---------- Admin Menu Page ----------\033[0m\n"]
+
+        return {
+            "main": Menu("main", main_header, [
+                ("Login", None, "login"),
+                ("Register", None, "register"),
+                ("Exit", self.exit_page, EXIT),
+            ]),
+            "login": self.login,
+            "register": self.register_new_user,
+            "user": Menu("user", user_header, [
+                ("View Catalog", self.catalog.view_catalog, "user"),
+                ("Purchase History", self.catalog.view_purchase_history, "user"),
+                ("View Cart", self.catalog.view_cart, "user"),
+                ("Return Item", self.catalog.return_items, "user"),
+                ("Logout", self.logout, "main"),
+            ]),
+            # Admin actions go through self.admin so the Admin object is only built when used
+            "admin": Menu("admin", admin_header, [
+                ("Add Users", lambda: self.admin.add_users(), "admin"),
+                ("View User Details", lambda: self.admin.view_registered_users(), "admin"),
+                ("Add Product", lambda: self.admin.add_products(), "admin"),
+                ("Edit Catalog", lambda: self.admin.edit_products(), "admin"),
+                ("Delete Items", lambda: self.admin.delete_products(), "admin"),
+                ("View Catalog", self.catalog.view_catalog, "admin"),
+                ("View Catalog Insight", lambda: self.admin.view_catalog_insights(), "admin"),
+                ("Monitor Stock", lambda: self.admin.monitor_stock(), "admin"),
+                ("Logout", self.logout, "main"),
+                ("Performance Metrics", lambda: self.admin.view_metrics(), "admin"),
+                ("Bulk Import Products", lambda: self.admin.import_products(), "admin"),
+                ("Export Products", lambda: self.admin.export_products(), "admin"),
+                ("Sales Reports", lambda: self.admin.sales_reports(), "admin"),
+                ("Set Stock Threshold", lambda: self.admin.set_stock_threshold(), "admin"),
+            ]),
+        }
+
+    # Run the store until Exit (or the end of input)
     def main_menu(self):
-        print("\n\033[1;95m==========   Welcome to the Sakura Clothing Store   ️==========\033[0m")
-        print("\n\033[1mPlease select from the following options:\033[0m")
-        print("\t1. Login")
-        print("\t2. Register")
-        print("\t3. Exit")
-
-        # Get User Choice
-        choice = input("\n\033[1m  Enter your choice: \033[0m")
-        if choice == "1":
-            self.login()
-        elif choice == "2":
-            self.register_new_user()
-        elif choice == "3":
-            self.exit_page()
-        else:
-            print("\n\033[31m Sorry, invalid option. Please try again.\033[0m")
-            self.main_menu()
-
-    # Display User Menu After Logged in
-    def user_menu(self):
-        role = self.current_user['role']
-        while True:
-
-            print(f'\n\033[1;95m---------- {role.title()} Menu Page ----------\033[0m\n')
-            if role == "user":
-                print("\t1.  View Catalog")
-                print("\t2.  Purchase History")
-                print("\t3.  View Cart")
-                print("\t4.  Return Item")
-                print("\t5.  Logout")
-
-                # Get User Choice
-                choice = input("\n\033[1m  Enter your choice: \033[0m")
-                if choice == "1":
-                    self.catalog.view_catalog()
-                elif choice == "2":
-                    self.catalog.view_purchase_history()
-                elif choice == "3":
-                    self.catalog.view_cart()
-                elif choice == "4":
-                    self.catalog.return_items()
-                elif choice == "5":
-                    print("\n\033[33m Logging out... \nReturning to Main Menu...\033[0m")
-                    # Returning to main menu
-                    self.main_menu()
-                else:
-                    print("\n\033[31m Sorry, invalid option. Please try again.\033[0m")
-            elif role == "admin":
-                while True:
-                    print("\n1.  Add Users")
-                    print("2.  View User Details")
-                    print("3.  Add Product")
-                    print("4.  Edit Catalog")
-                    print("5.  Delete Items")
-                    print("6.  View Catalog")
-                    print("7.  View Catalog Insight")
-                    print("8.  Monitor Stock")
-                    print("9.  Logout")
-
-                    admin_choice = input("\n\033[1m  Enter your choice: \033[0m")
-                    if admin_choice == "1":
-                        self.admin.add_users()
-                    elif admin_choice == "2":
-                        self.admin.view_registered_users()
-                    elif admin_choice == "3":
-                        self.admin.add_products()
-                    elif admin_choice == "4":
-                        self.admin.edit_products()
-                    elif admin_choice == "5":
-                        self.admin.delete_products()
-                    elif admin_choice == "6":
-                        self.catalog.view_catalog()
-                    elif admin_choice == "7":
-                        self.admin.view_catalog_insights()
-                    elif admin_choice == "8":
-                        self.admin.monitor_stock()
-                    elif admin_choice == "9":
-                        print("\n\033[33m Logging out... \nReturning to Main Menu...\033[0m")
-                        # Returning to main menu
-                        self.main_menu()
-                    else:
-                        print("\n\033[31m Sorry, invalid option. Please try again.\033[0m")
+        machine = MenuMachine(self.build_states(), "main")
+        machine.run()
+        return machine
+
 
 if __name__ == "__main__":
-        app = Store()
-        app.main_menu()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sakura Clothing Store")
+    parser.add_argument("--script", help="Answer prompts from this file (one answer per line) instead of the keyboard")
+    parser.add_argument("--repeat", type=int, default=1, help="Play the script this many times (soak runs)")
+    args = parser.parse_args()
+
+    if args.script:
+        builtins.input = ScriptedInput.from_file(args.script, args.repeat)
+
+    app = Store()
+    machine = app.main_menu()
+    if args.script:
+        print(f"\nScripted run finished: {machine.transitions} transitions, {builtins.input.answered} answers, max stack depth {machine.max_depth}")
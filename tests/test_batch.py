@@ -0,0 +1,46 @@
+import json
+
+from batch import BatchOrderProcessor
+from catalog import Catalog
+
+# The default catalog has T-Shirt S:3 M:4 L:3, Jeans M:2 L:2 XL:1 and Jacket M:1 L:2
+
+
+def order_lines(*orders):
+    return [json.dumps({"request_id": number, "username": "batch", "items": items}) for number, items in enumerate(orders, start=1)]
+
+
+def test_batch_rolls_back_orders_sold_by_another_session(data_dir):
+    processor = BatchOrderProcessor(Catalog(None))
+    shopper = Catalog(None)
+    cart = {}
+    shopper.add_cart_line(cart, shopper.catalog.get(1), "M", 4)
+    assert shopper.orders.checkout("a", cart, lambda cart: shopper.build_purchase_record(cart, "shopper"))[1] is None
+
+    # The batch session still sees M:4
+    outcomes, summary = processor.process(order_lines(
+        [{"id": 1, "size": "M", "quantity": 3}],
+        [{"id": 2, "size": "L", "quantity": 1}],
+    ))
+    assert [outcome["status"] for outcome in outcomes] == ["rejected", "accepted"]
+    assert (summary["accepted"], summary["rejected"]) == (1, 1)
+
+    saved = Catalog(None)
+    assert saved.catalog.get(1)["stock"]["M"] == 0
+    assert saved.catalog.get(2)["stock"]["L"] == 1
+    assert len(list(saved.purchase_history.iter_between())) == 2
+
+
+def test_lines_for_the_same_size_add_up(data_dir):
+    outcomes, _ = BatchOrderProcessor(Catalog(None)).process(order_lines(
+        [{"id": 1, "size": "S", "quantity": 1}, {"id": 1, "size": "s", "quantity": 2}],
+        [{"id": 3, "size": "L", "quantity": 2}, {"id": 3, "size": "L", "quantity": 1}],
+        [{"id": 2, "size": "M", "quantity": 3}, {"id": 2, "size": "M", "quantity": -2}],
+    ))
+    assert [outcome["status"] for outcome in outcomes] == ["accepted", "rejected", "rejected"]
+
+    saved = Catalog(None)
+    assert saved.catalog.get(1)["stock"]["S"] == 0
+    assert dict(saved.catalog.get(3)["stock"]) == {"M": 1, "L": 2}
+    record = next(saved.purchase_history.iter_between())
+    assert [(item["size"], item["quantity"]) for item in record["items"]] == [("S", 3)]
@@ -0,0 +1,30 @@
+import pytest
+
+from bulk import ProductImporter, parse_stock
+from catalog import Catalog
+
+
+def test_parse_stock_bounds_quantities():
+    assert parse_stock("S:3|m=1000000") == {"S": 3, "M": 1000000}
+    with pytest.raises(ValueError):
+        parse_stock("S:1000001")
+    with pytest.raises(ValueError):
+        parse_stock({"M": 2 ** 64})
+
+
+def test_huge_quantity_row_is_reported(data_dir):
+    with open("products.csv", 'w') as f:
+        f.write("id,name,price,sizes,stock\n")
+        f.write("10,Scarf,900,M,M:5\n")
+        f.write(f"11,Gloves,700,M,M:{2 ** 64}\n")
+        f.write(f"1,,,,M:{2 ** 40}\n")
+
+    session = Catalog(None)
+    report = ProductImporter(session.catalog, session.storage, upsert=True).import_file("products.csv")
+    assert (report["added"], report["updated"]) == (1, 0)
+    assert [line for line, _ in report["errors"]] == [3, 4]
+
+    saved = Catalog(None).catalog
+    assert dict(saved.get(10)["stock"]) == {"M": 5}
+    assert saved.get(11) is None
+    assert saved.get(1)["stock"]["M"] == 4
@@ -0,0 +1,49 @@
+import os
+
+from history import ShardedPurchaseHistory, timestamp_fields
+
+
+def purchase(username, epoch):
+    return {"order_id": f"{username}-{epoch}", "username": username, **timestamp_fields(epoch), "type": "purchase", "items": []}
+
+
+def order_ids(records):
+    return [record["order_id"] for record in records]
+
+
+def test_range_across_shards_uses_one_index(data_dir):
+    history = ShardedPurchaseHistory()
+    history.extend([purchase("alice", 100), purchase("bob", 200), purchase(None, 300)])
+    history.append(purchase("alice", 400))
+    # Older than the newest record (clock change): still found in time order
+    history.append(purchase("carol", 250))
+
+    assert order_ids(history.iter_between(200, 400)) == ["bob-200", "carol-250", "None-300"]
+    assert order_ids(history.iter_between(None, 250, newest_first=True)) == ["bob-200", "alice-100"]
+    assert order_ids(history.iter_between(400)) == ["alice-400"]
+    assert not [name for name in os.listdir(history.directory) if name.endswith(".tidx")]
+
+
+def test_other_sessions_appends_are_found(data_dir):
+    first, second = ShardedPurchaseHistory(), ShardedPurchaseHistory()
+    assert order_ids(first.iter_between()) == []
+
+    second.extend([purchase("bob", 200), purchase("dave", 100)])
+    first.append(purchase("alice", 300))
+
+    assert order_ids(first.iter_between()) == ["dave-100", "bob-200", "alice-300"]
+    assert order_ids(second.iter_between()) == ["dave-100", "bob-200", "alice-300"]
+
+
+def test_missing_index_is_rebuilt_from_the_shards(data_dir):
+    history = ShardedPurchaseHistory()
+    history.extend([purchase("alice", 300), purchase("bob", 100)])
+    os.remove(history.times.path)
+    with open(os.path.join(history.directory, "bob.jsonl.tidx"), 'wb'):
+        pass
+
+    reopened = ShardedPurchaseHistory()
+    assert order_ids(reopened.iter_between()) == ["bob-100", "alice-300"]
+    reopened.append(purchase("bob", 200))
+    assert order_ids(ShardedPurchaseHistory().iter_between(150)) == ["bob-200", "alice-300"]
+    assert not os.path.exists(os.path.join(history.directory, "bob.jsonl.tidx"))
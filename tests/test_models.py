@@ -0,0 +1,25 @@
+import pytest
+
+from inventory import ProductCatalog
+from models import Product
+
+
+def test_large_stock_fits_and_overflow_raises():
+    product = Product(1, "T-Shirt", 2500.0, ["M"], {"M": 2 ** 40})
+    assert product["stock"]["M"] == 2 ** 40
+    with pytest.raises(OverflowError):
+        Product(2, "Jeans", 4890.0, ["M"], {"M": 2 ** 64})
+
+
+def test_failed_update_changes_nothing():
+    catalog = ProductCatalog([{"id": 1, "name": "T-Shirt", "price": 2500.0, "sizes": ["S", "M"], "stock": {"S": 3, "M": 4}}])
+    product = catalog.get(1)
+    units = catalog.totals.total_units
+
+    with pytest.raises(OverflowError):
+        catalog.update(product, name="Polo", price=1999.0, sizes=["S", "M", "L"], stock={"S": 3, "M": 4, "L": 10 ** 30})
+
+    assert product.to_dict() == {"id": 1, "name": "T-Shirt", "price": 2500.0, "sizes": ["S", "M"], "stock": {"S": 3, "M": 4}}
+    assert catalog.find_by_name("T-Shirt") is product
+    assert catalog.find_by_name("Polo") is None
+    assert catalog.totals.total_units == units
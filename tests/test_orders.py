@@ -0,0 +1,76 @@
+import threading
+
+from catalog import Catalog
+
+# Two store sessions (like two terminals) share one data folder; the default catalog has
+# T-Shirt S:3 M:4 L:3, Jeans M:2 L:2 XL:1 and Jacket M:1 L:2
+
+
+def buy(session, cart_id, lines):
+    cart = {}
+    for product_id, size, quantity in lines:
+        session.add_cart_line(cart, session.catalog.get(product_id), size, quantity)
+    return session.orders.checkout(cart_id, cart, lambda cart: session.build_purchase_record(cart, "shopper"))
+
+
+def saved_stock(product_id):
+    return dict(Catalog(None).catalog.get(product_id)["stock"])
+
+
+def test_concurrent_checkouts_add_up(data_dir):
+    first, second = Catalog(None), Catalog(None)
+
+    assert buy(first, "a", [(1, "M", 1), (2, "L", 1)])[1] is None
+    assert buy(second, "b", [(1, "M", 2), (1, "S", 1)])[1] is None
+    assert buy(first, "c", [(1, "L", 1)])[1] is None
+
+    assert saved_stock(1) == {"S": 2, "M": 1, "L": 2}
+    assert saved_stock(2) == {"M": 2, "L": 1, "XL": 1}
+    assert len(list(Catalog(None).purchase_history.iter_between())) == 3
+
+
+def test_edit_keeps_concurrent_checkout(data_dir):
+    editor, shopper = Catalog(None), Catalog(None)
+
+    editor.catalog.update(editor.catalog.get(3), price=6900.0)
+    assert buy(shopper, "a", [(3, "M", 1), (3, "L", 1)])[1] is None
+    editor.save_catalog()
+
+    saved = Catalog(None).catalog.get(3)
+    assert saved["price"] == 6900.0
+    assert dict(saved["stock"]) == {"M": 0, "L": 1}
+
+
+def test_stale_session_cannot_oversell(data_dir):
+    first, second = Catalog(None), Catalog(None)
+
+    assert buy(first, "a", [(1, "M", 4)])[1] is None
+    # The second session still sees M:4; its cart is rolled back when it saves
+    record, error = buy(second, "b", [(1, "M", 3), (1, "S", 1)])
+    assert record is None and error
+    assert dict(second.catalog.get(1)["stock"]) == {"S": 3, "M": 0, "L": 3}
+    assert saved_stock(1) == {"S": 3, "M": 0, "L": 3}
+
+
+def test_threaded_sessions_never_go_negative(data_dir):
+    sessions = [Catalog(None), Catalog(None)]
+    sold = []
+    sold_lock = threading.Lock()
+
+    def shopper(number):
+        session = sessions[number % 2]
+        record, error = buy(session, f"cart-{number}", [(2, "M", 1), (3, "L", 1)])
+        if error is None:
+            with sold_lock:
+                sold.append(record)
+
+    threads = [threading.Thread(target=shopper, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Jeans M:2 limits the orders to two
+    assert len(sold) == 2
+    assert saved_stock(2) == {"M": 0, "L": 2, "XL": 1}
+    assert saved_stock(3) == {"M": 1, "L": 0}
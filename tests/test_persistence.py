@@ -0,0 +1,103 @@
+import pytest
+
+import config
+from inventory import ProductCatalog
+from persistence import CatalogFile
+from storage import SQLiteStorage
+
+PRODUCTS = [
+    {"id": 1, "name": "T-Shirt", "price": 2500.0, "sizes": ["S", "M", "L"], "stock": {"S": 3, "M": 2, "L": 3}},
+    {"id": 2, "name": "Jeans", "price": 4890.0, "sizes": ["M", "L"], "stock": {"M": 2, "L": 2}},
+]
+
+
+# Opens one session (its own store and in-memory catalog) on the shared catalog
+def json_session(compact_threshold):
+    def open_session():
+        store = CatalogFile(config.catalog_file, compact_threshold=compact_threshold)
+        catalog = ProductCatalog(store.load())
+        store.attach(catalog)
+        return store, catalog
+    return open_session
+
+
+def sqlite_session():
+    store = SQLiteStorage().catalog_store
+    catalog = ProductCatalog(store.load())
+    store.attach(catalog)
+    return store, catalog
+
+
+# Journal appends, a compaction on every save, and SQLite rows
+@pytest.fixture(params=["journal", "compacting", "sqlite"])
+def open_session(request, data_dir):
+    if request.param == "sqlite":
+        SQLiteStorage().catalog_store.create(PRODUCTS)
+        return sqlite_session
+    CatalogFile(config.catalog_file).create(PRODUCTS)
+    return json_session(1 if request.param == "compacting" else None)
+
+
+def saved_product(open_session, product_id):
+    return open_session()[1].get(product_id)
+
+
+@pytest.mark.parametrize("editor_saves_first", [False, True])
+def test_upsert_keeps_concurrent_sale(open_session, editor_saves_first):
+    editor_store, editor = open_session()
+    seller_store, seller = open_session()
+
+    editor.update(editor.get(1), price=2000.0)
+    seller.adjust_stock(seller.get(1), "M", -1)
+    seller.adjust_stock(seller.get(1), "L", -1)
+    if editor_saves_first:
+        editor_store.save()
+        seller_store.save()
+    else:
+        seller_store.save()
+        editor_store.save()
+
+    product = saved_product(open_session, 1)
+    assert product["price"] == 2000.0
+    assert dict(product["stock"]) == {"S": 3, "M": 1, "L": 2}
+    if not editor_saves_first:
+        # The editor caught up with the sale while saving
+        assert dict(editor.get(1)["stock"]) == {"S": 3, "M": 1, "L": 2}
+
+
+def test_restock_edit_adds_to_concurrent_sale(open_session):
+    editor_store, editor = open_session()
+    seller_store, seller = open_session()
+
+    editor.update(editor.get(1), stock={"S": 3, "M": 5, "L": 3})
+    seller.adjust_stock(seller.get(1), "M", -1)
+    seller_store.save()
+    editor_store.save()
+
+    assert dict(saved_product(open_session, 1)["stock"]) == {"S": 3, "M": 4, "L": 3}
+
+
+def test_edit_after_other_session_edit_keeps_both_sales(open_session):
+    first_store, first = open_session()
+    second_store, second = open_session()
+
+    first.update(first.get(2), name="Slim Jeans")
+    first.adjust_stock(first.get(2), "M", -1)
+    second.update(second.get(2), price=3990.0)
+    second.adjust_stock(second.get(2), "L", -2)
+    first_store.save()
+    second_store.save()
+
+    product = saved_product(open_session, 2)
+    # The later edit wins for name and price; every sale is kept
+    assert (product["name"], product["price"]) == ("Jeans", 3990.0)
+    assert dict(product["stock"]) == {"M": 1, "L": 0}
+
+
+def test_new_product_keeps_its_stock(open_session):
+    store, catalog = open_session()
+    catalog.add({"id": 3, "name": "Jacket", "price": 7600.0, "sizes": ["M"], "stock": {"M": 4}})
+    catalog.adjust_stock(catalog.get(3), "M", -1)
+    store.save()
+
+    assert dict(saved_product(open_session, 3)["stock"]) == {"M": 3}
@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+import config
+from pricing import PriceBook, PricingEngine
+
+SHIRT = {"id": 1, "name": "T-Shirt", "price": 2500.0, "sizes": ["S", "M"], "stock": {"S": 3, "M": 4}}
+
+
+def line_cart(product, size, quantity):
+    return {(product["id"], size): {"product": product, "size": size, "quantity": quantity}}
+
+
+def test_bad_rules_are_skipped_and_reported():
+    book = PriceBook([
+        {"type": "price", "product_id": 1, "size": "M", "price": 2000},
+        {"type": "price", "product_id": 1, "price": "cheap"},
+        {"type": "percent_off", "product_id": 1},
+        {"type": "buy_x_get_y", "product_id": 1, "buy": "two", "get": 1},
+        {"type": "percent_off", "product_id": [1], "percent": 10},
+        {"type": "cart_threshold", "min_total": "Infinity", "percent": 5},
+        "10% off",
+        {"type": "free_lunch"},
+    ])
+    assert book.prices == {(1, "M"): 200000}
+    assert [error.split(":")[0] for error in book.errors] == [f"Rule {number}" for number in range(2, 9)]
+
+
+def test_size_rule_for_every_product():
+    book = PriceBook([
+        {"type": "percent_off", "size": "S", "percent": 20},
+        {"type": "percent_off", "percent": 5},
+        {"type": "percent_off", "product_id": 2, "percent": 10},
+    ])
+    assert book.price_line(SHIRT, "S", 1)[2] == 50000
+    assert book.price_line(SHIRT, "M", 1)[2] == 12500
+    # A product's own rule is more specific than a size rule for every product
+    assert book.price_line(dict(SHIRT, id=2), "S", 1)[2] == 25000
+
+
+def write_promotions(rules):
+    with open(config.promotions_file, 'w') as f:
+        f.write(rules if isinstance(rules, str) else json.dumps(rules))
+    # A new size or mtime marks the file as changed
+    stat = os.stat(config.promotions_file)
+    os.utime(config.promotions_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+
+def test_broken_file_keeps_last_promotions(data_dir):
+    engine = PricingEngine()
+    write_promotions([{"type": "percent_off", "product_id": 1, "percent": 10}])
+    assert engine.price_cart(line_cart(SHIRT, "M", 1)).total_cents == 225000
+
+    write_promotions('[{"type": "percent_off", "product_id": 1, "perc')
+    assert engine.price_cart(line_cart(SHIRT, "M", 1)).total_cents == 225000
+
+    write_promotions({"type": "price"})
+    assert engine.price_cart(line_cart(SHIRT, "M", 1)).total_cents == 225000
+
+    write_promotions([])
+    assert engine.price_cart(line_cart(SHIRT, "M", 1)).total_cents == 250000
+
+
+def test_pricing_error_leaves_stock_untouched(data_dir):
+    from catalog import Catalog
+
+    session = Catalog(None)
+    cart = {}
+    session.add_cart_line(cart, session.catalog.get(1), "M", 2)
+
+    def failing_record(cart):
+        raise ArithmeticError("pricing failed")
+
+    with pytest.raises(ArithmeticError):
+        session.orders.checkout("a", cart, failing_record)
+    assert session.catalog.get(1)["stock"]["M"] == 4
+    assert Catalog(None).catalog.get(1)["stock"]["M"] == 4
@@ -0,0 +1,24 @@
+from history import ShardedPurchaseHistory, timestamp_fields
+from restock import DAY_SECONDS, RollingSales
+
+NOW = 1_700_000_000
+
+
+def sale(epoch, size, quantity, kind="purchase"):
+    return {"username": "shopper", **timestamp_fields(epoch), "type": kind, "items": [{"product_id": 1, "size": size, "quantity": quantity}]}
+
+
+def test_rolling_counts_follow_appends_and_expire(data_dir):
+    history = ShardedPurchaseHistory()
+    history.extend([sale(NOW - 40 * DAY_SECONDS, "M", 9), sale(NOW - 29 * DAY_SECONDS, "M", 6), sale(NOW - DAY_SECONDS, "L", 3)])
+
+    sales = RollingSales(history, days=30, now=NOW)
+    assert sales.velocity() == {(1, "M"): 0.2, (1, "L"): 0.1}
+
+    history.extend([sale(NOW, "M", 3), sale(NOW, "L", 3, kind="return")])
+    assert sales.per_day(1, "M") == 0.3
+    assert sales.per_day(1, "L") == 0.0
+
+    # Two days later the sale from 29 days ago has left the window
+    sales.expire(NOW + 2 * DAY_SECONDS)
+    assert sales.velocity() == {(1, "M"): 0.1}
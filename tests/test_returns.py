@@ -0,0 +1,51 @@
+import builtins
+from types import SimpleNamespace
+
+from catalog import Catalog
+
+
+def session():
+    return Catalog(SimpleNamespace(current_user={"username": "alice"}, cart={}, cart_id="cart"))
+
+
+def answer(monkeypatch, *answers):
+    answers = iter(answers)
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(answers)())
+
+
+def buy_shirts(shopper, quantity):
+    cart = {}
+    shopper.add_cart_line(cart, shopper.catalog.get(1), "M", quantity)
+    record, error = shopper.orders.checkout("cart", cart, shopper.build_purchase_record)
+    assert error is None
+    return record
+
+
+def test_order_index_finds_lines_by_order_and_product(data_dir):
+    shopper = session()
+    record = buy_shirts(shopper, 3)
+    history = shopper.user_history()
+    index = history.order_index()
+
+    assert index.lines_for(1, "M") == {(record["order_id"], 1)}
+    assert index.find_line(history, record["order_id"], 1, 1, "M")["quantity"] == 3
+    assert index.find_line(history, record["order_id"], 1, 1, "L") is None
+    assert index.find_line(history, "no-such-order", 1) is None
+
+
+def test_return_rechecks_what_another_session_returned(data_dir, monkeypatch):
+    first, second = session(), session()
+    buy_shirts(first, 3)
+
+    def return_two_elsewhere():
+        answer(monkeypatch, lambda: "0", lambda: "2")
+        first.return_items()
+        # Back in the second session, which listed 3 returnable shirts
+        return "2"
+
+    answer(monkeypatch, lambda: "0", return_two_elsewhere)
+    second.return_items()
+
+    returns = [record for record in second.user_history().iter_records() if record["type"] == "return"]
+    assert [item["quantity"] for record in returns for item in record["items"]] == [2]
+    assert Catalog(None).catalog.get(1)["stock"]["M"] == 3